@@ -0,0 +1,48 @@
+import utime
+
+_CONVERSION = 0
+_CONFIG = 1
+
+# PGA full scale, mV
+GAIN_6144 = 0
+GAIN_4096 = 1
+GAIN_2048 = 2
+
+
+class ADS1115:
+    """TI ADS1115 16 bit I2C ADC, single shot conversions at 860 samples/s"""
+
+    def __init__(self, i2c, addr=0x48, gain=GAIN_6144):
+        self.i2c = i2c
+        self.addr = addr
+        self.gain = gain
+        self._buf = bytearray(2)
+
+    def read_channel(self, channel):
+        """single ended AIN0..AIN3, raw 0..32767"""
+        # OS start | MUX AINx vs GND | PGA | single shot | 860 SPS | comparator off
+        config = 0x8000 | (4 + channel) << 12 | self.gain << 9 | 0x0100 | 0x00e0 | 0x0003
+        buf = self._buf
+        buf[0] = config >> 8
+        buf[1] = config & 0xff
+        self.i2c.writeto_mem(self.addr, _CONFIG, buf)
+        # one conversion is 1.16 ms at 860 SPS
+        utime.sleep_us(1200)
+        self.i2c.readfrom_mem_into(self.addr, _CONVERSION, buf)
+        value = buf[0] << 8 | buf[1]
+        # below ground reads as a small negative number
+        return 0 if value & 0x8000 else value
+
+    def channel(self, channel):
+        return Channel(self, channel)
+
+
+class Channel:
+    """one input with the machine.ADC read() interface, scaled to 10 bits for the calibration table"""
+
+    def __init__(self, adc, channel):
+        self.adc = adc
+        self.channel = channel
+
+    def read(self):
+        return self.adc.read_channel(self.channel) >> 5
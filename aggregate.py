@@ -0,0 +1,153 @@
+from array import array
+
+import ustruct as struct
+import utime
+
+# fields of a window
+START = 0       # ticks_ms
+ELAPSED = 1     # ms, set when the window closes
+COUNT = 2       # readings
+MIN = 3         # deci-bars
+MAX = 4
+SUM = 5
+PUMP_MS = 6     # time the pump ran
+SWITCHES = 7    # relay changes
+FIELDS = 8
+
+# summary flags
+FLAG_RUNNING = 1    # the window is still open, an answer to <board_id>/cmd/summary
+
+VERSION = 1
+FORMAT = "<BBIIIhhhIH"  # version, flags, window s, elapsed s, readings, min, max, mean, pump on s, switches
+SIZE = struct.calcsize(FORMAT)
+NAMES = ("window_s", "elapsed_s", "readings", "min", "max", "mean", "pump_on_s", "switches")
+
+
+class Aggregator:
+    """Min, max, mean, reading count, pump on time and relay switches over tiered windows
+
+    add() is called with every reading pressure_check takes and only updates
+    the shortest window; when it closes it is folded into the next tier and
+    so on, the work per reading does not depend on the number of tiers. The
+    last closed window of every tier stays in `closed` until it is
+    published, `pending` has one bit per tier waiting.
+    """
+
+    def __init__(self, windows_s=(60, 900, 3600)):
+        self.tiers = len(windows_s)
+        self.length = array('i', [s * 1000 for s in windows_s])
+        self.current = array('i', [0] * (self.tiers * FIELDS))
+        self.closed = array('i', [0] * (self.tiers * FIELDS))
+        self.pending = 0
+        self._prev = None       # ticks_ms of the previous reading
+        self._pump = False      # pump state at the previous reading
+        self._view = array('i', [0] * FIELDS)
+        self._buf = bytearray(SIZE)
+
+    def add(self, now, dbar, pump_on):
+        """a reading taken at utime.ticks_ms() == now, return the pending bits"""
+        cur = self.current
+        if self._prev is None:
+            for tier in range(self.tiers):
+                cur[tier * FIELDS + START] = now
+            self._prev = now
+            self._pump = pump_on
+        length = self.length[0]
+        end = utime.ticks_add(cur[START], length)
+        if utime.ticks_diff(now, end) >= 0:
+            if self._pump:
+                cur[PUMP_MS] += utime.ticks_diff(end, self._prev)
+            self._close(0, end)
+            if utime.ticks_diff(now, end) >= length:
+                # no reading for a whole window, start over at this one
+                end = now
+            cur[START] = end
+            self._prev = end
+        if self._pump:
+            cur[PUMP_MS] += utime.ticks_diff(now, self._prev)
+        self._prev = now
+        self._pump = pump_on
+        if cur[COUNT]:
+            if dbar < cur[MIN]:
+                cur[MIN] = dbar
+            elif dbar > cur[MAX]:
+                cur[MAX] = dbar
+        else:
+            cur[MIN] = cur[MAX] = dbar
+        cur[COUNT] += 1
+        cur[SUM] += dbar
+        return self.pending
+
+    def switched(self):
+        """the relay changed, see PumpController.pop_event"""
+        self.current[SWITCHES] += 1
+
+    def _close(self, tier, end):
+        cur = self.current
+        base = tier * FIELDS
+        cur[base + ELAPSED] = utime.ticks_diff(end, cur[base + START])
+        closed = self.closed
+        for i in range(base, base + FIELDS):
+            closed[i] = cur[i]
+        self.pending |= 1 << tier
+        if tier + 1 < self.tiers:
+            _fold(cur, base + FIELDS, cur, base)
+            if utime.ticks_diff(end, utime.ticks_add(cur[base + FIELDS + START], self.length[tier + 1])) >= 0:
+                self._close(tier + 1, end)
+        for i in range(base + 1, base + FIELDS):
+            cur[i] = 0
+        cur[base + START] = end
+
+    def running(self, tier, now):
+        """the open window of a tier with the readings of the shorter ones, valid until the next call"""
+        view = self._view
+        cur = self.current
+        base = tier * FIELDS
+        for i in range(FIELDS):
+            view[i] = cur[base + i]
+        for i in range(tier):
+            _fold(view, 0, cur, i * FIELDS)
+        view[ELAPSED] = utime.ticks_diff(now, view[START])
+        return view
+
+    def encode(self, tier, window=None, flags=0):
+        """summary payload of the last closed window of a tier, or of window
+
+        The buffer is valid until the next call.
+        """
+        w = 0
+        if window is None:
+            window = self.closed
+            w = tier * FIELDS
+        n = window[w + COUNT]
+        struct.pack_into(FORMAT, self._buf, 0, VERSION, flags, self.length[tier] // 1000,
+                         window[w + ELAPSED] // 1000, n, window[w + MIN], window[w + MAX],
+                         window[w + SUM] // n if n else 0, (window[w + PUMP_MS] + 500) // 1000,
+                         window[w + SWITCHES])
+        return self._buf
+
+
+def _fold(dst, d, src, s):
+    """add the window at src[s:] to the one at dst[d:]"""
+    n = src[s + COUNT]
+    if n:
+        if not dst[d + COUNT] or src[s + MIN] < dst[d + MIN]:
+            dst[d + MIN] = src[s + MIN]
+        if not dst[d + COUNT] or src[s + MAX] > dst[d + MAX]:
+            dst[d + MAX] = src[s + MAX]
+        dst[d + COUNT] += n
+        dst[d + SUM] += src[s + SUM]
+    dst[d + PUMP_MS] += src[s + PUMP_MS]
+    dst[d + SWITCHES] += src[s + SWITCHES]
+
+
+def decode(payload):
+    """summary payload to a dict, pressures in bars, for the consuming side"""
+    values = struct.unpack_from(FORMAT, payload, 0)
+    if values[0] != VERSION:
+        raise ValueError("unknown summary version {}".format(values[0]))
+    summary = dict(zip(NAMES, values[2:]))
+    for name in ("min", "max", "mean"):
+        summary[name] /= 10
+    summary["running"] = bool(values[1] & FLAG_RUNNING)
+    return summary
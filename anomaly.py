@@ -0,0 +1,176 @@
+from array import array
+
+import utime
+
+from events import EV_LEAK, EV_DRY_RUN
+
+# statistics
+GAIN = 0        # deci-bars per minute a run adds: rise while running minus the fall before the start
+FLOOR = 1       # lowest fall between two runs in a leak window, deci-bars per minute
+METRICS = 2
+# per metric
+N = 0
+MEAN = 1        # Welford mean and sum of squared differences
+M2 = 2
+EWMA = 3
+STATS = 4
+
+GAIN_ALPHA = 0.125      # EWMA weight of the last run, follows a pump that wears slowly
+DRY_FRACTION = 0.3      # a check window that adds less than that of the usual gain fails
+DRY_MIN_GAIN = 5        # deci-bars per minute, until the usual gain is learned
+DRY_CHECKS = 3          # failed windows in a row that make a dry run
+LEAK_LEARN = 3          # leak windows learned before EV_LEAK can fire
+LEAK_MIN = 1            # deci-bars per minute, the smallest floor rise that counts
+
+
+class CycleMonitor:
+    """Leak and dry run detection from pump cycle statistics
+
+    update() is called with every reading pressure_check takes: a few
+    comparisons, the statistics are updated once per check window or leak
+    window in a fixed array('f').
+
+    Dry run: every dry_ms while the pump runs the pressure must rise by
+    DRY_FRACTION of the usual gain of a run (an EWMA), measured against the
+    fall before the start, so a consumer that was already running does not
+    look like a dry well. One that starts with the pump and takes more than
+    it gives fails a window or two, EV_DRY_RUN needs DRY_CHECKS in a row.
+    There is no check until the fall has been measured once, after a stop.
+
+    Leak: a constant drain raises the lowest fall rate between two runs,
+    the quiet night hours. The floor of every leak window (a day) goes into
+    a Welford mean / variance; EV_LEAK fires when a floor is sigma standard
+    deviations and LEAK_MIN above it, once until the floor comes back.
+    """
+
+    def __init__(self, dry_ms=30000, sigma=3, learn_cycles=10, leak_window_ms=86400000):
+        self.dry_ms = dry_ms
+        self.sigma = sigma
+        self.learn_cycles = learn_cycles
+        self.leak_window_ms = leak_window_ms
+        self.stats = array('f', [0] * (METRICS * STATS))
+        self.cycles = 0
+        self.dry_runs = 0
+        self.leaks = 0
+        self._pump = False
+        self._on_at = 0
+        self._start = 0         # deci-bars at the start
+        self._off_at = None     # ticks_ms of the last stop, None before the first one
+        self._stop = 0          # deci-bars at the last stop
+        self._ref = None        # start of the current check window, deci-bars
+        self._ref_at = 0
+        self._fall = None       # deci-bars per minute over the last window before the start, < 0 falling
+        self._failed = 0        # dry check windows failed in a row
+        self._floor = None      # lowest fall rate between two runs in this leak window
+        self._window_at = None
+        self._leak = False
+
+    def update(self, now, dbar, pump_on):
+        """a reading taken at utime.ticks_ms() == now, return EV_LEAK / EV_DRY_RUN bits"""
+        ev = 0
+        if pump_on != self._pump:
+            self._pump = pump_on
+            if pump_on:
+                ev = self._started(now, dbar)
+            else:
+                self._stopped(now, dbar)
+            self._ref = dbar
+            self._ref_at = now
+            return ev
+        if self._ref is None:
+            self._ref = dbar
+            self._ref_at = now
+            return 0
+        elapsed = utime.ticks_diff(now, self._ref_at)
+        if elapsed < self.dry_ms:
+            return 0
+        rate = (dbar - self._ref) * 60000 / elapsed
+        self._ref = dbar
+        self._ref_at = now
+        if not pump_on:
+            # what a run has to make up for
+            self._fall = rate
+        elif self._fall is not None and self._failed < DRY_CHECKS:
+            if rate - self._fall < self._dry_limit():
+                self._failed += 1
+                if self._failed == DRY_CHECKS:
+                    self.dry_runs += 1
+                    ev = EV_DRY_RUN
+            else:
+                self._failed = 0
+        return ev
+
+    def _started(self, now, dbar):
+        self._on_at = now
+        self._start = dbar
+        self._failed = 0 if self.dry_ms else DRY_CHECKS
+        if self._window_at is None:
+            self._window_at = now
+        if self._off_at is not None:
+            idle = utime.ticks_diff(now, self._off_at)
+            if idle > 0:
+                fall = (self._stop - dbar) * 60000 / idle
+                if self._floor is None or fall < self._floor:
+                    self._floor = fall
+        if utime.ticks_diff(now, self._window_at) >= self.leak_window_ms:
+            self._window_at = now
+            return self._leak_window()
+        return 0
+
+    def _stopped(self, now, dbar):
+        run_ms = utime.ticks_diff(now, self._on_at)
+        if self._off_at is not None and self._fall is not None and run_ms > 0:
+            self.cycles += 1
+            gain = (dbar - self._start) * 60000 / run_ms - self._fall
+            if gain >= self._dry_limit():
+                # a dry or cut run would drag the usual gain down
+                stats = self.stats
+                _welford(stats, GAIN, gain)
+                if stats[GAIN * STATS + N] > 1:
+                    stats[GAIN * STATS + EWMA] += (gain - stats[GAIN * STATS + EWMA]) * GAIN_ALPHA
+                else:
+                    stats[GAIN * STATS + EWMA] = gain
+        self._off_at = now
+        self._stop = dbar
+
+    def _dry_limit(self):
+        stats = self.stats
+        if stats[GAIN * STATS + N] < self.learn_cycles:
+            return DRY_MIN_GAIN
+        return stats[GAIN * STATS + EWMA] * DRY_FRACTION
+
+    def _leak_window(self):
+        """a leak window is over, compare its floor with the usual one"""
+        floor = self._floor
+        self._floor = None
+        if floor is None:
+            return 0
+        stats = self.stats
+        if self.sigma and stats[FLOOR * STATS + N] >= LEAK_LEARN:
+            excess = floor - stats[FLOOR * STATS + MEAN]
+            if excess >= LEAK_MIN and excess >= self.sigma * self.std(FLOOR):
+                # not part of the baseline
+                if self._leak:
+                    return 0
+                self._leak = True
+                self.leaks += 1
+                return EV_LEAK
+        self._leak = False
+        _welford(stats, FLOOR, floor)
+        return 0
+
+    def std(self, metric):
+        n = self.stats[metric * STATS + N]
+        return (self.stats[metric * STATS + M2] / (n - 1)) ** 0.5 if n > 1 else 0
+
+    def mean(self, metric):
+        return self.stats[metric * STATS + MEAN]
+
+
+def _welford(stats, metric, x):
+    base = metric * STATS
+    n = stats[base + N] + 1
+    stats[base + N] = n
+    delta = x - stats[base + MEAN]
+    stats[base + MEAN] += delta / n
+    stats[base + M2] += delta * (x - stats[base + MEAN])
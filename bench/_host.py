@@ -0,0 +1,11 @@
+"""Make the firmware modules importable on the host, see sim.install()"""
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import sim  # noqa: E402
+
+sim.install(clock=sim.Clock(realtime=True))
@@ -0,0 +1,126 @@
+"""Leak and dry run detection on the simulated water system
+
+Every run uses the household usage model: quiet nights, busy mornings and
+evenings, a shower every 37 minutes.
+
+  normal:   no fault, [days] days per seed, false alerts per day and per cycle
+  leak:     a constant drain of 0.004 bar/s from LEAK_AT_H hours, once the
+            leak baseline is learned, delay until the leak event
+  dry:      the pump stops adding water FAULT_AT_H hours in, delay until
+            the dry_run event and pump on time after the fault, against
+            pump_max_run_ms alone
+
+The last table times CycleMonitor.update() per reading on the host.
+
+python3 bench/bench_anomaly.py [days] [seeds]
+"""
+import sys
+import time
+
+import _host  # noqa: F401
+
+from anomaly import CycleMonitor  # noqa: E402
+from sim import simulate  # noqa: E402
+from sim.model import WaterSystem, household_usage  # noqa: E402
+
+FAULT_AT_H = 6       # dry well
+LEAK_AT_H = 84       # half a day after the three days the leak baseline is learned from
+MAX_RUN_MS = 180000
+EVENT_TOPIC = b"smarty/water_pressure/event"
+
+
+def run(hours, fault=None, seed=1, at_h=FAULT_AT_H, **kwargs):
+    def source(board):
+        faults = ((at_h * 3600, 10 ** 9, fault),) if fault else ()
+        board.adc_sources[0] = WaterSystem(board, 14, usage=household_usage, faults=faults, seed=seed).raw
+
+    return simulate("pump_cycles", hours * 3600, ("mqtt",), seed=seed, lag_probe_ms=0, board_setup=source,
+                    **kwargs)
+
+
+def events(report, name):
+    """sim times of the published events with that name"""
+    return [p[0] for p in report.broker.published if p[1] == EVENT_TOPIC and p[2] == name]
+
+
+def pump_on_after(report, t0):
+    on = 0
+    started = None
+    for ms, v in report.board.pin_history(14):
+        t = ms / 1000
+        if v and started is None:
+            started = t
+        elif not v and started is not None:
+            on += max(0, t - max(started, t0))
+            started = None
+    if started is not None:
+        on += report.seconds - max(started, t0)
+    return on
+
+
+def normal(days, seeds):
+    print("no fault, {} day(s) x {} seed(s)".format(days, seeds))
+    print("{:>6} {:>8} {:>8} {:>10}".format("seed", "cycles", "leak", "dry_run"))
+    cycles = leaks = dries = 0
+    for seed in range(1, seeds + 1):
+        report = run(days * 24, seed=seed)
+        monitor = report.sensor.zones[0].anomaly
+        leak = len(events(report, b"leak"))
+        dry = len(events(report, b"dry_run"))
+        print("{:>6} {:>8} {:>8} {:>10}".format(seed, monitor.cycles, leak, dry))
+        cycles += monitor.cycles
+        leaks += leak
+        dries += dry
+    print("false alerts: {:.2f} per day, {:.2%} of cycles".format(
+        (leaks + dries) / (days * seeds), (leaks + dries) / cycles if cycles else 0))
+
+
+def delay(times, at_h=FAULT_AT_H):
+    after = [t - at_h * 3600 for t in times if t >= at_h * 3600]
+    return "{:.0f} s".format(after[0]) if after else "missed"
+
+
+def leak(seeds):
+    print("leak of 0.004 bar/s after {} h, one day leak windows".format(LEAK_AT_H))
+    for seed in range(1, seeds + 1):
+        # the window the leak starts in still has a night without it, the next one shows it
+        report = run(LEAK_AT_H + 48, "leak", seed, LEAK_AT_H)
+        times = [t for t in events(report, b"leak") if t >= LEAK_AT_H * 3600]
+        print("  seed {}  leak event after {}".format(
+            seed, "{:.1f} h".format(times[0] / 3600 - LEAK_AT_H) if times else "missed"))
+
+
+def dry(seeds):
+    print("dry well after {} h, pump on time after it".format(FAULT_AT_H))
+    print("{:>6} {:>14} {:>12} {:>22}".format("seed", "dry_run event", "pump on s", "max run only: on s"))
+    for seed in range(1, seeds + 1):
+        report = run(FAULT_AT_H + 1, "dry", seed, pump_max_run_ms=MAX_RUN_MS)
+        only = run(FAULT_AT_H + 1, "dry", seed, pump_max_run_ms=MAX_RUN_MS, dry_run_ms=0)
+        print("{:>6} {:>14} {:>12.0f} {:>22.0f}".format(
+            seed, delay(events(report, b"dry_run")), pump_on_after(report, FAULT_AT_H * 3600),
+            pump_on_after(only, FAULT_AT_H * 3600)))
+
+
+def cost():
+    monitor = CycleMonitor()
+    n = 200000
+    t = time.perf_counter()
+    for i in range(n):
+        # 40 s runs every 200 s, a reading every 500 ms
+        phase = i % 400
+        monitor.update(i * 500, 40 + phase // 8 if phase < 80 else 50 - (phase - 80) // 32, phase < 80)
+    elapsed = time.perf_counter() - t
+    print("CycleMonitor.update: {:.2f} us per reading, {} cycles".format(elapsed / n * 1e6, monitor.cycles))
+
+
+def main():
+    days = float(sys.argv[1]) if len(sys.argv) > 1 else 6
+    seeds = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    normal(days, seeds)
+    leak(seeds)
+    dry(seeds)
+    cost()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Host measurement: time from boot to the first reading, heap after boot
+
+Every configuration runs in a fresh interpreter with an empty bytecode
+cache, so module compile and import time is included as on the board
+without frozen modules. The clock is the real time sim clock: 0 is the
+moment the fake board was installed (reset). "eager" imports every backend
+module before sync, the way the firmware started before the backends were
+loaded on demand.
+
+python3 bench/bench_boot.py [rounds]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONFIGS = (
+    ("none", (), False),
+    ("mqtt", ("mqtt",), False),
+    ("mqtt,db", ("mqtt", "db"), False),
+    ("mqtt,db eager", ("mqtt", "db"), True),
+)
+BACKENDS = ("outputs", "display", "umqtt_async", "connection", "commands", "payload", "readings", "uploader")
+FIRMWARE = ("sync", "sampler", "filters", "calibration", "events", "controller", "telemetry") + BACKENDS
+
+
+def child(outputs, eager):
+    import tracemalloc
+    import _host  # noqa: F401
+
+    tracemalloc.start()
+    if eager:
+        for name in BACKENDS:
+            __import__(name)
+    import sync
+    sensor = sync.SmartWaterSync(output_channels=outputs)
+    heap, _ = tracemalloc.get_traced_memory()
+    loaded = sorted(name for name in FIRMWARE if name in sys.modules)
+    print(json.dumps({"first": sensor.boot_first_reading_ms, "ready": sensor.boot_ms, "heap": heap,
+                      "modules": loaded}))
+
+
+def run(outputs, eager):
+    args = [sys.executable, "-B", os.path.abspath(__file__), "--child", ",".join(outputs), "1" if eager else "0"]
+    with tempfile.TemporaryDirectory() as cache:
+        # an empty bytecode cache: every module is compiled, as without frozen bytecode
+        env = dict(os.environ, PYTHONPYCACHEPREFIX=cache)
+        out = subprocess.run(args, cwd=HERE, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print("{:<16} {:>16} {:>10} {:>10} {:>8}".format("outputs", "first reading ms", "ready ms", "heap KB",
+                                                       "modules"))
+    for label, outputs, eager in CONFIGS:
+        results = [run(outputs, eager) for _ in range(rounds)]
+        # best of rounds, the host is noisy at this scale
+        first = min(r["first"] for r in results)
+        ready = min(r["ready"] for r in results)
+        print("{:<16} {:>16} {:>10} {:>10.1f} {:>8}".format(
+            label, first, ready, results[0]["heap"] / 1024, len(results[0]["modules"])))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(tuple(o for o in sys.argv[2].split(",") if o), sys.argv[3] == "1")
+    else:
+        main()
@@ -0,0 +1,123 @@
+"""Config store: load cost and live reload latency
+
+tests/test_config.py checks the recovery from damaged files and rejected
+messages, this prints the numbers.
+
+  load:      file size, host time of ConfigStore.load() and decode()
+  reload:    pump_cycles with <board_id>/cmd/config messages on the way:
+             thresholds, sensor offset (new table), new topics (re-encode
+             and resubscribe) and a move to a second broker. Host time of
+             apply_config(), sim time until the config echo is published,
+             and whether the board acts on the new settings
+
+python3 bench/bench_config.py
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+import _host  # noqa: F401
+
+from config import ConfigStore, decode, encode  # noqa: E402
+from controller import LOW  # noqa: E402
+from sim import simulate  # noqa: E402
+from sim.broker import FakeBroker  # noqa: E402
+
+SAVED = {
+    "low_pressure": 3.5,
+    "high_pressure": 5.5,
+    "sensor_raw_offset": 41,
+    "mqtt_server": "broker.lan",
+    "mqtt_password": "secret",
+    "mqtt_channels": ("home/pressure", "home/relay"),
+}
+CMD = b"water_pressure/cmd/config"
+RUN_S = 600
+
+
+def load_cost(directory):
+    path = os.path.join(directory, "config.bin")
+    store = ConfigStore(path)
+    store.save(SAVED)
+    n = 2000
+    t = time.perf_counter()
+    for _ in range(n):
+        store.load()
+    load_us = (time.perf_counter() - t) / n * 1e6
+    data = encode(SAVED)
+    t = time.perf_counter()
+    for _ in range(n):
+        decode(data)
+    decode_us = (time.perf_counter() - t) / n * 1e6
+    print("{} settings in {} bytes: load {:.1f} us, decode {:.1f} us".format(len(SAVED), len(data), load_us,
+                                                                           decode_us))
+
+
+def reload(directory):
+    path = os.path.join(directory, "live.bin")
+    second = FakeBroker()
+    steps = []
+
+    def setup(sensor, broker, board):
+        loop = asyncio.get_event_loop()
+        sensor.config = ConfigStore(path)
+        apply = sensor.apply_config
+
+        async def timed(changes):
+            t = time.perf_counter()
+            await apply(changes)
+            steps.append([", ".join(sorted(changes)), (time.perf_counter() - t) * 1e6, loop.time(), None])
+
+        sensor.apply_config = timed
+        publish = sensor.mqtt_publish_async
+
+        async def echo(topic, msg):
+            if topic == b"water_pressure/config" and steps and steps[-1][3] is None:
+                steps[-1][3] = loop.time()
+            await publish(topic, msg)
+
+        sensor.mqtt_publish_async = echo
+
+        async def script():
+            port = await second.start()
+            await asyncio.sleep(60)
+            broker.send(CMD, b"low_pressure=3.5\nhigh_pressure=5.5")
+            await asyncio.sleep(60)
+            broker.send(CMD, b"sensor_raw_offset=41")
+            await asyncio.sleep(60)
+            broker.send(CMD, b"mqtt_channels=home/pressure,home/relay")
+            await asyncio.sleep(5)
+            broker.send(b"home/relay", b"1")
+            await asyncio.sleep(55)
+            broker.send(CMD, b"mqtt_port=%d" % port)
+            await asyncio.sleep(RUN_S - 250)
+            await second.stop()
+
+        asyncio.ensure_future(script())
+
+    report = simulate("pump_cycles", RUN_S, ("mqtt",), setup=setup, lag_probe_ms=0)
+    sensor = report.sensor
+    print("{:<40} {:>12} {:>16}".format("change", "apply us", "echo after ms"))
+    for name, us, t, echoed in steps:
+        print("{:<40} {:>12.0f} {:>16}".format(name, us, "{:.0f}".format((echoed - t) * 1000) if echoed else "-"))
+    published = [p[1] for p in report.broker.published + second.published]
+    print("thresholds now {} / {} dbar, controller low {}".format(
+        sensor._low_dbar, sensor._high_dbar, sensor.controller.state[LOW]))
+    print("on the new topics: {} readings, {} relay changes (home/relay 1 was sent at 185 s)".format(
+        published.count(b"home/pressure"), published.count(b"home/relay")))
+    print("second broker: {} connections, {} publishes; first broker after the move: {}".format(
+        second.connections, len(second.published),
+        sum(1 for p in report.broker.published if p[0] > 240 + 1)))
+    saved = ConfigStore(path).load()
+    print("saved: {}".format(", ".join("{}={}".format(k, v) for k, v in sorted(saved.items()))))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        load_cost(directory)
+        reload(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Host simulation: how fast the control loop cuts the pump at high pressure
+
+Runs the firmware on the simulated board with the broker stalled after the
+first connection (no CONNACK/PUBACK/PINGRESP any more) and measures, for
+every time the modelled pressure reaches high_pressure with the pump on,
+the delay until the relay opens, and the sampler jitter (AdcSampler.jitter)
+over the last samples before it. Exits 1 if any delay is over the bound.
+
+python3 bench/bench_control.py [hours]
+"""
+import sys
+
+import _host  # noqa: F401
+
+from sim import simulate  # noqa: E402
+
+HIGH_DBAR = 50          # high_pressure=5, the SmartWaterSync default
+PERIOD_MS = 50
+WINDOW = 5
+STALL_AFTER_S = 60
+# a rising noise free signal reaches the median WINDOW // 2 samples late, plus one tick to see it
+BOUND_MS = (WINDOW // 2 + 2) * PERIOD_MS
+
+
+def stall_broker(sensor, broker, board):
+    """record when the sensor starts to read HIGH_DBAR and stall the broker once the sensor is connected"""
+    source = board.adc_sources[0]
+    model = source.__self__
+    # no noise: the delay should come from the control loop, not from the dice
+    model.noise = 0
+    table = sensor._pressure_table
+    raw = 0
+    while table[raw] < HIGH_DBAR:
+        raw += 1
+    cross = (raw - model.raw_offset) * model.max_pressure / (1023 - model.raw_offset)
+    crossings = []
+    jitter = []
+    last = [0.0, model.pressure]
+
+    def read(t):
+        value = source(t)
+        p = model.pressure
+        t0, p0 = last
+        if p0 < cross <= p and board.pin_value(14):
+            # interpolate between the two reads
+            crossings.append(t0 + (t - t0) * (cross - p0) / (p - p0))
+            # the pump runs, the samples before this one were taken at the full rate
+            jitter.append(sensor.sampler.jitter())
+        last[0], last[1] = t, p
+        return value
+    board.adc_sources[0] = read
+    sensor.crossings = crossings
+    sensor.jitter = jitter
+
+    import asyncio
+    asyncio.get_event_loop().call_later(STALL_AFTER_S, setattr, broker, "latency_s", 10 ** 6)
+
+
+def reaction_ms(report):
+    offs = [ms for ms, v in report.relay_switches if not v]
+    delays = []
+    for t in report.sensor.crossings:
+        ms = t * 1000
+        after = [off for off in offs if off >= ms - PERIOD_MS]
+        if after:
+            delays.append(after[0] - ms)
+    return delays
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    worst = 0
+    print("{:<14} {:>10} {:>10} {:>10} {:>10}".format("control", "stops", "avg ms", "max ms", "jitter ms"))
+    for name, timer in (("machine.Timer", -1), ("asyncio task", None)):
+        report = simulate("pump_cycles", hours * 3600, ("mqtt",), setup=stall_broker, sample_window=WINDOW,
+                          sample_period_ms=PERIOD_MS, control_timer=timer)
+        delays = reaction_ms(report)
+        worst = max([worst] + delays)
+        jitter = report.sensor.jitter
+        print("{:<14} {:>10} {:>10.0f} {:>10.0f} {:>10}".format(
+            name, len(delays), sum(delays) / len(delays) if delays else 0, max(delays) if delays else 0,
+            max(jitter) if jitter else 0))
+    print("bound {} ms: {}".format(BOUND_MS, "ok" if worst <= BOUND_MS else "EXCEEDED"))
+    return 0 if worst <= BOUND_MS else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
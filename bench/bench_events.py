@@ -0,0 +1,99 @@
+"""Host simulation: fixed 1 s deadband poll against the pressure event engine
+
+Replays a pressure trace (deci-bars every 500 ms, like pressure_check) and
+reports the number of published messages and how late a pipe burst is seen.
+
+python3 bench/bench_events.py [trace.csv]
+
+A recorded trace is a CSV of "<ms>,<deci-bars>,<pump 0/1>" lines.
+"""
+import random
+import sys
+
+import _host  # noqa: F401
+
+from events import PressureEvents, EV_RAPID_DROP  # noqa: E402
+
+STEP_MS = 500
+LOW, HIGH = 40, 50
+BURST_AT_MS = 3600 * 1000 + STEP_MS   # half way between two 1 s polls
+
+
+def synthetic_trace(hours=2):
+    """pump cycles between LOW and HIGH, one pipe burst after an hour"""
+    random.seed(3)
+    p = 45.0
+    pump = False
+    t = 0
+    while t < hours * 3600 * 1000:
+        use = 0.02 if (t // 600000) % 3 else 0.15      # dbar per step: quiet / busy periods
+        if BURST_AT_MS <= t < BURST_AT_MS + 20000:
+            use = 8.0
+        p = max(0.0, p + (0.5 if pump else 0.0) - use)
+        if pump and p >= HIGH:
+            pump = False
+        elif not pump and p <= LOW:
+            pump = True
+        yield t, int(round(p + random.uniform(-0.4, 0.4))), pump
+        t += STEP_MS
+
+
+def load_trace(path):
+    with open(path) as f:
+        for line in f:
+            t, dbar, pump = line.strip().split(",")
+            yield int(t), int(dbar), pump == "1"
+
+
+def run_poll(trace):
+    """what send_data did: wake up every 1000 ms, publish if the change is > 0.1 bar"""
+    sent = []
+    last = None
+    current = None
+    next_poll = 1000
+    for t, dbar, pump in trace:
+        current = dbar
+        if t >= next_poll:
+            next_poll += 1000
+            if last is None or abs(current - last) > 1:
+                last = current
+                sent.append((t, 0))
+    return sent
+
+
+def run_events(trace):
+    engine = PressureEvents(LOW, HIGH)
+    sent = []
+    for t, dbar, pump in trace:
+        ev = engine.update(dbar, t, pump)
+        if ev:
+            engine.sent(dbar, t, ev)
+            sent.append((t, ev))
+    return sent
+
+
+def burst_latency(sent, flag=0):
+    for t, ev in sent:
+        if t >= BURST_AT_MS and (not flag or ev & flag):
+            return t - BURST_AT_MS
+    return None
+
+
+def main():
+    if len(sys.argv) > 1:
+        trace = list(load_trace(sys.argv[1]))
+    else:
+        trace = list(synthetic_trace())
+    hours = (trace[-1][0] - trace[0][0]) / 3600000
+    poll = run_poll(trace)
+    events = run_events(trace)
+    print("trace: {} readings, {:.1f} h".format(len(trace), hours))
+    print("{:<12} {:>10} {:>12} {:>22}".format("strategy", "messages", "msgs/hour", "burst published (ms)"))
+    print("{:<12} {:>10} {:>12.0f} {:>22}".format("1 s poll", len(poll), len(poll) / hours, str(burst_latency(poll))))
+    print("{:<12} {:>10} {:>12.0f} {:>22}".format("events", len(events), len(events) / hours,
+                                                  str(burst_latency(events))))
+    print("rapid_drop alert after {} ms".format(burst_latency(events, EV_RAPID_DROP)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Host benchmark: streaming filters against the list based median()
+
+python3 bench/bench_filters.py
+"""
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from filters import median, make_filter  # noqa: E402
+
+SAMPLES = 20000
+WINDOW = 5
+
+
+def trace(n):
+    random.seed(1)
+    return [max(0, min(1023, 400 + random.randint(-15, 15))) for _ in range(n)]
+
+
+def run_median(values):
+    # the way sync.py used to do it: build a list, sort it for every reading
+    window = []
+    for raw in values:
+        window.append(raw)
+        if len(window) > WINDOW:
+            window.pop(0)
+        median(list(window))
+
+
+def run_filter(name, values):
+    f = make_filter(name, WINDOW)
+    for raw in values:
+        f.push(raw)
+        f.value()
+
+
+def measure(fn, *args):
+    # time without tracing, then the heap peak with tracemalloc
+    t = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - t
+    gc.collect()
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def check(values):
+    # the median filter must give the same numbers as median() on full windows
+    f = make_filter("median", WINDOW)
+    for i, raw in enumerate(values):
+        f.push(raw)
+        if i >= WINDOW - 1:
+            assert f.value() == median(values[i - WINDOW + 1:i + 1])
+
+
+def main():
+    values = trace(SAMPLES)
+    check(values)
+    print("{:<10} {:>12} {:>12}".format("filter", "us/sample", "peak bytes"))
+    cases = [("median()", run_median, (values,))]
+    cases += [(name, run_filter, (name, values)) for name in ("median", "ema", "kalman")]
+    for label, fn, args in cases:
+        elapsed, peak = measure(fn, *args)
+        print("{:<10} {:>12.3f} {:>12}".format(label, elapsed * 1e6 / SAMPLES, peak))
+
+
+if __name__ == "__main__":
+    main()
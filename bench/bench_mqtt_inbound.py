@@ -0,0 +1,218 @@
+"""Host benchmark: incoming MQTT messages, buffered reader against byte reads
+
+"byte reads" is the reader before the receive buffer: readexactly() for
+every header byte and one more for the body, bytes slices to the callback.
+"buffered" is umqtt_async now: readinto() one buffer, every complete
+packet parsed in one pass, memoryview slices to the callback.
+
+  parser:  small PUBLISH frames served from memory in TCP segment sized
+           chunks, stream read calls, new objects (read results, slices
+           and the callback arguments) and bytes copied into new objects
+           per message
+  flood:   the fake broker floods a subscribed client over loopback,
+           messages per second end to end
+
+python3 bench/bench_mqtt_inbound.py [messages]
+"""
+import asyncio
+import struct
+import sys
+import time
+
+import _host  # noqa: F401
+
+import sim  # noqa: E402
+import umqtt_async  # noqa: E402
+from sim.broker import FakeBroker  # noqa: E402
+from umqtt_async import MQTTException  # noqa: E402
+
+TOPIC = b"smarty/water_pressure/cmd/flood"
+PAYLOAD = b"4.5,1"
+SEGMENT = 1460
+
+
+class ByteReader(umqtt_async.MQTTClient):
+    """umqtt_async before the receive buffer"""
+
+    async def _read_loop(self):
+        try:
+            while True:
+                await self._read_packet()
+        except (OSError, EOFError, MQTTException):
+            pass
+        finally:
+            self.connected = False
+            self._closed.set()
+            self._slot_free.set()
+
+    async def _recv_len(self):
+        n = 0
+        sh = 0
+        while 1:
+            b = (await self._reader.readexactly(1))[0]
+            n |= (b & 0x7f) << sh
+            if not b & 0x80:
+                return n
+            sh += 7
+
+    async def _read_packet(self):
+        op = (await self._reader.readexactly(1))[0]
+        sz = await self._recv_len()
+        body = await self._reader.readexactly(sz) if sz else b""
+        kind = op & 0xf0
+        if kind == 0x30:
+            topic_len = (body[0] << 8) | body[1]
+            topic = body[2:2 + topic_len]
+            pos = 2 + topic_len
+            if op & 6:
+                pid = body[pos] << 8 | body[pos + 1]
+                pos += 2
+            self.cb(topic, body[pos:])
+            if op & 6 == 2:
+                struct.pack_into("!BBH", self._buf, 0, 0x40, 2, pid)
+                self._writer.write(self._mv[:4])
+                await self._writer.drain()
+        elif kind == 0x40 or kind == 0x90:
+            self._ack(body[0] << 8 | body[1])
+
+
+class MemoryReader:
+    """stream reader over a bytes object, at most SEGMENT bytes per read like a TCP receive"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.calls = 0
+        self.allocs = 0
+        self.copied = 0
+
+    async def readexactly(self, n):
+        self.calls += 1
+        if self.pos + n > len(self.data):
+            raise EOFError
+        self.pos += n
+        # a new bytes object
+        self.allocs += 1
+        self.copied += n
+        return self.data[self.pos - n:self.pos]
+
+    async def readinto(self, buf):
+        self.calls += 1
+        # the caller's memoryview slice of its buffer
+        self.allocs += 1
+        n = min(len(buf), SEGMENT, len(self.data) - self.pos)
+        buf[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+class NullWriter:
+    def write(self, buf):
+        pass
+
+    async def drain(self):
+        pass
+
+
+def frames(n, qos=0):
+    out = bytearray()
+    for i in range(n):
+        body = struct.pack("!H", len(TOPIC)) + TOPIC
+        if qos:
+            body += struct.pack("!H", i % 0xffff + 1)
+        body += PAYLOAD
+        out += bytes([0x30 | qos << 1, len(body)]) + body
+    return bytes(out)
+
+
+def run_reader(cls, data):
+    """handle data with the client reader task, without an event loop
+
+    return (messages, read calls, new objects, bytes copied)
+    """
+    client = cls("bench", "localhost")
+    count = [0, 0, 0]
+
+    def cb(topic, msg):
+        count[0] += 1
+        count[1] += 2
+        for arg in (topic, msg):
+            if not isinstance(arg, memoryview):
+                count[2] += len(arg)
+    client.set_callback(cb)
+    client._reader = MemoryReader(data)
+    client._writer = NullWriter()
+    client.connected = True
+    coro = client._read_loop()
+    try:
+        while True:
+            coro.send(None)
+    except StopIteration:
+        pass
+    reader = client._reader
+    return count[0], reader.calls, reader.allocs + count[1], reader.copied + count[2]
+
+
+def parser(messages):
+    print("parser, {} messages".format(messages))
+    print("{:<12} {:>4} {:>10} {:>10} {:>11} {:>11}".format(
+        "reader", "qos", "msgs/s", "reads/msg", "objects/msg", "copied/msg"))
+    for qos in (0, 1):
+        data = frames(messages, qos)
+        for label, cls in (("byte reads", ByteReader), ("buffered", umqtt_async.MQTTClient)):
+            t = time.perf_counter()
+            n, calls, allocs, copied = run_reader(cls, data)
+            elapsed = time.perf_counter() - t
+            assert n == messages, (label, n)
+            print("{:<12} {:>4} {:>10.0f} {:>10.2f} {:>11.2f} {:>11.1f}".format(
+                label, qos, n / elapsed, calls / n, allocs / n, copied / n))
+
+
+def flood(messages):
+    clock = sim.Clock()
+    sim.install(sim.Board(clock))
+    print("flood over loopback, {} messages".format(messages))
+    for label, cls in (("byte reads", ByteReader), ("buffered", umqtt_async.MQTTClient)):
+        loop = sim.new_event_loop(clock)
+        asyncio.set_event_loop(loop)
+        try:
+            rate = loop.run_until_complete(_flood(cls, messages))
+            loop.run_until_complete(asyncio.sleep(0.1))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        print("{:<12} {:>12.0f} msgs/s".format(label, rate))
+
+
+async def _flood(cls, messages):
+    broker = FakeBroker()
+    port = await broker.start()
+    client = cls("bench", "127.0.0.1", port)
+    count = [0]
+
+    def cb(topic, msg):
+        count[0] += 1
+    client.set_callback(cb)
+    await client.connect()
+    await client.subscribe(b"smarty/#")
+    start = time.perf_counter()
+    for i in range(messages):
+        broker.send(TOPIC, PAYLOAD)
+        if i % 100 == 99:
+            await asyncio.sleep(0)
+    while count[0] < messages:
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    client.close()
+    await broker.stop()
+    return messages / elapsed
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    parser(messages)
+    flood(messages)
+
+
+if __name__ == "__main__":
+    main()
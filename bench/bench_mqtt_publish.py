@@ -0,0 +1,100 @@
+"""Host benchmark: socket writes and transient heap per MQTT publish
+
+python3 bench/bench_mqtt_publish.py
+"""
+import asyncio
+import time
+import tracemalloc
+
+import _host  # noqa: F401
+
+import umqtt_async  # noqa: E402
+import umqtt_simple  # noqa: E402
+from calibration import format_dbar  # noqa: E402
+
+ROUNDS = 2000
+TOPIC = "smarty/water_pressure"
+
+
+class CountingSocket:
+    """umqtt_simple socket / uasyncio stream writer replacement"""
+
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, buf, n=None):
+        self.writes += 1
+
+    async def drain(self):
+        pass
+
+
+def publish_before(client, pressure):
+    # what sync.py did before: format a float, encode the topic on every call
+    client.publish(TOPIC, "{}".format(pressure), False, 0)
+
+
+async def publish_after(client, topic, payload, payload_mv, dbar):
+    n = format_dbar(payload, dbar)
+    await client.publish(topic, payload_mv[:n], False, 0)
+
+
+def measure(run_one):
+    # transient heap peak of one call, time over ROUNDS calls
+    run_one(0)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    run_one(1)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    t = time.perf_counter()
+    for i in range(ROUNDS):
+        run_one(i)
+    return (time.perf_counter() - t) * 1e6 / ROUNDS, peak
+
+
+def main():
+    sock = CountingSocket()
+    old = umqtt_simple.MQTTClient("bench", "localhost")
+    old.sock = sock
+    us_old, peak_old = measure(lambda i: publish_before(old, 4.0 + (i % 20) / 10))
+    writes_old = sock.writes / (ROUNDS + 2)
+
+    writer = CountingSocket()
+    new = umqtt_async.MQTTClient("bench", "localhost")
+    new._writer = writer
+    new.connected = True
+    topic = umqtt_async.encode_topic(TOPIC)
+    payload = bytearray(8)
+    payload_mv = memoryview(payload)
+    loop = asyncio.new_event_loop()
+
+    def run_new(i):
+        coro = publish_after(new, topic, payload, payload_mv, 40 + i % 20)
+        try:
+            coro.send(None)
+        except StopIteration:
+            pass
+
+    us_new, peak_new = measure(run_new)
+    writes_new = writer.writes / (ROUNDS + 2)
+    loop.close()
+
+    def frame_only(i):
+        # the synchronous part of publish(): encode into the scratch buffer and write
+        n = format_dbar(payload, 40 + i % 20)
+        h = new._encode_publish(topic, payload_mv[:n], False, 0, 0)
+        new._buf[h:h + n] = payload_mv[:n]
+        writer.write(new._mv[:h + n])
+
+    us_frame, peak_frame = measure(frame_only)
+
+    print("{:<14} {:>10} {:>14} {:>12}".format("publish", "us/call", "writes/call", "peak bytes"))
+    print("{:<14} {:>10.2f} {:>14.1f} {:>12}".format("umqtt_simple", us_old, writes_old, peak_old))
+    print("{:<14} {:>10.2f} {:>14.1f} {:>12}".format("umqtt_async", us_new, writes_new, peak_new))
+    print("{:<14} {:>10.2f} {:>14.1f} {:>12}".format("  frame only", us_frame, 1.0, peak_frame))
+    print("(umqtt_async peak includes the coroutine frames of publish())")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Host simulation: QoS 1 in-flight window, keepalive and retransmission
+
+Against the fake broker on the virtual clock:
+  - time to publish and get PUBACKs for a replay burst, by window size and latency
+  - time to notice a half open connection (broker stops answering PINGREQ)
+  - frames sent again with DUP after the broker dropped the connection
+
+python3 bench/bench_mqtt_window.py
+"""
+import asyncio
+
+import _host  # noqa: F401
+
+import sim  # noqa: E402
+from sim.broker import FakeBroker  # noqa: E402
+
+BURST = 200
+LATENCIES = (0.02, 0.1, 0.3)
+WINDOWS = (1, 4, 16)
+
+
+def run(coro_fn):
+    clock = sim.Clock()
+    sim.install(sim.Board(clock))
+    loop = sim.new_event_loop(clock)
+    asyncio.set_event_loop(loop)
+    try:
+        result = loop.run_until_complete(coro_fn(clock))
+        # let the broker handlers see their sockets close and delayed answers go out
+        loop.run_until_complete(asyncio.sleep(2))
+        return result
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+async def connect(broker, **kwargs):
+    from umqtt_async import MQTTClient
+    port = await broker.start()
+    client = MQTTClient("bench", "127.0.0.1", port, **kwargs)
+    client.set_callback(lambda t, m: None)
+    await client.connect()
+    return client
+
+
+def burst(latency, window):
+    async def main(clock):
+        broker = FakeBroker(latency)
+        client = await connect(broker, max_inflight=window)
+        start = clock.time()
+        for i in range(BURST):
+            await client.publish(b"smarty/water_pressure/replay", b"%d,4.5" % i, False, 1)
+        while client.inflight():
+            await asyncio.sleep(0.001)
+        elapsed = clock.time() - start
+        client.close()
+        await broker.stop()
+        return elapsed
+    return run(main)
+
+
+def half_open(keepalive):
+    async def main(clock):
+        broker = FakeBroker()
+        client = await connect(broker, keepalive=keepalive)
+        await asyncio.sleep(5)
+        broker.ignore_pings = True
+        start = clock.time()
+        while client.connected:
+            await asyncio.sleep(0.1)
+        elapsed = clock.time() - start
+        await broker.stop()
+        return elapsed, client.pings, client.ping_timeouts
+    return run(main)
+
+
+def retransmit():
+    async def main(clock):
+        broker = FakeBroker(1.0)
+        client = await connect(broker, max_inflight=4)
+        for i in range(4):
+            await client.publish(b"t", b"%d" % i, False, 1)
+        await asyncio.sleep(0.1)
+        broker.drop_all()
+        await asyncio.sleep(0.1)
+        broker.latency_s = 0
+        client.close()
+        await client.connect()
+        while client.inflight():
+            await asyncio.sleep(0.01)
+        dups = sum(1 for p in broker.published if p[4])
+        client.close()
+        await broker.stop()
+        return dups, client.retransmits, len(broker.published)
+    return run(main)
+
+
+def main():
+    print("{} QoS 1 publishes until the last PUBACK, seconds".format(BURST))
+    print("{:>12}".format("latency") + "".join("{:>12}".format("window %d" % w) for w in WINDOWS))
+    for latency in LATENCIES:
+        row = [burst(latency, w) for w in WINDOWS]
+        print("{:>11.0f}ms".format(latency * 1000) + "".join("{:>12.2f}".format(t) for t in row))
+    for keepalive in (10, 60):
+        t, pings, timeouts = half_open(keepalive)
+        print("keepalive {:>3} s: half open connection closed after {:.1f} s ({} pings, {} timeouts)".format(
+            keepalive, t, pings, timeouts))
+    dups, retransmits, published = retransmit()
+    print("after a drop: {} frames sent again, broker saw {} with DUP ({} publishes in total)".format(
+        retransmits, dups, published))
+
+
+if __name__ == "__main__":
+    main()
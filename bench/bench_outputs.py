@@ -0,0 +1,45 @@
+"""Host simulation: output backends under a slow broker
+
+Runs mqtt, db and display together while the broker answers every packet
+LATENCY_S late with a one message in-flight window, so every mqtt publish
+waits for its PUBACK. Prints per backend how many readings went out, how
+many were dropped (their events are merged into the next reading) and the
+longest time from submit() to the end of send(). The display line compares
+the characters written with the ones a full redraw per update would take.
+
+python3 bench/bench_outputs.py [hours] [scenario]
+"""
+import sys
+
+import _host  # noqa: F401
+
+from sim import simulate  # noqa: E402
+
+LATENCY_S = 3
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    name = sys.argv[2] if len(sys.argv) > 2 else "burst"
+
+    def slow_broker(sensor, broker, board):
+        broker.latency_s = LATENCY_S
+
+    report = simulate(name, hours * 3600, ("mqtt", "db", "display"), setup=slow_broker, lag_probe_ms=0,
+                      mqtt_inflight=1)
+    sensor = report.sensor
+    print("{}, {:.1f} h, broker latency {} s".format(name, hours, LATENCY_S))
+    print("{:<10} {:>8} {:>8} {:>8} {:>12}".format("output", "sent", "dropped", "errors", "max lag ms"))
+    for name, output in sensor.outputs.items():
+        print("{:<10} {:>8} {:>8} {:>8} {:>12}".format(
+            name, output.sent, output.dropped, output.errors, output.lag_max_ms))
+    display = sensor.outputs["display"]
+    lcd = report.board.lcd
+    full = display.sent * display.rows * display.cols
+    print("display: {} characters written, {} for full redraws ({:.1f}%)".format(
+        lcd.chars, full, 100 * lcd.chars / full if full else 0))
+    print("http: {} requests, mqtt: {} publishes".format(report.http_requests, sum(report.publishes.values())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Host simulation: fixed sampling schedule against the adaptive one
+
+Counts the wakeups per hour (times the simulated board went idle and a timer
+woke it up), control ticks per hour and host CPU time per simulated hour,
+the last one only as a relative measure of the work done on the board.
+
+python3 bench/bench_power.py [hours] [scenario]
+"""
+import sys
+import time
+
+import _host  # noqa: F401
+
+from sim import simulate  # noqa: E402
+
+SCHEDULES = (
+    ("fixed 50 ms", dict(sample_max_period_ms=50)),
+    ("adaptive 1 s", dict(sample_max_period_ms=1000)),
+    ("adaptive 4 s", dict(sample_max_period_ms=4000)),
+)
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 6
+    name = sys.argv[2] if len(sys.argv) > 2 else "pump_cycles"
+    print("{:<14} {:>12} {:>12} {:>14} {:>10} {:>10}".format(
+        "schedule", "wakeups/h", "ticks/h", "cpu ms/h", "switches", "pump on s"))
+    for label, kwargs in SCHEDULES:
+        cpu = time.process_time()
+        report = simulate(name, hours * 3600, ("mqtt",), lag_probe_ms=0, power_mode="light", **kwargs)
+        cpu = (time.process_time() - cpu) * 1000
+        board = report.board
+        print("{:<14} {:>12.0f} {:>12.0f} {:>14.0f} {:>10} {:>10.0f}".format(
+            label, board.clock.wakeups / hours, report.sensor.controller.state[14] / hours, cpu / hours,
+            len(report.relay_switches), report.pump_on_s))
+
+
+if __name__ == "__main__":
+    main()
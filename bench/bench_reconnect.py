@@ -0,0 +1,59 @@
+"""Host simulation: how fast the connection manager recovers
+
+Every 5 minutes the broker drops all connections; once it also refuses new
+ones for 2 minutes (backoff) and once WiFi goes away for a minute. Prints
+the reconnect counters and the time to recover from every outage.
+
+python3 bench/bench_reconnect.py [hours]
+"""
+import asyncio
+import sys
+
+import _host  # noqa: F401
+
+from sim import simulate  # noqa: E402
+import connection  # noqa: E402
+
+DROP_EVERY_S = 300
+REFUSE_AT_S = 1500
+REFUSE_S = 120
+WIFI_AT_S = 2700
+WIFI_S = 60
+
+
+def outages(sensor, broker, board):
+    loop = asyncio.get_event_loop()
+    t = DROP_EVERY_S
+    while t < 10 ** 5:
+        loop.call_later(t, broker.drop_all)
+        t += DROP_EVERY_S
+    loop.call_later(REFUSE_AT_S, setattr, broker, "refuse", True)
+    loop.call_later(REFUSE_AT_S + REFUSE_S, setattr, broker, "refuse", False)
+    loop.call_later(WIFI_AT_S, setattr, board, "wifi_available", False)
+    loop.call_later(WIFI_AT_S + WIFI_S, setattr, board, "wifi_available", True)
+
+    # keep every recovery time, the counters only have the last and the max
+    manager = sensor.connection
+    sensor.recoveries = []
+    recovered = manager._recovered
+
+    def record():
+        recovered()
+        sensor.recoveries.append((loop.time(), manager.counters[connection.RECOVER_MS]))
+    manager._recovered = record
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    report = simulate("pump_cycles", hours * 3600, ("mqtt",), setup=outages, lag_probe_ms=0)
+    sensor = report.sensor
+    c = sensor.connection.counters
+    print("connections {}  refused {}  reconnects {}  failures {}  max recover {} ms".format(
+        report.mqtt_connections, report.broker.refused, c[connection.RECONNECTS], c[connection.FAILURES],
+        c[connection.RECOVER_MAX_MS]))
+    for t, ms in sensor.recoveries:
+        print("  {:>7.0f} s  recovered in {:>6} ms".format(t, ms))
+
+
+if __name__ == "__main__":
+    main()
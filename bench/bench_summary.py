@@ -0,0 +1,115 @@
+"""Window summaries against the raw readings
+
+Runs the firmware for some simulated hours and checks the published 1 min
+summaries against what the simulated board did: pump on time and relay
+switches summed over the windows, min / max against the raw readings that
+were published. Then compares the messages a dashboard needs per hour,
+asks for the open windows with cmd/summary, runs the burst scenario behind
+a slow broker and times Aggregator.add() with 1 and 3 tiers.
+
+python3 bench/bench_summary.py [hours]
+"""
+import sys
+import time
+import tracemalloc
+
+import _host  # noqa: F401
+
+from aggregate import Aggregator, decode  # noqa: E402
+from sim import simulate  # noqa: E402
+
+LATENCY_S = 3
+
+
+def summaries(report):
+    """decoded summaries published for zone 0, in order"""
+    return [decode(p[2]) for p in report.broker.published if p[1].startswith(b"smarty/water_pressure/summary/")]
+
+
+def accuracy(hours):
+    def query(sensor, broker, board):
+        import asyncio
+
+        async def ask():
+            await asyncio.sleep(hours * 3600 - 30)
+            broker.send(b"water_pressure/cmd/summary", b"")
+        asyncio.ensure_future(ask())
+
+    report = simulate("pump_cycles", hours * 3600, ("mqtt",), setup=query, lag_probe_ms=0)
+    closed = [s for s in summaries(report) if not s["running"]]
+    running = [s for s in summaries(report) if s["running"]]
+    minutes = [s for s in closed if s["window_s"] == 60]
+    raw = [float(p[2]) for p in report.broker.published if p[1] == b"smarty/water_pressure"]
+    seconds = len(minutes) * 60
+    sim_on = sum(min(end, seconds) - start for start, end in _on_periods(report) if start < seconds)
+    print("{:.0f} h pump_cycles, windows closed: {}".format(
+        hours, ", ".join("{} x {} s".format(sum(1 for s in closed if s["window_s"] == w), w)
+                         for w in sorted(set(s["window_s"] for s in closed)))))
+    print("  pump on s   summaries {:>8}   board {:>8.0f}".format(sum(s["pump_on_s"] for s in minutes), sim_on))
+    print("  switches    summaries {:>8}   board {:>8}".format(
+        sum(s["switches"] for s in minutes),
+        sum(1 for ms, _ in report.relay_switches if ms < seconds * 1000)))
+    print("  min bar     summaries {:>8}   published readings {:>5}".format(
+        min(s["min"] for s in minutes), min(raw)))
+    print("  max bar     summaries {:>8}   published readings {:>5}".format(
+        max(s["max"] for s in minutes), max(raw)))
+    readings = sum(s["readings"] for s in minutes)
+    print("  readings    aggregated {:>7}   published {:>12}".format(readings, len(raw)))
+    print("messages per hour: raw readings {:.0f}, summaries {}".format(
+        len(raw) / hours, ", ".join("{} s tier {:.0f}".format(w, 3600 / w) for w in (60, 900, 3600))))
+    print("cmd/summary answer:")
+    for s in running:
+        print("  {window_s:>5} s window, open {elapsed_s:>4} s, {readings:>5} readings, "
+              "min {min} max {max} mean {mean} bar, pump {pump_on_s} s, {switches} switches".format(**s))
+
+
+def _on_periods(report):
+    started = None
+    for ms, v in report.board.pin_history(14):
+        if v and started is None:
+            started = ms / 1000
+        elif not v and started is not None:
+            yield started, ms / 1000
+            started = None
+    if started is not None:
+        yield started, report.seconds
+
+
+def burst(hours):
+    def slow_broker(sensor, broker, board):
+        broker.latency_s = LATENCY_S
+
+    report = simulate("burst", hours * 3600, ("mqtt",), setup=slow_broker, lag_probe_ms=0, mqtt_inflight=1)
+    mqtt = report.sensor.outputs["mqtt"]
+    closed = [s for s in summaries(report) if not s["running"]]
+    # the first window opens with the first reading, half a second after boot
+    print("burst behind a {} s broker: readings sent {}, dropped {}; summaries {} of {} windows".format(
+        LATENCY_S, mqtt.sent, mqtt.dropped, len(closed),
+        sum(int((hours * 3600 - 1) // w) for w in (60, 900, 3600))))
+
+
+def cost():
+    print("{:>6} {:>10} {:>12}".format("tiers", "us/add", "heap bytes"))
+    for windows in ((60,), (60, 900, 3600)):
+        tracemalloc.start()
+        agg = Aggregator(windows)
+        heap = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        n = 200000
+        t = time.perf_counter()
+        for i in range(n):
+            # a reading every 500 ms
+            agg.add(i * 500, 40 + i % 11, i & 64)
+        elapsed = time.perf_counter() - t
+        print("{:>6} {:>10.2f} {:>12}".format(len(windows), elapsed / n * 1e6, heap))
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    accuracy(hours)
+    burst(1)
+    cost()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""MQTT over TLS against the fake broker terminating TLS on loopback
+
+A self-signed RSA 2048 certificate is made with the openssl tool. Then
+[connects] connects of one client, each followed by one QoS 1 publish, for:
+
+  plain:      no TLS
+  per connect: a new context every connect, the certificate file is read
+              and parsed again, what ussl.wrap_socket() did
+  cached:     one context, full handshake every time
+  resumed:    one context handing its session to the next handshake
+
+and cached / resumed again with TLS 1.2, what the ESP8266 speaks: its
+resumed handshake skips the key exchange too, TLS 1.3 only the certificate.
+
+Connect ms is open_connection() to CONNACK on the real clock, client and
+broker share the process. The gc.collect() before a TLS handshake is left
+out: on the host it walks all of CPython's heap (about 4 ms), on the board
+40 KB. Peak heap is what CPython allocates in connect()
+(tracemalloc, mostly the 256 KB read buffers of the asyncio socket and TLS
+transports, OpenSSL's own allocations are not traced). The board reports
+its own numbers on the stats topic: handshake_ms, tls_resumed and tls_heap.
+
+Last, an hour of pump_cycles over TLS with the broker dropping every
+connection every 5 minutes, against the same hour without TLS.
+
+python3 bench/bench_tls.py [connects]
+"""
+import asyncio
+import gc
+import ssl
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import _host  # noqa: F401
+
+import connection  # noqa: E402
+import umqtt_async  # noqa: E402
+from sim import simulate  # noqa: E402
+from sim.broker import FakeBroker, self_signed, server_context  # noqa: E402
+from broker_tls import make_context  # noqa: E402
+from umqtt_async import MQTTClient  # noqa: E402
+
+DROP_EVERY_S = 300
+
+
+def context_for(ca, mode):
+    context = make_context(ca)
+    if mode.endswith("1.2"):
+        context.maximum_version = ssl.TLSVersion.TLSv1_2
+    if mode.startswith("cached"):
+        context.resume = False
+    return context
+
+
+async def connects(port, n, ca, mode, heap):
+    context = None
+    if mode.startswith(("cached", "resumed")):
+        context = context_for(ca, mode)
+    client = MQTTClient("bench", "127.0.0.1", port, ssl=context)
+    client.set_callback(lambda t, m: None)
+    times = []
+    peaks = []
+    resumed = 0
+    for i in range(n):
+        if mode == "per connect":
+            client.ssl = make_context(ca)
+        if heap:
+            tracemalloc.start()
+        t = time.perf_counter()
+        await client.connect()
+        times.append((time.perf_counter() - t) * 1000)
+        if heap:
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        resumed += client.tls_resumed
+        await client.publish(b"bench", b"%d" % i, False, 1)
+        while client.inflight():
+            await asyncio.sleep(0.001)
+        await client.disconnect()
+        await asyncio.sleep(0)
+    return times, peaks, resumed
+
+
+class _NoCollect:
+    @staticmethod
+    def collect():
+        pass
+
+
+def handshakes(n, cert, key):
+    umqtt_async.gc = _NoCollect
+    print("{} connects per mode".format(n))
+    print("{:>12} {:>9} {:>9} {:>9} {:>16}".format("mode", "p50 ms", "mean ms", "resumed", "peak heap bytes"))
+    for mode in ("plain", "per connect", "cached", "resumed", "cached 1.2", "resumed 1.2"):
+        async def main():
+            broker = FakeBroker(ssl=None if mode == "plain" else server_context(cert, key))
+            port = await broker.start()
+            timed = await connects(port, n, cert, mode, False)
+            measured = await connects(port, max(5, n // 10), cert, mode, True)
+            await broker.stop()
+            return timed, measured
+
+        loop = asyncio.new_event_loop()
+        try:
+            (times, _, resumed), (_, peaks, _) = loop.run_until_complete(main())
+        finally:
+            loop.close()
+        times.sort()
+        print("{:>12} {:>9.2f} {:>9.2f} {:>9} {:>16}".format(
+            mode, times[len(times) // 2], sum(times) / len(times), resumed, max(peaks)))
+    umqtt_async.gc = gc
+
+
+def context_cost(ca):
+    tracemalloc.start()
+    t = time.perf_counter()
+    make_context(ca)
+    elapsed = (time.perf_counter() - t) * 1000
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("make_context: {:.2f} ms, python peak {} bytes, once per boot".format(elapsed, peak))
+
+
+def outages(sensor, broker, board):
+    loop = asyncio.get_event_loop()
+    for t in range(DROP_EVERY_S, 3600, DROP_EVERY_S):
+        loop.call_later(t, broker.drop_all)
+
+
+def firmware(cert, key):
+    print("1 h pump_cycles, broker drops every {} s".format(DROP_EVERY_S))
+    for name, kwargs in (("plain", {}),
+                         ("tls", dict(broker_ssl=server_context(cert, key), mqtt_tls=True, mqtt_ca=cert))):
+        report = simulate("pump_cycles", 3600, ("mqtt",), setup=outages, lag_probe_ms=0, **kwargs)
+        c = report.sensor.connection.counters
+        print("  {:>5}: {} connections, {} resumed, {} publishes, max recover {} ms".format(
+            name, report.mqtt_connections, c[connection.RESUMED], len(report.broker.published),
+            c[connection.RECOVER_MAX_MS]))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = self_signed(directory)
+        context_cost(cert)
+        handshakes(n, cert, key)
+        firmware(cert, key)
+
+
+if __name__ == "__main__":
+    main()
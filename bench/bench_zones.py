@@ -0,0 +1,106 @@
+"""Heap per zone and several zones on the simulated board
+
+The first table is the heap taken by SmartWaterSync with 1 to 8 zones
+(tracemalloc on the host, gc.mem_alloc deltas on the board) and the cost of
+every extra zone, with the board calibration table and with an own one.
+The second part runs ZONES tanks for an hour of simulated time on one
+control loop and one broker connection.
+
+python3 bench/bench_zones.py [hours]
+"""
+import gc
+import sys
+
+import _host  # noqa: F401
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import sync  # noqa: E402
+
+RELAYS = (14, 12, 13, 15, 0, 2, 4, 5)
+ZONES = 4
+
+
+def zone_configs(n, own_table=False):
+    configs = []
+    for i in range(1, n):
+        config = {"name": "tank%d" % i, "adc": i, "relay": RELAYS[i]}
+        if own_table:
+            config["raw_offset"] = 43
+        configs.append(config)
+    return configs
+
+
+def heap(n, own_table=False):
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        sensor = sync.SmartWaterSync(output_channels=("mqtt",), zones=zone_configs(n, own_table))
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    else:
+        before = gc.mem_alloc()
+        sensor = sync.SmartWaterSync(output_channels=("mqtt",), zones=zone_configs(n, own_table))
+        gc.collect()
+        used = gc.mem_alloc() - before
+    del sensor
+    return used
+
+
+def memory():
+    print("{:>6} {:>12} {:>14} {:>14}".format("zones", "heap bytes", "per extra zone", "own table"))
+    # the first one also imports the output backends
+    heap(1)
+    one = heap(1)
+    for n in (1, 2, 4, 8):
+        used = heap(n)
+        own = heap(n, True)
+        per = (used - one) // (n - 1) if n > 1 else 0
+        per_own = (own - one) // (n - 1) if n > 1 else 0
+        print("{:>6} {:>12} {:>14} {:>14}".format(n, used, per, per_own))
+
+
+def simulate_zones(hours, **kwargs):
+    from sim import simulate
+    from sim.model import scenario
+
+    def sources(board):
+        for i in range(1, ZONES):
+            board.adc_sources[i] = scenario("pump_cycles", board, RELAYS[i], seed=i + 1).raw
+
+    return simulate("pump_cycles", hours * 3600, ("mqtt",), lag_probe_ms=0, board_setup=sources,
+                    zones=zone_configs(ZONES), **kwargs)
+
+
+def batched(report):
+    """(messages, readings) on <board_id>/zones"""
+    messages = [p[2] for p in report.broker.published if p[1].endswith(b"/zones")]
+    return len(messages), sum(m.count(b"\n") + 1 for m in messages)
+
+
+def simulation(hours):
+    report = simulate_zones(hours)
+    print("{} zones, {:.1f} h simulated in {:.2f} s wall".format(ZONES, hours, report.wall_s))
+    for i in range(ZONES):
+        switches = len(report.board.pin_history(RELAYS[i])) - 1
+        ticks = report.sensor.zones[i].controller.state[14]
+        print("  zone {}  relay switches {:>4}  control ticks {:>7}".format(i, switches, ticks))
+    for topic, n in sorted(report.publishes.items()):
+        print("  {:<40} {:>6}".format(topic, n))
+    print("mqtt connections: {}".format(report.mqtt_connections))
+    print("{:>14} {:>10} {:>10}".format("zone_batch_ms", "messages", "readings"))
+    for ms in (0, 2000, 10000):
+        print("{:>14} {:>10} {:>10}".format(ms, *batched(simulate_zones(hours, zone_batch_ms=ms))))
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    memory()
+    simulation(hours)
+
+
+if __name__ == "__main__":
+    main()
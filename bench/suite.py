@@ -0,0 +1,201 @@
+"""Sensor-to-broker hot path benchmark, stage by stage and end to end
+
+    python3 bench/suite.py                       # print the table
+    python3 bench/suite.py --save base.json      # store a baseline
+    python3 bench/suite.py --compare base.json   # flag regressions, exit 1 if any
+
+Runs on the host (tracemalloc for allocations) and on the board with
+mpremote run (gc.mem_alloc deltas). Allocation numbers are bytes per call.
+"""
+import gc
+import sys
+
+try:
+    import _host  # noqa: F401  host only: fake machine / network modules
+except ImportError:
+    pass
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    from time import perf_counter
+
+    def now_us():
+        return perf_counter() * 1000000
+
+    def elapsed_us(start):
+        return perf_counter() * 1000000 - start
+except ImportError:
+    from utime import ticks_us, ticks_diff
+
+    def now_us():
+        return ticks_us()
+
+    def elapsed_us(start):
+        return ticks_diff(ticks_us(), start)
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+import sync  # noqa: E402
+from calibration import format_dbar  # noqa: E402
+from filters import MedianFilter  # noqa: E402
+from payload import PayloadEncoder  # noqa: E402
+from umqtt_async import MQTTClient  # noqa: E402
+
+ROUNDS = 2000
+THRESHOLD = 0.25        # 25% slower / more allocation counts as a regression
+
+
+def make_stages():
+    sensor = sync.SmartWaterSync(output_channels=("mqtt",))
+    client = MQTTClient("bench", "localhost")
+    topic = sensor._topics[0]
+    relay_topic = sensor._topics[1]
+    payload = sensor._payload
+    payload_mv = sensor._payload_mv
+    median = MedianFilter(5)
+    encoder = PayloadEncoder(1)
+    state = [0]
+
+    def filter_median():
+        state[0] = (state[0] + 7) & 0x3ff
+        median.push(state[0])
+        median.value()
+
+    def convert_pressure():
+        state[0] = (state[0] + 7) & 0x3ff
+        sensor.convert_pressure(state[0])
+
+    def check_pressure_value():
+        state[0] = (state[0] + 1) % 80
+        sensor.check_pressure_value(state[0])
+
+    def send_data_format():
+        state[0] = (state[0] + 1) % 120
+        format_dbar(payload, state[0])
+
+    def payload_binary():
+        state[0] = (state[0] + 1) % 120
+        encoder.add(state[0], state[0], 444, 1)
+        encoder.encode()
+
+    def mqtt_frame():
+        n = format_dbar(payload, 45)
+        h = client._encode_publish(topic, payload_mv[:n], False, 1, 1)
+        client._buf[h:h + n] = payload_mv[:n]
+
+    def mqtt_callback():
+        state[0] ^= 1
+        sensor._mqtt_setup_callback(relay_topic, b"1" if state[0] else b"0")
+        handler, t, msg = sensor.router.pop()
+        handler(t, msg)
+
+    def end_to_end():
+        raw = sensor.sampler.sample()
+        raw = sensor.get_analog_data()
+        sensor.check_sensor_health(raw)
+        dbar = sensor.convert_pressure(raw)
+        sensor.check_pressure_value(dbar)
+        sensor.pressure_dbar = dbar
+        sensor.events.update(dbar, state[0], sensor.pump_working)
+        state[0] += 500
+        n = format_dbar(payload, dbar)
+        h = client._encode_publish(topic, payload_mv[:n], False, 1, 1)
+        client._buf[h:h + n] = payload_mv[:n]
+
+    return (
+        ("filter_median", filter_median),
+        ("convert_pressure", convert_pressure),
+        ("check_pressure_value", check_pressure_value),
+        ("send_data_format", send_data_format),
+        ("payload_binary", payload_binary),
+        ("mqtt_frame", mqtt_frame),
+        ("mqtt_callback", mqtt_callback),
+        ("end_to_end", end_to_end),
+    )
+
+
+def alloc_per_call(fn, n=200):
+    gc.collect()
+    if tracemalloc is not None:
+        # peak of a single call, the host has no running allocation counter
+        fn()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        peak = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+        return peak
+    if hasattr(gc, "mem_alloc"):
+        gc.disable()
+        start = gc.mem_alloc()
+        for _ in range(n):
+            fn()
+        used = gc.mem_alloc() - start
+        gc.enable()
+        return used // n
+    return 0
+
+
+def run_stage(fn, rounds=ROUNDS):
+    for _ in range(50):
+        fn()
+    times = []
+    total = now_us()
+    for _ in range(rounds):
+        t = now_us()
+        fn()
+        times.append(elapsed_us(t))
+    total = elapsed_us(total)
+    times.sort()
+    return {
+        "ops": int(rounds * 1000000 / total) if total else 0,
+        "p50_us": round(times[len(times) // 2], 2),
+        "p99_us": round(times[min(len(times) - 1, len(times) * 99 // 100)], 2),
+        "alloc": alloc_per_call(fn),
+    }
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """list of regression messages"""
+    problems = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if r["ops"] < base["ops"] * (1 - threshold):
+            problems.append("{}: {} ops/s, baseline {}".format(name, r["ops"], base["ops"]))
+        if r["p99_us"] > base["p99_us"] * (1 + threshold) + 1:
+            problems.append("{}: p99 {} us, baseline {}".format(name, r["p99_us"], base["p99_us"]))
+        if r["alloc"] > base["alloc"] * (1 + threshold) + 16:
+            problems.append("{}: {} bytes/call, baseline {}".format(name, r["alloc"], base["alloc"]))
+    return problems
+
+
+def main(argv):
+    results = {}
+    print("{:<22} {:>10} {:>9} {:>9} {:>10}".format("stage", "ops/s", "p50 us", "p99 us", "alloc B"))
+    for name, fn in make_stages():
+        r = run_stage(fn)
+        results[name] = r
+        print("{:<22} {:>10} {:>9} {:>9} {:>10}".format(name, r["ops"], r["p50_us"], r["p99_us"], r["alloc"]))
+    if "--save" in argv:
+        with open(argv[argv.index("--save") + 1], "w") as f:
+            json.dump(results, f)
+    if "--compare" in argv:
+        with open(argv[argv.index("--compare") + 1]) as f:
+            problems = compare(results, json.load(f))
+        for p in problems:
+            print("REGRESSION", p)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,56 @@
+import ssl
+
+
+class TlsContext(ssl.SSLContext):
+    """Client SSLContext for the broker, built once and kept by the MQTT client
+
+    The CA, certificate and key files are read and parsed here, not on every
+    connect. Where the ssl module can resume sessions (CPython, through the
+    wrap_bio() asyncio calls) the session of the last connection is handed
+    to the next handshake, which then skips the certificate exchange and
+    the key agreement; resumed counts the handshakes that did.
+    """
+
+    resume = True
+    session = None
+    resumed = 0
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and self.resume:
+            session = self.session
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+    def connected(self, writer):
+        """keep the session of a new connection, True when its handshake was resumed"""
+        try:
+            obj = writer.get_extra_info("ssl_object")
+        except (AttributeError, KeyError):
+            # MicroPython streams, no session API
+            return False
+        if obj is None:
+            return False
+        if self.resume:
+            self.session = obj.session
+        if obj.session_reused:
+            self.resumed += 1
+            return True
+        return False
+
+
+def make_context(ca=None, cert=None, key=None):
+    """TlsContext checking the broker against the CA file, with a client certificate if given
+
+    ca=None encrypts without checking who the broker is. On the ESP8266
+    the files are DER.
+    """
+    context = TlsContext(ssl.PROTOCOL_TLS_CLIENT)
+    if ca is None:
+        if hasattr(context, "check_hostname"):
+            context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    else:
+        context.verify_mode = ssl.CERT_REQUIRED
+        context.load_verify_locations(cafile=ca)
+    if cert is not None:
+        context.load_cert_chain(cert, key)
+    return context
@@ -0,0 +1,65 @@
+from array import array
+
+TABLE_SIZE = 1024   # 10 bit ADC
+
+
+def _linear(raw_value, raw_offset, max_pressure):
+    # https://forum.arduino.cc/index.php?topic=568567.0
+    full_scale = TABLE_SIZE - 1 - raw_offset
+    return round((raw_value - raw_offset) * max_pressure / full_scale, 1)
+
+
+def _curve(raw_value, curve):
+    # piecewise linear interpolation between (raw, bar) points, the end segments are extrapolated
+    i = 1
+    while i < len(curve) - 1 and raw_value > curve[i][0]:
+        i += 1
+    r0, p0 = curve[i - 1]
+    r1, p1 = curve[i]
+    return p0 + (raw_value - r0) * (p1 - p0) / (r1 - r0)
+
+
+def build_table(raw_offset, max_pressure, curve=None):
+    """Precompute pressure in deci-bars (0.1 bar) for every raw ADC value"""
+    return fill_table(array('h', [0] * TABLE_SIZE), raw_offset, max_pressure, curve)
+
+
+def fill_table(table, raw_offset, max_pressure, curve=None):
+    """build_table into an existing table, the controllers holding it see the new values"""
+    if curve:
+        curve = sorted(curve)
+        assert len(curve) > 1, "calibration curve needs at least 2 points"
+    for raw_value in range(TABLE_SIZE):
+        if curve:
+            pressure = _curve(raw_value, curve)
+        else:
+            pressure = _linear(raw_value, raw_offset, max_pressure)
+        dbar = int(round(pressure * 10))
+        table[raw_value] = max(-32768, min(32767, dbar))
+    return table
+
+
+def format_dbar(buf, dbar):
+    """Write deci-bars as ASCII bars ("-1.5", "12.0") into buf, return the length"""
+    i = 0
+    if dbar < 0:
+        buf[0] = 0x2d  # -
+        dbar = -dbar
+        i = 1
+    whole, frac = divmod(dbar, 10)
+    start = i
+    while True:
+        buf[i] = 0x30 + whole % 10
+        whole //= 10
+        i += 1
+        if not whole:
+            break
+    # digits were written backwards
+    j = i - 1
+    while start < j:
+        buf[start], buf[j] = buf[j], buf[start]
+        start += 1
+        j -= 1
+    buf[i] = 0x2e  # .
+    buf[i + 1] = 0x30 + frac
+    return i + 2
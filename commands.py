@@ -0,0 +1,143 @@
+import uasyncio as asyncio
+
+
+def topic_matches(topic_filter, topic):
+    """MQTT filter match for + and # wildcards, both bytes"""
+    f = 0
+    t = 0
+    nf = len(topic_filter)
+    nt = len(topic)
+    while f < nf:
+        c = topic_filter[f]
+        if c == 0x23:   # '#' matches the rest, including the parent level
+            return True
+        if c == 0x2b:   # '+' matches one level
+            while t < nt and topic[t] != 0x2f:
+                t += 1
+            f += 1
+            continue
+        if t >= nt or topic[t] != c:
+            # "a/#" matches "a" as well
+            return t == nt and topic_filter[f:] == b"/#"
+        f += 1
+        t += 1
+    return t == nt
+
+
+class CommandRouter:
+    """Routes incoming MQTT messages to handlers off the socket read path
+
+    dispatch() is called by the client reader task: a dict lookup on the
+    bytes topic (wildcard filters are only tried on a miss) and a slot in a
+    fixed size queue. run() calls the handlers, a handler may be a coroutine.
+
+    The client hands over memoryview slices of its receive buffer: an exact
+    topic is found by comparing it with the keys of the same length and the
+    key is queued instead, only the payload and wildcard topics are copied.
+    """
+
+    def __init__(self, size=8):
+        self._exact = {}
+        self._exact_topics = []     # the keys of _exact, for memoryview topics
+        self._wild = []             # (filter, handler)
+        self._handlers = [None] * size
+        self._topics = [None] * size
+        self._msgs = [None] * size
+        self._head = 0
+        self._count = 0
+        self._ready = asyncio.Event()
+        self.dropped = 0
+        self.unknown = 0
+
+    def add(self, topic_filter, handler):
+        """handler(topic, msg) for a bytes topic or filter with + / #"""
+        if b"+" in topic_filter or b"#" in topic_filter:
+            self._wild.append((topic_filter, handler))
+        else:
+            if topic_filter not in self._exact:
+                self._exact_topics.append(topic_filter)
+            self._exact[topic_filter] = handler
+
+    def remove(self, topic_filter):
+        if topic_filter in self._exact:
+            del self._exact[topic_filter]
+            self._exact_topics.remove(topic_filter)
+        else:
+            self._wild = [w for w in self._wild if w[0] != topic_filter]
+
+    def lookup(self, topic):
+        handler = self._exact.get(topic)
+        if handler is None:
+            for topic_filter, h in self._wild:
+                if topic_matches(topic_filter, topic):
+                    return h
+        return handler
+
+    def _key(self, topic):
+        """the registered bytes topic equal to a memoryview topic, None if there is none"""
+        n = len(topic)
+        for key in self._exact_topics:
+            if len(key) == n and key == topic:
+                return key
+        return None
+
+    def dispatch(self, topic, msg):
+        """queue the message for its handler, the client set_callback() target"""
+        if isinstance(topic, memoryview):
+            key = self._key(topic)
+            if key is not None:
+                topic = key
+                handler = self._exact[key]
+            else:
+                handler = None
+                for topic_filter, h in self._wild:
+                    if topic_matches(topic_filter, topic):
+                        handler = h
+                        topic = bytes(topic)
+                        break
+        else:
+            handler = self.lookup(topic)
+        if handler is None:
+            self.unknown += 1
+            return
+        size = len(self._handlers)
+        if self._count == size:
+            self.dropped += 1
+            return
+        i = self._head + self._count
+        if i >= size:
+            i -= size
+        self._handlers[i] = handler
+        self._topics[i] = topic
+        # the client buffer is reused once the callback returns
+        self._msgs[i] = bytes(msg) if isinstance(msg, memoryview) else msg
+        self._count += 1
+        self._ready.set()
+
+    def pop(self):
+        """oldest queued (handler, topic, msg), None when the queue is empty"""
+        if not self._count:
+            return None
+        i = self._head
+        item = self._handlers[i], self._topics[i], self._msgs[i]
+        self._handlers[i] = self._topics[i] = self._msgs[i] = None
+        self._head = 0 if i + 1 == len(self._handlers) else i + 1
+        self._count -= 1
+        return item
+
+    async def run(self, on_error=None):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._count:
+                handler, topic, msg = self.pop()
+                try:
+                    result = handler(topic, msg)
+                    if result is not None and hasattr(result, "send"):
+                        await result
+                except Exception as e:
+                    # a bad message must not stop the commands that come after it
+                    if on_error is not None:
+                        on_error(topic, e)
+                # one handler per slice
+                await asyncio.sleep_ms(0)
@@ -0,0 +1,235 @@
+import ustruct as struct
+
+from calibration import TABLE_SIZE
+
+try:
+    import uos as os
+except ImportError:
+    import os
+
+try:
+    from binascii import crc32
+except ImportError:
+    def crc32(data, crc=0):
+        crc ^= 0xffffffff
+        for b in data:
+            crc ^= b
+            for _ in range(8):
+                crc = (crc >> 1) ^ (0xedb88320 & -(crc & 1))
+        return crc ^ 0xffffffff
+
+# value kinds
+INT = 0
+DBAR = 1        # bars, stored as integer deci-bars
+STR = 2
+SECRET = 3      # a string that is never sent back on the config topic
+STRS = 4        # tuple of strings, stored , separated
+
+# SmartWaterSync arguments that can be stored, the key id is the index: only append
+KEYS = (
+    ("low_pressure", DBAR),
+    ("high_pressure", DBAR),
+    ("sensor_raw_offset", INT),
+    ("max_sensor_pressure", DBAR),
+    ("sample_period_ms", INT),
+    ("wifi_ssid", STR),
+    ("wifi_pass", SECRET),
+    ("mqtt_server", STR),
+    ("mqtt_port", INT),
+    ("mqtt_username", STR),
+    ("mqtt_password", SECRET),
+    ("mqtt_channels", STRS),
+    ("db_host", STR),
+    ("db_port", INT),
+    ("db_path", STR),
+)
+KEY_IDS = dict((name, i) for i, (name, _) in enumerate(KEYS))
+
+VERSION = 1
+MAGIC = b"WPCF"
+HEADER = "<4sBBHI"  # magic, version, entries, payload bytes, crc32 of the payload
+HEADER_SIZE = struct.calcsize(HEADER)
+ENTRY = "<BB"       # key id, value bytes
+
+
+class ConfigStore:
+    """Settings saved over <board_id>/cmd/config, they win over the SmartWaterSync arguments
+
+    One checksummed file on flash, read in one go at boot. save() writes
+    <path>.tmp and renames it over the file, a power cut leaves either the
+    old or the new settings. load() falls back to a complete .tmp (and puts
+    it in place), then to nothing: the arguments. `source` is the file the
+    settings came from, `corrupt` the copies that failed the checks.
+    """
+
+    def __init__(self, path="config.bin"):
+        self.path = path
+        self.values = {}
+        self.source = None
+        self.corrupt = 0
+
+    def load(self):
+        tmp = self.path + ".tmp"
+        for path in (self.path, tmp):
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            values = decode(data)
+            if values is None:
+                self.corrupt += 1
+                continue
+            if path == tmp:
+                # the rename did not happen
+                os.rename(tmp, self.path)
+            self.values = values
+            self.source = path
+            return values
+        self.values = {}
+        self.source = None
+        return self.values
+
+    def save(self, values):
+        """store these settings in place of the old ones"""
+        data = encode(values)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.rename(tmp, self.path)
+        self.values = values
+        self.source = self.path
+
+
+def encode(values):
+    """settings dict to the file bytes"""
+    payload = bytearray()
+    for name, value in values.items():
+        i = KEY_IDS[name]
+        raw = _pack(KEYS[i][1], value)
+        if len(raw) > 255:
+            raise ValueError("{} too long".format(name))
+        payload += struct.pack(ENTRY, i, len(raw))
+        payload += raw
+    return struct.pack(HEADER, MAGIC, VERSION, len(values), len(payload), crc32(payload)) + payload
+
+
+def decode(data):
+    """file bytes to a settings dict, None when they are not a complete config of this version"""
+    if len(data) < HEADER_SIZE:
+        return None
+    magic, version, entries, size, crc = struct.unpack_from(HEADER, data, 0)
+    if magic != MAGIC or version != VERSION or len(data) != HEADER_SIZE + size:
+        return None
+    payload = memoryview(data)[HEADER_SIZE:]
+    if crc32(payload) != crc:
+        return None
+    values = {}
+    i = 0
+    count = 0
+    while i < size:
+        key, n = struct.unpack_from(ENTRY, payload, i)
+        i += 2
+        if key < len(KEYS):
+            # a key a newer firmware added is skipped
+            name, kind = KEYS[key]
+            values[name] = _unpack(kind, bytes(payload[i:i + n]))
+        i += n
+        count += 1
+    if i != size or count != entries:
+        return None
+    return values
+
+
+def parse(msg):
+    """<name>=<value> lines of a config command to a settings dict
+
+    ValueError on an unknown key or a value the file cannot hold.
+    """
+    values = {}
+    for line in bytes(msg).decode().split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        if "=" not in line:
+            raise ValueError("no = in {}".format(line))
+        name, value = line.split("=", 1)
+        name = name.strip()
+        if name not in KEY_IDS:
+            raise ValueError("unknown setting {}".format(name))
+        kind = KEYS[KEY_IDS[name]][1]
+        value = value.strip()
+        try:
+            if kind == INT:
+                value = int(value)
+            elif kind == DBAR:
+                value = int(round(float(value) * 10)) / 10
+            elif kind == STRS:
+                value = tuple(s.strip() for s in value.split(","))
+        except OverflowError:
+            # inf
+            raise ValueError("{} out of range".format(name))
+        if kind in (INT, DBAR) and not -0x80000000 <= (value if kind == INT else value * 10) <= 0x7fffffff:
+            raise ValueError("{} out of range".format(name))
+        if len(_pack(kind, value)) > 255:
+            raise ValueError("{} too long".format(name))
+        values[name] = value
+    return values
+
+
+def check(values, max_period_ms):
+    """ValueError when a setting is out of its range or low_pressure is not below high_pressure
+
+    max_period_ms is the sample_max_period_ms of the board, a longer period
+    would leave a running pump unchecked that long.
+    """
+    for name in ("mqtt_port", "db_port"):
+        if name in values and not 0 < values[name] < 0x10000:
+            raise ValueError("{} out of range".format(name))
+    if "sensor_raw_offset" in values and not 0 <= values["sensor_raw_offset"] < TABLE_SIZE - 1:
+        raise ValueError("sensor_raw_offset out of range")
+    if "max_sensor_pressure" in values and not values["max_sensor_pressure"] > 0:
+        raise ValueError("max_sensor_pressure must be above 0")
+    if "sample_period_ms" in values:
+        if values["sample_period_ms"] < 10:
+            raise ValueError("period too short")
+        if values["sample_period_ms"] > max_period_ms:
+            raise ValueError("period above {} ms".format(max_period_ms))
+    if "low_pressure" in values and "high_pressure" in values:
+        if int(round(values["low_pressure"] * 10)) >= int(round(values["high_pressure"] * 10)):
+            raise ValueError("low must be below high")
+    if "mqtt_channels" in values:
+        channels = values["mqtt_channels"]
+        if len(channels) != 2 or not channels[0] or not channels[1]:
+            raise ValueError("mqtt_channels needs the reading and the relay topic")
+
+
+def format_values(values):
+    """settings as <name>=<value> lines, without the secrets"""
+    lines = []
+    for name, kind in KEYS:
+        if name in values and kind != SECRET:
+            value = values[name]
+            lines.append("{}={}".format(name, ",".join(value) if kind == STRS else value))
+    return "\n".join(lines).encode()
+
+
+def _pack(kind, value):
+    if kind == INT:
+        return struct.pack("<i", value)
+    if kind == DBAR:
+        return struct.pack("<i", int(round(value * 10)))
+    if kind == STRS:
+        value = ",".join(value)
+    return value.encode() if isinstance(value, str) else bytes(value)
+
+
+def _unpack(kind, raw):
+    if kind == INT:
+        return struct.unpack("<i", raw)[0]
+    if kind == DBAR:
+        return struct.unpack("<i", raw)[0] / 10
+    raw = raw.decode()
+    if kind == STRS:
+        return tuple(raw.split(","))
+    return raw
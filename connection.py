@@ -0,0 +1,222 @@
+from array import array
+
+import uasyncio as asyncio
+import usocket as socket
+import utime
+
+from rtc import sync as ntp_sync
+from umqtt_async import MQTTClient
+
+try:
+    from urandom import getrandbits
+except ImportError:
+    from random import getrandbits
+
+# ConnectionManager.state
+WIFI_DOWN = 0
+MQTT_DOWN = 1
+CONNECTED = 2
+STATE_NAMES = ("wifi_down", "mqtt_down", "connected")
+
+# ConnectionManager.counters
+RECONNECTS = 0      # successful connections after the first one
+FAILURES = 1        # failed WiFi or MQTT attempts
+RECOVER_MS = 2      # time to recover from the last drop
+RECOVER_MAX_MS = 3
+HANDSHAKE_MS = 4    # time the last connect took to open the connection, TLS handshake included
+HANDSHAKE_MAX_MS = 5
+RESUMED = 6         # TLS handshakes that resumed the previous session
+TLS_HEAP = 7        # heap held by the TLS session of the last connection
+COUNTERS = 8
+
+
+class ConnectionManager:
+    """One task that keeps WiFi and MQTT up
+
+    A lost connection is retried at once, consecutive failures back off
+    exponentially with jitter up to backoff_max_ms. The broker address is
+    resolved once (getaddrinfo blocks the loop) and again only after
+    resolve_after failures. Subscriptions are renewed on every connect and
+    on_connect() is awaited after them. server=None only keeps WiFi up.
+    With ssl (an SSLContext, see broker_tls.py) the broker certificate is
+    checked against server, not the resolved address.
+
+    Once WiFi is up the RTC is set from NTP, again every ntp_interval_ms
+    (the esp8266 RTC drifts) and a minute after a failed try;
+    on_clock(delta) gets the seconds it moved.
+    """
+
+    def __init__(self, wlan, client_id, server, port=0, user=None, password=None, ssid="", wifi_pass="",
+                 callback=None, subscriptions=(), on_connect=None, connect_timeout_ms=5000,
+                 wifi_timeout_ms=15000, backoff_ms=500, backoff_max_ms=60000, resolve_after=3,
+                 sleep_ms=asyncio.sleep_ms, on_clock=None, ntp_interval_ms=3600000, **client_kwargs):
+        self.wlan = wlan
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.ssid = ssid
+        self.wifi_pass = wifi_pass
+        self.callback = callback
+        self.subscriptions = list(subscriptions)
+        self.on_connect = on_connect
+        self.connect_timeout_ms = connect_timeout_ms
+        self.wifi_timeout_ms = wifi_timeout_ms
+        self.backoff_ms = backoff_ms
+        self.backoff_max_ms = backoff_max_ms
+        self.resolve_after = resolve_after
+        self._sleep_ms = sleep_ms
+        self.on_clock = on_clock
+        self.ntp_interval_ms = ntp_interval_ms
+        self._clock_due = None      # ticks_ms of the next NTP try, None: as soon as WiFi is up
+        self._client_kwargs = client_kwargs
+        self.client = None
+        self.state = WIFI_DOWN
+        self.counters = array('I', [0] * COUNTERS)
+        self._address = None
+        self._failures = 0          # in a row
+        self._down_since = utime.ticks_ms()
+        self._connected_once = False
+        self.last_error = None
+
+    @property
+    def connected(self):
+        return self.state == CONNECTED and self.client is not None and self.client.connected
+
+    def _recovered(self):
+        counters = self.counters
+        self.state = CONNECTED
+        recover = utime.ticks_diff(utime.ticks_ms(), self._down_since)
+        counters[RECOVER_MS] = recover
+        if recover > counters[RECOVER_MAX_MS]:
+            counters[RECOVER_MAX_MS] = recover
+        if self._connected_once:
+            counters[RECONNECTS] += 1
+        self._connected_once = True
+        self._failures = 0
+
+    def backoff(self):
+        """ms to wait after the current run of failures, 0 for the first retry"""
+        n = self._failures
+        if n == 0:
+            return 0
+        delay = self.backoff_ms << min(n - 1, 16)
+        if delay > self.backoff_max_ms:
+            delay = self.backoff_max_ms
+        # full delay spread over [delay / 2, delay) so a fleet does not retry in step
+        half = delay >> 1
+        return half + ((getrandbits(16) * half) >> 16)
+
+    def address(self):
+        if self._address is None:
+            self._address = socket.getaddrinfo(self.server, self.port or 1883)[0][-1][0]
+        return self._address
+
+    def reconfigure(self, server, port, user, password):
+        """another broker or login: the connection is dropped and made again with them"""
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self._address = None
+        client = self.client
+        if client is not None:
+            client.port = port or (8883 if client.ssl is not None else 1883)
+            client.server_hostname = server
+            client.user = user
+            client.pswd = password
+            # run() sees it closed and connects with the new settings
+            client.close()
+
+    def _failed(self, e):
+        self.last_error = e
+        self._failures += 1
+        self.counters[FAILURES] += 1
+        if self._failures % self.resolve_after == 0:
+            # the broker may have moved
+            self._address = None
+
+    def _lost(self):
+        if self.state == CONNECTED:
+            self._down_since = utime.ticks_ms()
+            self.state = MQTT_DOWN
+        if self.client is not None:
+            # the client is kept for its unacked QoS 1 frames, connect() sends them again
+            self.client.close()
+
+    async def _wifi(self):
+        wlan = self.wlan
+        wlan.active(True)
+        if self.ssid:
+            wlan.connect(self.ssid, self.wifi_pass)
+        else:
+            # credentials saved by the last successful connect
+            wlan.connect()
+        waited = 0
+        while not wlan.isconnected():
+            if waited >= self.wifi_timeout_ms:
+                raise OSError("wifi timeout")
+            await self._sleep_ms(100)
+            waited += 100
+
+    def _clock(self):
+        now = utime.ticks_ms()
+        if self.ntp_interval_ms <= 0 or (self._clock_due is not None and utime.ticks_diff(self._clock_due, now) > 0):
+            return
+        try:
+            delta = ntp_sync()
+        except OSError as e:
+            self.last_error = e
+            self._clock_due = utime.ticks_add(now, 60000)
+            return
+        self._clock_due = utime.ticks_add(now, self.ntp_interval_ms)
+        if self.on_clock is not None:
+            self.on_clock(delta)
+
+    async def _mqtt(self):
+        client = self.client
+        if client is None:
+            client = MQTTClient(self.client_id, self.address(), self.port, self.user, self.password,
+                                server_hostname=self.server, **self._client_kwargs)
+            client.set_callback(self.callback)
+            self.client = client
+        else:
+            client.server = self.address()
+        await asyncio.wait_for_ms(client.connect(), self.connect_timeout_ms)
+        counters = self.counters
+        counters[HANDSHAKE_MS] = client.handshake_ms
+        if client.handshake_ms > counters[HANDSHAKE_MAX_MS]:
+            counters[HANDSHAKE_MAX_MS] = client.handshake_ms
+        if client.tls_resumed:
+            counters[RESUMED] += 1
+        counters[TLS_HEAP] = client.tls_heap
+        for topic in self.subscriptions:
+            await client.subscribe(topic, timeout_ms=self.connect_timeout_ms)
+
+    async def run(self):
+        while True:
+            try:
+                if not self.wlan.isconnected():
+                    self._lost()
+                    self.state = WIFI_DOWN
+                    await self._wifi()
+                self._clock()
+                if self.server is None:
+                    if self.state != CONNECTED:
+                        self._recovered()
+                    await self._sleep_ms(self.wifi_timeout_ms)
+                    continue
+                if self.state != CONNECTED or not self.client.connected:
+                    self._lost()
+                    await self._mqtt()
+                    self._recovered()
+                    if self.on_connect is not None:
+                        await self.on_connect()
+                # sleeps until the reader task sees the connection go, WiFi is checked every wait
+                await self.client.wait_closed(self.wifi_timeout_ms)
+            except Exception as e:
+                # OSError, MQTTException, TimeoutError, or a setting the network stack refused
+                self._failed(e)
+                self._lost()
+                await self._sleep_ms(self.backoff())
@@ -0,0 +1,285 @@
+from array import array
+
+import uasyncio as asyncio
+import utime
+
+# PumpController.state fields
+LOW = 0             # start at or below, deci-bars
+HIGH = 1            # stop at or above, deci-bars
+SAFETY = 2          # stop at or above even during min_on_ms
+MIN_RAW = 3         # raw ADC value at or below is a sensor error
+MIN_ON_MS = 4
+MIN_OFF_MS = 5
+MAX_RUN_MS = 6      # 0 == no limit
+LOCKOUT_MS = 7      # pump stays off that long after MAX_RUN_MS was hit
+PUMP_ON = 8
+SWITCHED_AT = 9     # ticks_ms of the last relay change
+LOCKED_AT = 10      # ticks_ms when the max run time tripped, 0 == not locked
+SENSOR_ERROR = 11
+RAW = 12            # last filtered raw value
+DBAR = 13           # last pressure
+TICKS = 14          # number of control ticks
+INTERVAL = 15       # ms until the next tick
+MAX_INTERVAL = 16   # back off up to that while the pump is off and the pressure steady
+FLOOR = 17          # deci-bars above LOW that are sampled at full rate
+MOVE = 18           # change between two ticks, deci-bars, that counts as moving
+FORCE = 19          # relay command for the next tick: 0 none, FORCE_OFF, FORCE_ON
+LOCK = 20           # 1: the next tick locks the pump out
+FIELDS = 21
+
+# PumpController.state[FORCE]
+FORCE_OFF = 1
+FORCE_ON = 2
+
+# notifications for the publishing side
+EV_PUMP_OFF = 1
+EV_PUMP_ON = 2
+EV_SENSOR_ERROR = 3
+EV_MAX_RUN = 4
+EV_QUEUE = 8        # must be a power of 2
+
+
+class TimerLoop:
+    """Runs tick() from a one shot machine.Timer, armed again for interval_ms after every tick
+
+    tick() calls _arm() when _timer is set, whatever happened in it.
+    """
+
+    _timer = None
+
+    def _arm(self):
+        self._timer.init(period=max(1, self.interval_ms), mode=self._timer.ONE_SHOT, callback=self.tick)
+
+    def start(self, timer_id=-1):
+        """run tick() from a machine.Timer, False if there is no timer to use"""
+        try:
+            from machine import Timer
+            self._timer = Timer(timer_id)
+            self._arm()
+            return True
+        except (ImportError, AttributeError, ValueError, OSError):
+            self._timer = None
+            return False
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+
+    async def run(self, sleep_ms=asyncio.sleep_ms):
+        """fallback without a hardware timer"""
+        while True:
+            self.tick()
+            await sleep_ms(max(1, self.interval_ms))
+
+
+class PumpController(TimerLoop):
+    """Hysteresis pump control that owns the relay
+
+    tick() samples the ADC, checks the sensor, converts the reading and
+    switches the relay. It runs from a machine.Timer callback (or a tight
+    asyncio task when there is no timer) and never waits for the network:
+    relay changes are handed to the publishing side through a small
+    single producer / single consumer ring read with pop_event().
+
+    The tasks never switch the relay themselves: force() and lock_out()
+    leave a request in FORCE / LOCK that the next tick() carries out, so
+    the relay and the ring are only written between two ticks, never
+    halfway through one. A request waits at most one interval.
+
+    The tick interval is the sampler period while the pump runs, the
+    pressure moves or is within FLOOR of LOW, otherwise it doubles up to
+    MAX_INTERVAL.
+    """
+
+    def __init__(self, sampler, table, relay, low_dbar, high_dbar, min_raw,
+                 min_on_ms=0, min_off_ms=0, max_run_ms=0, lockout_ms=600000, safety_margin=5,
+                 max_interval_ms=0, floor_dbar=1, move_dbar=2):
+        self.sampler = sampler
+        self.table = table
+        self.relay = relay
+        self.state = array('i', [0] * FIELDS)
+        st = self.state
+        st[LOW] = low_dbar
+        st[HIGH] = high_dbar
+        st[SAFETY] = high_dbar + safety_margin
+        st[MIN_RAW] = min_raw
+        st[MIN_ON_MS] = min_on_ms
+        st[MIN_OFF_MS] = min_off_ms
+        st[MAX_RUN_MS] = max_run_ms
+        st[LOCKOUT_MS] = lockout_ms
+        st[INTERVAL] = sampler.period_ms
+        st[MAX_INTERVAL] = max(max_interval_ms, sampler.period_ms)
+        st[FLOOR] = floor_dbar
+        st[MOVE] = move_dbar
+        # min_off_ms does not delay the first start
+        st[SWITCHED_AT] = utime.ticks_add(utime.ticks_ms(), -min_off_ms)
+        self._events = bytearray(EV_QUEUE)
+        self._head = 0      # written by tick() only
+        self._tail = 0      # written by pop_event() only
+        self.relay.value(0)
+
+    @property
+    def pump_on(self):
+        return self.state[PUMP_ON] == 1
+
+    @property
+    def sensor_error(self):
+        return self.state[SENSOR_ERROR] == 1
+
+    @property
+    def dbar(self):
+        return self.state[DBAR]
+
+    @property
+    def raw(self):
+        return self.state[RAW]
+
+    @property
+    def interval_ms(self):
+        return self.state[INTERVAL]
+
+    def _notify(self, ev):
+        self._events[self._head & (EV_QUEUE - 1)] = ev
+        self._head = (self._head + 1) & 0xff
+
+    def pop_event(self):
+        """oldest notification or 0, older ones are lost if the reader falls EV_QUEUE behind"""
+        head = self._head
+        if self._tail == head:
+            return 0
+        if (head - self._tail) & 0xff > EV_QUEUE:
+            self._tail = (head - EV_QUEUE) & 0xff
+        ev = self._events[self._tail & (EV_QUEUE - 1)]
+        self._tail = (self._tail + 1) & 0xff
+        return ev
+
+    def _switch(self, on, now):
+        st = self.state
+        self.relay.value(1 if on else 0)
+        st[PUMP_ON] = 1 if on else 0
+        st[SWITCHED_AT] = now
+        self._notify(EV_PUMP_ON if on else EV_PUMP_OFF)
+
+    def force(self, on):
+        """manual relay command, carried out by the next tick()"""
+        self.state[FORCE] = FORCE_ON if on else FORCE_OFF
+
+    def lock_out(self):
+        """stop the pump and keep it off for LOCKOUT_MS from the next tick()"""
+        self.state[LOCK] = 1
+
+    def _lock_out(self, now):
+        self.state[LOCKED_AT] = now or 1
+        if self.state[PUMP_ON]:
+            self._switch(False, now)
+
+    def _requests(self, now):
+        # FORCE and LOCK are written by the tasks, a tick is never interrupted by them
+        st = self.state
+        if st[LOCK]:
+            st[LOCK] = 0
+            self._lock_out(now)
+        force = st[FORCE]
+        if force:
+            st[FORCE] = 0
+            on = force == FORCE_ON
+            if on and st[SENSOR_ERROR]:
+                return
+            if (st[PUMP_ON] == 1) != on:
+                self._switch(on, now)
+
+    def set_thresholds(self, low_dbar, high_dbar):
+        if low_dbar >= high_dbar:
+            raise ValueError("low must be below high")
+        st = self.state
+        st[SAFETY] += high_dbar - st[HIGH]
+        st[LOW] = low_dbar
+        st[HIGH] = high_dbar
+
+    def set_period(self, period_ms):
+        """new control / sampling period, restarts the timer if there is one
+
+        MAX_INTERVAL is the ceiling: a running pump is checked against HIGH
+        and SAFETY at least that often whatever a command asks for.
+        """
+        st = self.state
+        if period_ms < 10:
+            raise ValueError("period too short")
+        if period_ms > st[MAX_INTERVAL]:
+            raise ValueError("period above {} ms".format(st[MAX_INTERVAL]))
+        self.sampler.period_ms = period_ms
+        st[INTERVAL] = period_ms
+        if self._timer is not None:
+            self._arm()
+
+    def check_health(self, raw):
+        """stop the pump and hold it off while the sensor reads at or below MIN_RAW"""
+        st = self.state
+        if raw <= st[MIN_RAW]:
+            if not st[SENSOR_ERROR]:
+                st[SENSOR_ERROR] = 1
+                self._notify(EV_SENSOR_ERROR)
+            if st[PUMP_ON]:
+                self._switch(False, utime.ticks_ms())
+            else:
+                # whatever happened to the relay, keep it off
+                self.relay.value(0)
+            return False
+        # the filter has already smoothed out single bad readings
+        st[SENSOR_ERROR] = 0
+        return True
+
+    def decide(self, dbar, now=None):
+        """hysteresis between LOW and HIGH with min on / off and max run times"""
+        st = self.state
+        if now is None:
+            now = utime.ticks_ms()
+        st[DBAR] = dbar
+        if st[SENSOR_ERROR]:
+            return
+        elapsed = utime.ticks_diff(now, st[SWITCHED_AT])
+        if st[PUMP_ON]:
+            if dbar >= st[SAFETY] or (dbar >= st[HIGH] and elapsed >= st[MIN_ON_MS]):
+                self._switch(False, now)
+            elif st[MAX_RUN_MS] and elapsed >= st[MAX_RUN_MS]:
+                # runs too long without reaching HIGH: dry well or a big leak
+                self._lock_out(now)
+                self._notify(EV_MAX_RUN)
+        elif dbar <= st[LOW] and elapsed >= st[MIN_OFF_MS]:
+            if st[LOCKED_AT]:
+                if utime.ticks_diff(now, st[LOCKED_AT]) < st[LOCKOUT_MS]:
+                    return
+                st[LOCKED_AT] = 0
+            self._switch(True, now)
+
+    def tick(self, _=None):
+        """one control step: sample, check, convert, decide"""
+        st = self.state
+        try:
+            prev = st[DBAR]
+            self.sampler.sample()
+            raw = self.sampler.value()
+            st[RAW] = raw
+            st[TICKS] += 1
+            if st[FORCE] or st[LOCK]:
+                self._requests(utime.ticks_ms())
+            if self.check_health(raw):
+                if raw >= len(self.table):
+                    raw = len(self.table) - 1
+                self.decide(self.table[raw])
+            self._next_interval(prev)
+        finally:
+            # the timer is one shot, it must be armed again whatever happened
+            if self._timer is not None:
+                self._arm()
+
+    def _next_interval(self, prev):
+        st = self.state
+        dbar = st[DBAR]
+        period = self.sampler.period_ms
+        if (st[PUMP_ON] or st[SENSOR_ERROR] or dbar <= st[LOW] + st[FLOOR]
+                or dbar - prev >= st[MOVE] or prev - dbar >= st[MOVE]):
+            st[INTERVAL] = period
+        elif st[INTERVAL] < st[MAX_INTERVAL]:
+            st[INTERVAL] = min(st[INTERVAL] * 2, st[MAX_INTERVAL])
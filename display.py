@@ -0,0 +1,75 @@
+from calibration import format_dbar
+from outputs import Output, LATEST
+
+
+class LcdOutput(Output):
+    """latest reading and pump state on an I2cLcd, only changed characters are written
+
+    The screen is rendered into a frame buffer and compared with what the
+    display shows, every run of changed characters is one move_to() and one
+    putstr(). The I2C bus is slow: a full 4x20 redraw is 80 characters of
+    4 bit transfers.
+    """
+
+    def __init__(self, lcd, controller, rows=4, cols=20, names=()):
+        super().__init__(1, LATEST)
+        self.lcd = lcd
+        self.controller = controller
+        self.rows = rows
+        self.cols = cols
+        self.names = names          # ((event bit, bytes name), ...) shown on the third row
+        self._frame = bytearray(b" " * (rows * cols))
+        self._shown = bytearray(b" " * (rows * cols))
+        self._number = bytearray(8)
+        self.chars = 0              # characters written to the display
+
+    async def open(self):
+        self.lcd.clear()
+
+    def _put(self, row, text):
+        if row >= self.rows:
+            return
+        start = row * self.cols
+        n = min(len(text), self.cols)
+        frame = self._frame
+        frame[start:start + n] = text[:n]
+        for i in range(start + n, start + self.cols):
+            frame[i] = 0x20
+
+    def render(self, dbar, ev):
+        n = format_dbar(self._number, dbar)
+        self._put(0, b"Pressure " + bytes(self._number[:n]) + b" bar")
+        controller = self.controller
+        if controller.sensor_error:
+            self._put(1, b"SENSOR ERROR")
+        else:
+            self._put(1, b"Pump on" if controller.pump_on else b"Pump off")
+        alert = b""
+        for bit, name in self.names:
+            if ev & bit:
+                alert = name
+        self._put(2, alert)
+
+    async def send(self, ticks, dbar, ev):
+        self.render(dbar, ev)
+        self.redraw()
+
+    def redraw(self):
+        frame = self._frame
+        shown = self._shown
+        cols = self.cols
+        for row in range(self.rows):
+            col = 0
+            base = row * cols
+            while col < cols:
+                if frame[base + col] == shown[base + col]:
+                    col += 1
+                    continue
+                end = col + 1
+                while end < cols and frame[base + end] != shown[base + end]:
+                    end += 1
+                self.lcd.move_to(col, row)
+                self.lcd.putstr(bytes(frame[base + col:base + end]).decode())
+                shown[base + col:base + end] = frame[base + col:base + end]
+                self.chars += end - col
+                col = end
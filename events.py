@@ -0,0 +1,103 @@
+import utime
+
+# event bits returned by PressureEvents.update()
+EV_CHANGE = 0x01        # pressure moved more than the deadband since the last publish
+EV_LOW = 0x02           # fell through low_pressure, the pump is about to start
+EV_HIGH = 0x04          # rose through high_pressure, the pump is about to stop
+EV_RAPID_DROP = 0x08    # pressure falls faster than drop_rate (pipe burst, big consumer)
+EV_STUCK = 0x10         # pump runs but the reading does not move
+EV_HEARTBEAT = 0x20     # nothing happened for the heartbeat interval
+# from the pump cycle statistics, see anomaly.py
+EV_LEAK = 0x40          # the pump starts more often than it used to
+EV_DRY_RUN = 0x80       # the pump runs but does not raise the pressure
+
+EV_ALERTS = EV_LOW | EV_HIGH | EV_RAPID_DROP | EV_STUCK | EV_LEAK | EV_DRY_RUN
+NAMES = ((EV_LOW, b"low"), (EV_HIGH, b"high"), (EV_RAPID_DROP, b"rapid_drop"), (EV_STUCK, b"stuck"),
+         (EV_LEAK, b"leak"), (EV_DRY_RUN, b"dry_run"))
+
+
+class PressureEvents:
+    """Decide when a reading is worth publishing
+
+    Fed with every reading from pressure_check, keeps the rate of change in
+    deci-bars per second and fires events instead of a fixed poll. While
+    nothing happens the heartbeat interval doubles up to heartbeat_max_ms.
+    """
+
+    def __init__(self, low_dbar, high_dbar, deadband=2, drop_rate=10, stuck_ms=60000,
+                 heartbeat_min_ms=30000, heartbeat_max_ms=300000):
+        self.low = low_dbar
+        self.high = high_dbar
+        self.deadband = deadband
+        self.drop_rate = drop_rate
+        self.stuck_ms = stuck_ms
+        self.heartbeat_min_ms = heartbeat_min_ms
+        self.heartbeat_max_ms = heartbeat_max_ms
+        self.interval = heartbeat_min_ms
+        self.rate = 0               # deci-bars per second, smoothed
+        self.published = None       # last published deci-bars
+        self._prev = None
+        self._prev_ticks = 0
+        self._changed_ticks = 0
+        self._sent_ticks = 0
+        self._dropping = False
+        self._stuck = False
+        self._low_armed = True      # threshold events re-arm once pressure is a deadband away
+        self._high_armed = True
+
+    def update(self, dbar, now, pump_working):
+        """new reading taken at utime.ticks_ms() == now, return event bits (0 == nothing to send)"""
+        prev = self._prev
+        if prev is None:
+            self._prev = dbar
+            self._prev_ticks = self._changed_ticks = self._sent_ticks = now
+            return EV_CHANGE
+        ev = 0
+        dt = utime.ticks_diff(now, self._prev_ticks)
+        if dt > 0:
+            self.rate += ((dbar - prev) * 1000 // dt - self.rate) >> 1
+        self._prev = dbar
+        self._prev_ticks = now
+
+        if dbar <= self.low:
+            if self._low_armed:
+                self._low_armed = False
+                ev |= EV_LOW
+        elif dbar >= self.low + self.deadband:
+            self._low_armed = True
+        if dbar >= self.high:
+            if self._high_armed:
+                self._high_armed = False
+                ev |= EV_HIGH
+        elif dbar <= self.high - self.deadband:
+            self._high_armed = True
+
+        if self.rate <= -self.drop_rate:
+            if not self._dropping:
+                self._dropping = True
+                ev |= EV_RAPID_DROP
+        elif self.rate > -(self.drop_rate >> 1):
+            self._dropping = False
+
+        if dbar != prev:
+            self._changed_ticks = now
+            self._stuck = False
+        elif pump_working and not self._stuck and utime.ticks_diff(now, self._changed_ticks) >= self.stuck_ms:
+            self._stuck = True
+            ev |= EV_STUCK
+
+        if self.published is None or abs(dbar - self.published) >= self.deadband:
+            ev |= EV_CHANGE
+        if not ev and utime.ticks_diff(now, self._sent_ticks) >= self.interval:
+            ev = EV_HEARTBEAT
+        return ev
+
+    def sent(self, dbar, now, ev):
+        """the reading was published because of ev"""
+        self.published = dbar
+        self._sent_ticks = now
+        if ev & EV_HEARTBEAT:
+            interval = self.interval << 1
+            self.interval = interval if interval < self.heartbeat_max_ms else self.heartbeat_max_ms
+        else:
+            self.interval = self.heartbeat_min_ms
@@ -0,0 +1,110 @@
+from array import array
+
+
+def median(lst):
+    # return median from the list of values
+    quotient, remainder = divmod(len(lst), 2)
+    if remainder:
+        return sorted(lst)[quotient]
+    return sum(sorted(lst)[quotient - 1:quotient + 1]) / 2
+
+
+class MedianFilter:
+    """Sliding window median, the window is kept sorted on every push"""
+
+    def __init__(self, window=5):
+        self.window = window
+        self._ring = array('H', [0] * window)     # values in arrival order
+        self._sorted = array('H', [0] * window)   # the same values sorted
+        self._index = 0
+        self._count = 0
+
+    def push(self, raw):
+        srt = self._sorted
+        n = self._count
+        if n == self.window:
+            # evict the oldest value, shift the tail left
+            old = self._ring[self._index]
+            i = 0
+            while srt[i] != old:
+                i += 1
+            n -= 1
+            while i < n:
+                srt[i] = srt[i + 1]
+                i += 1
+        # insert the new value, shift the tail right
+        i = n
+        while i and srt[i - 1] > raw:
+            srt[i] = srt[i - 1]
+            i -= 1
+        srt[i] = raw
+        self._count = n + 1
+        self._ring[self._index] = raw
+        self._index += 1
+        if self._index == self.window:
+            self._index = 0
+
+    def value(self):
+        n = self._count
+        quotient, remainder = divmod(n, 2)
+        if remainder:
+            return self._sorted[quotient]
+        if not n:
+            return 0
+        return (self._sorted[quotient - 1] + self._sorted[quotient]) >> 1
+
+
+class EmaFilter:
+    """Integer exponential moving average, alpha == 1 / 2**shift"""
+
+    def __init__(self, shift=2):
+        self.shift = shift
+        self._acc = -1  # value << shift, -1 until the first push
+
+    def push(self, raw):
+        if self._acc < 0:
+            self._acc = raw << self.shift
+        else:
+            self._acc += raw - (self._acc >> self.shift)
+
+    def value(self):
+        if self._acc < 0:
+            return 0
+        return self._acc >> self.shift
+
+
+class KalmanFilter:
+    """1-D Kalman filter for a constant signal, fixed point so no floats are created"""
+    # state is kept in 1/16 of a raw unit, gain in Q12
+
+    def __init__(self, q=4, r=256):
+        self.q = q  # process noise
+        self.r = r  # measurement noise
+        self._x = -1
+        self._p = r
+
+    def push(self, raw):
+        if self._x < 0:
+            self._x = raw << 4
+            return
+        p = self._p + self.q
+        k = (p << 12) // (p + self.r)
+        self._x += (k * ((raw << 4) - self._x)) >> 12
+        self._p = ((4096 - k) * p) >> 12
+
+    def value(self):
+        if self._x < 0:
+            return 0
+        return (self._x + 8) >> 4
+
+
+def make_filter(name, window=5):
+    """return filter instance by the name: median, ema, kalman"""
+    if name == "median":
+        return MedianFilter(window)
+    if name == "ema":
+        return EmaFilter()
+    if name == "kalman":
+        return KalmanFilter()
+    # custom filter object with push() / value()
+    return name
@@ -0,0 +1,29 @@
+# Modules frozen into the firmware with mpy-cross, see README.md.
+# boot.py and main.py stay on the filesystem, main.py holds the configuration.
+include("$(PORT_DIR)/boards/manifest.py")
+
+# control loop, imported by sync at boot
+module("anomaly.py")
+module("calibration.py")
+module("config.py")
+module("controller.py")
+module("events.py")
+module("filters.py")
+module("sampler.py")
+module("sync.py")
+module("telemetry.py")
+module("zones.py")
+
+# output backends, imported when listed in output_channels, and drivers
+module("aggregate.py")
+module("ads1115.py")
+module("broker_tls.py")
+module("commands.py")
+module("connection.py")
+module("display.py")
+module("outputs.py")
+module("payload.py")
+module("readings.py")
+module("rtc.py")
+module("umqtt_async.py")
+module("uploader.py")
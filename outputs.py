@@ -0,0 +1,122 @@
+from array import array
+
+import uasyncio as asyncio
+import utime
+
+# Output.policy, what submit() does when the queue is full
+DROP_OLDEST = 0     # the oldest reading goes, its events are merged into the next one
+DROP_NEWEST = 1     # the new reading goes
+LATEST = 2          # one slot that is overwritten, events are merged
+
+
+class Output:
+    """Output backend with its own bounded queue and drain task
+
+    send_data() calls submit(), which never waits. run() opens the backend
+    and hands the queued readings to send() oldest first, then calls
+    flush(), so a slow backend only holds up its own queue. Backends
+    override open / send / flush / close.
+    """
+
+    def __init__(self, size=8, policy=DROP_OLDEST):
+        if policy == LATEST:
+            size = 1
+        self.size = size
+        self.policy = policy
+        self._ticks = array('I', [0] * size)
+        self._dbar = array('h', [0] * size)
+        self._ev = array('H', [0] * size)
+        self._head = 0
+        self._count = 0
+        self._ready = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+        self.lag_max_ms = 0         # longest time from submit() to the end of send()
+
+    def __len__(self):
+        return self._count
+
+    def submit(self, ticks, dbar, ev=0):
+        """queue a reading for the drain task"""
+        size = self.size
+        if self._count == size:
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return
+            head = self._head
+            if self.policy == LATEST:
+                ev |= self._ev[head]
+                self._count = 0
+            else:
+                nxt = head + 1 if head + 1 < size else 0
+                self._ev[nxt] |= self._ev[head]
+                self._head = nxt
+                self._count -= 1
+        i = self._head + self._count
+        if i >= size:
+            i -= size
+        self._ticks[i] = ticks & 0x3fffffff
+        self._dbar[i] = dbar
+        self._ev[i] = ev
+        self._count += 1
+        self._ready.set()
+
+    def pop(self):
+        """oldest queued (ticks, dbar, ev), None when the queue is empty"""
+        if not self._count:
+            return None
+        i = self._head
+        self._head = i + 1 if i + 1 < self.size else 0
+        self._count -= 1
+        return self._ticks[i], self._dbar[i], self._ev[i]
+
+    async def open(self):
+        pass
+
+    async def send(self, ticks, dbar, ev):
+        pass
+
+    async def flush(self):
+        """called when the queue is empty"""
+        pass
+
+    def close(self):
+        pass
+
+    async def run(self, telemetry=None, task=0):
+        await self.open()
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                started = utime.ticks_us()
+                try:
+                    while self._count:
+                        ticks, dbar, ev = self.pop()
+                        await self.send(ticks, dbar, ev)
+                        self.sent += 1
+                        lag = utime.ticks_diff(utime.ticks_ms() & 0x3fffffff, ticks)
+                        if lag > self.lag_max_ms:
+                            self.lag_max_ms = lag
+                    await self.flush()
+                except (OSError, ValueError):
+                    # the reading is gone, the next one may go through
+                    self.errors += 1
+                    if telemetry is not None:
+                        telemetry.error(task)
+                if telemetry is not None:
+                    telemetry.busy(task, started)
+        finally:
+            self.close()
+
+
+class MqttOutput(Output):
+    """readings to the broker through publish(dbar, ev), a coroutine function"""
+
+    def __init__(self, publish, size=8):
+        super().__init__(size, DROP_OLDEST)
+        self._publish = publish
+
+    async def send(self, ticks, dbar, ev):
+        await self._publish(dbar, ev)
@@ -0,0 +1,74 @@
+import ustruct as struct
+
+VERSION = 1
+HEADER = "<BBH"     # version, number of readings, sequence number
+HEADER_SIZE = struct.calcsize(HEADER)
+RECORD = "<IhHB"    # ticks_ms, deci-bars, raw ADC, flags
+RECORD_SIZE = struct.calcsize(RECORD)
+
+# reading flags
+FLAG_PUMP = 1
+FLAG_SENSOR_ERROR = 2
+FLAG_LOCKED = 4     # max run time tripped, the pump is locked out
+FLAG_NAMES = ((FLAG_PUMP, "pump"), (FLAG_SENSOR_ERROR, "sensor_error"), (FLAG_LOCKED, "locked"))
+
+
+class PayloadEncoder:
+    """Packs up to batch readings into one binary message
+
+    The buffer is allocated once, encode() returns a memoryview into it
+    that is valid until the next add().
+    """
+
+    def __init__(self, batch=1):
+        self.batch = batch
+        self.seq = 0
+        self.count = 0
+        self._buf = bytearray(HEADER_SIZE + batch * RECORD_SIZE)
+        self._mv = memoryview(self._buf)
+
+    def add(self, ts, dbar, raw, flags):
+        """store a reading, True when the batch is full"""
+        if self.count == self.batch:
+            # the caller did not take the full batch, the oldest message is lost
+            self.count = 0
+        struct.pack_into(RECORD, self._buf, HEADER_SIZE + self.count * RECORD_SIZE,
+                         ts & 0xffffffff, dbar, raw, flags)
+        self.count += 1
+        return self.count == self.batch
+
+    def encode(self):
+        """the readings added since the last call, None if there are none"""
+        n = self.count
+        if not n:
+            return None
+        struct.pack_into(HEADER, self._buf, 0, VERSION, n, self.seq)
+        self.seq = (self.seq + 1) & 0xffff
+        self.count = 0
+        return self._mv[:HEADER_SIZE + n * RECORD_SIZE]
+
+
+def decode(payload):
+    """binary payload to a dict, for the consuming side"""
+    if len(payload) < HEADER_SIZE:
+        raise ValueError("payload too short for the header")
+    version, n, seq = struct.unpack_from(HEADER, payload, 0)
+    if version != VERSION:
+        raise ValueError("unknown payload version {}".format(version))
+    if len(payload) < HEADER_SIZE + n * RECORD_SIZE:
+        raise ValueError("payload too short for {} readings".format(n))
+    readings = []
+    i = HEADER_SIZE
+    for _ in range(n):
+        ts, dbar, raw, flags = struct.unpack_from(RECORD, payload, i)
+        reading = {"ts": ts, "pressure": dbar / 10, "raw": raw, "flags": flags}
+        for bit, name in FLAG_NAMES:
+            reading[name] = bool(flags & bit)
+        readings.append(reading)
+        i += RECORD_SIZE
+    return {"version": version, "seq": seq, "readings": readings}
+
+
+def missing(prev_seq, seq):
+    """number of messages lost between two sequence numbers"""
+    return (seq - prev_seq - 1) & 0xffff
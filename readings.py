@@ -0,0 +1,191 @@
+import ustruct as struct
+
+from rtc import SET_AFTER, unix_time
+
+RECORD = "<Ih"              # unix time (s), pressure (deci-bars)
+RECORD_SIZE = struct.calcsize(RECORD)
+HEADER = "<4sHHH"           # magic, capacity, head, count
+HEADER_SIZE = struct.calcsize(HEADER)
+MAGIC = b"RQ01"
+
+
+class _FlashRing:
+    """Fixed size records in a preallocated file, only the slot and the header are rewritten"""
+
+    def __init__(self, path, capacity):
+        self.capacity = capacity
+        self.head = 0
+        self.count = 0
+        self.old = 0            # oldest records, written before this boot
+        self._rec = bytearray(RECORD_SIZE)
+        try:
+            self._f = open(path, "r+b")
+        except OSError:
+            # no file yet
+            self._f = open(path, "w+b")
+        header = self._f.read(HEADER_SIZE)
+        if len(header) == HEADER_SIZE:
+            magic, cap, head, count = struct.unpack(HEADER, header)
+            if magic == MAGIC and cap == capacity and head < cap and count <= cap:
+                self.head = head
+                self.count = count
+                self.old = count
+                return
+        self._format()
+
+    def _format(self):
+        self._f.seek(0)
+        self._f.write(struct.pack(HEADER, MAGIC, self.capacity, 0, 0))
+        chunk = bytes(RECORD_SIZE * 16)
+        left = self.capacity
+        while left > 0:
+            n = 16 if left > 16 else left
+            self._f.write(chunk[:n * RECORD_SIZE])
+            left -= n
+        self.head = 0
+        self.count = 0
+        self._f.flush()
+
+    def _save_header(self):
+        self._f.seek(0)
+        self._f.write(struct.pack(HEADER, MAGIC, self.capacity, self.head, self.count))
+        self._f.flush()
+
+    def push(self, ts, dbar):
+        """append a record, return False if the oldest one had to be overwritten"""
+        dropped = self.count == self.capacity
+        slot = self.head + self.count
+        if slot >= self.capacity:
+            slot -= self.capacity
+        struct.pack_into(RECORD, self._rec, 0, ts, dbar)
+        self._f.seek(HEADER_SIZE + slot * RECORD_SIZE)
+        self._f.write(self._rec)
+        if dropped:
+            self.head = slot + 1 if slot + 1 < self.capacity else 0
+            if self.old:
+                self.old -= 1
+        else:
+            self.count += 1
+        self._save_header()
+        return not dropped
+
+    def peek(self):
+        self._f.seek(HEADER_SIZE + self.head * RECORD_SIZE)
+        self._f.readinto(self._rec)
+        return struct.unpack(RECORD, self._rec)
+
+    def pop(self):
+        self.head += 1
+        if self.head == self.capacity:
+            self.head = 0
+        self.count -= 1
+        if self.old:
+            self.old -= 1
+        self._save_header()
+
+    def shift(self, delta):
+        """add delta to the times of this boot taken before the clock was set"""
+        f = self._f
+        rec = self._rec
+        for i in range(self.old, self.count):
+            slot = self.head + i
+            if slot >= self.capacity:
+                slot -= self.capacity
+            f.seek(HEADER_SIZE + slot * RECORD_SIZE)
+            f.readinto(rec)
+            ts, dbar = struct.unpack(RECORD, rec)
+            if ts < SET_AFTER:
+                struct.pack_into(RECORD, rec, 0, ts + delta, dbar)
+                f.seek(HEADER_SIZE + slot * RECORD_SIZE)
+                f.write(rec)
+        f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+class ReadingQueue:
+    """Bounded store-and-forward queue of timestamped readings
+
+    The newest readings are kept in a RAM ring of fixed size records, when it
+    is full the oldest record spills to the flash ring (if a path is given).
+    When everything is full the oldest reading is dropped.
+
+    Readings are stamped with the unix time. The RTC starts at its epoch on
+    every boot, clock_set() fixes the readings taken before NTP set it.
+    Those of an earlier boot cannot be fixed, peek() gives them time 0.
+    """
+
+    def __init__(self, capacity=32, path=None, flash_capacity=512):
+        self.capacity = capacity
+        self._buf = bytearray(capacity * RECORD_SIZE)
+        self._head = 0
+        self._count = 0
+        self.flash = _FlashRing(path, flash_capacity) if path else None
+        self.dropped = 0
+        self.replayed = 0
+
+    def __len__(self):
+        if self.flash:
+            return self._count + self.flash.count
+        return self._count
+
+    def append(self, dbar, ts=None):
+        if ts is None:
+            ts = unix_time()
+        if self._count == self.capacity:
+            # RAM is full: move the oldest record to flash or drop it
+            if self.flash:
+                old_ts, old_dbar = struct.unpack_from(RECORD, self._buf, self._head * RECORD_SIZE)
+                if not self.flash.push(old_ts, old_dbar):
+                    self.dropped += 1
+            else:
+                self.dropped += 1
+            self._head += 1
+            if self._head == self.capacity:
+                self._head = 0
+            self._count -= 1
+        slot = self._head + self._count
+        if slot >= self.capacity:
+            slot -= self.capacity
+        struct.pack_into(RECORD, self._buf, slot * RECORD_SIZE, ts, dbar)
+        self._count += 1
+
+    def peek(self):
+        """oldest (unix time, deci-bars) or None, flash records are older than RAM ones
+
+        The time is 0 when the reading was taken before the clock was set.
+        """
+        if self.flash and self.flash.count:
+            ts, dbar = self.flash.peek()
+        elif self._count:
+            ts, dbar = struct.unpack_from(RECORD, self._buf, self._head * RECORD_SIZE)
+        else:
+            return None
+        return (ts if ts >= SET_AFTER else 0), dbar
+
+    def clock_set(self, delta):
+        """the RTC moved by delta seconds, move the readings of this boot taken before it was set"""
+        buf = self._buf
+        for i in range(self._count):
+            slot = self._head + i
+            if slot >= self.capacity:
+                slot -= self.capacity
+            ts, dbar = struct.unpack_from(RECORD, buf, slot * RECORD_SIZE)
+            if ts < SET_AFTER:
+                struct.pack_into(RECORD, buf, slot * RECORD_SIZE, ts + delta, dbar)
+        if self.flash:
+            self.flash.shift(delta)
+
+    def pop(self):
+        """remove the oldest reading, call it once the reading returned by peek() is delivered"""
+        if self.flash and self.flash.count:
+            self.flash.pop()
+        elif self._count:
+            self._head += 1
+            if self._head == self.capacity:
+                self._head = 0
+            self._count -= 1
+        else:
+            return
+        self.replayed += 1
@@ -0,0 +1,27 @@
+import utime
+
+# seconds from 1970-01-01 to the epoch of utime.time(): 2000-01-01 on the esp8266
+EPOCH_OFFSET = 946684800 if utime.localtime(0)[0] == 2000 else 0
+# unix times before 2020-01-01 were taken before the RTC was set, it starts at its epoch on every boot
+SET_AFTER = 1577836800
+
+
+def unix_time():
+    """seconds since 1970-01-01, only meaningful once is_set()"""
+    return utime.time() + EPOCH_OFFSET
+
+
+def is_set():
+    return unix_time() >= SET_AFTER
+
+
+def sync():
+    """set the RTC from NTP, return the seconds it moved, OSError when the server did not answer
+
+    ntptime blocks the event loop for up to a second, the pump controller
+    runs from its timer meanwhile.
+    """
+    import ntptime
+    before = unix_time()
+    ntptime.settime()
+    return unix_time() - before
@@ -0,0 +1,70 @@
+from array import array
+
+import utime
+
+
+class AdcSampler:
+    """ADC sampling into a preallocated ring buffer, sample() is called by PumpController.tick()"""
+
+    def __init__(self, adc, size=5, period_ms=50, sensor_filter=None):
+        self.adc = adc
+        self.filter = sensor_filter
+        self.size = size
+        self.period_ms = period_ms
+        # raw values and utime.ticks_ms() of every sample, oldest is overwritten first
+        self.samples = array('H', [0] * size)
+        self.ticks = array('L', [0] * size)
+        self.index = 0
+        self.count = 0
+        self.errors = 0
+
+    def sample(self):
+        """take a single ADC reading and store it in the ring buffer"""
+        try:
+            raw_value = self.adc.read()
+        except OSError:
+            # 0 is below any sensor_min_raw_for_error so the health check will switch the pump off
+            raw_value = 0
+            self.errors += 1
+        i = self.index
+        self.samples[i] = raw_value
+        self.ticks[i] = utime.ticks_ms()
+        if self.filter is not None:
+            self.filter.push(raw_value)
+        i += 1
+        self.index = 0 if i == self.size else i
+        if self.count < self.size:
+            self.count += 1
+        return raw_value
+
+    def value(self):
+        """current filtered value, the latest raw reading if there is no filter"""
+        if not self.count:
+            self.sample()
+        if self.filter is None:
+            return self.samples[self.index - 1]
+        return self.filter.value()
+
+    def jitter(self):
+        """max deviation (ms) of the interval between buffered samples from period_ms
+
+        Only meaningful while the controller samples at period_ms (pump on,
+        pressure moving or near LOW), it backs off when the pressure is steady.
+        """
+        n = self.count
+        if n < 2:
+            return 0
+        # walk from the oldest sample to the newest one
+        start = self.index if n == self.size else 0
+        worst = 0
+        prev = self.ticks[start]
+        for k in range(1, n):
+            i = start + k
+            if i >= self.size:
+                i -= self.size
+            t = self.ticks[i]
+            d = abs(utime.ticks_diff(t, prev) - self.period_ms)
+            if d > worst:
+                worst = d
+            prev = t
+        return worst
@@ -0,0 +1,15 @@
+"""Host simulation of the pressure sensor board
+
+    import sim
+    report = sim.simulate("leak", seconds=7200, output_channels=("mqtt", "db"))
+    print(report.format())
+
+or from the shell: python3 -m sim --scenario leak --seconds 7200
+
+sim.install() only registers the fake machine / network / urequests / utime /
+uasyncio modules, for scripts that drive the firmware modules themselves.
+"""
+from sim.clock import Clock, new_event_loop
+from sim.fakes import Board, install
+from sim.model import RecordedTrace, WaterSystem, scenario
+from sim.runner import simulate
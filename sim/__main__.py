@@ -0,0 +1,24 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sim.runner import simulate  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run SmartWaterSync against a simulated board")
+    parser.add_argument("--scenario", default="pump_cycles",
+                        choices=("pump_cycles", "leak", "sensor_fault", "stuck_sensor", "dry_run", "burst"))
+    parser.add_argument("--trace", help='replay a recorded "<ms>,<raw>" CSV instead of the model')
+    parser.add_argument("--seconds", type=float, default=3600)
+    parser.add_argument("--outputs", default="mqtt", help="comma separated output_channels")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    report = simulate(args.scenario, args.seconds, tuple(args.outputs.split(",")), args.trace, args.seed)
+    print(report.format())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""In-process MQTT 3.1.1 broker stand-in for the asyncio clients"""
+import asyncio
+import os
+import ssl
+import struct
+import subprocess
+
+
+def topic_matches(pattern, topic):
+    """MQTT topic filter match with + and # wildcards, both bytes"""
+    p = pattern.split(b"/")
+    t = topic.split(b"/")
+    for i, level in enumerate(p):
+        if level == b"#":
+            return True
+        if i >= len(t) or (level != b"+" and level != t[i]):
+            return False
+    return len(p) == len(t)
+
+
+class FakeBroker:
+    """Counts packets per topic, can delay answers and drop connections
+
+    latency_s delays every answer (CONNACK, PUBACK, SUBACK, PINGRESP),
+    ignore_pings stops answering PINGREQ (half open connection), refuse
+    closes new connections right away (broker restarting). With ssl (see
+    server_context) it terminates TLS like a broker on port 8883. A client
+    that sends nothing for 1.5 times its keepalive is dropped, counted in
+    keepalive_drops.
+    """
+
+    def __init__(self, latency_s=0.0, ssl=None):
+        self.latency_s = latency_s
+        self.ssl = ssl
+        self.ignore_pings = False
+        self.refuse = False
+        self.refused = 0
+        self.connections = 0
+        self.published = []         # (t, topic, payload, qos, dup)
+        self.pings = 0
+        self.keepalive_drops = 0
+        self._clients = {}          # writer -> [topic filters]
+        self._handlers = set()
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._handle, host, port, ssl=self.ssl)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.drop_all()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._handlers:
+            # TLS connections take a few more loop turns to close
+            await asyncio.wait(self._handlers, timeout=1)
+
+    def count(self, topic=None):
+        if topic is None:
+            return len(self.published)
+        return sum(1 for p in self.published if p[1] == topic)
+
+    def drop_all(self):
+        """close every client connection without a word, like a broker restart"""
+        for w in list(self._clients):
+            w.close()
+        self._clients.clear()
+
+    def send(self, topic, payload, qos=0):
+        """deliver a PUBLISH to every subscribed client"""
+        for w, filters in self._clients.items():
+            if any(topic_matches(f, topic) for f in filters):
+                body = struct.pack("!H", len(topic)) + topic
+                if qos:
+                    body += b"\0\1"
+                w.write(bytes([0x30 | qos << 1]) + _encode_len(len(body) + len(payload)) + body + payload)
+
+    async def _answer(self, w, data):
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        if not w.is_closing():
+            w.write(data)
+
+    async def _handle(self, r, w):
+        if self.refuse:
+            self.refused += 1
+            w.close()
+            return
+        self.connections += 1
+        self._clients[w] = []
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        loop = asyncio.get_event_loop()
+        limit = None
+        try:
+            while True:
+                try:
+                    h = (await asyncio.wait_for(r.readexactly(1), limit))[0]
+                except asyncio.TimeoutError:
+                    self.keepalive_drops += 1
+                    break
+                n = 0
+                sh = 0
+                while True:
+                    b = (await r.readexactly(1))[0]
+                    n |= (b & 0x7f) << sh
+                    sh += 7
+                    if not b & 0x80:
+                        break
+                body = await r.readexactly(n) if n else b""
+                kind = h & 0xf0
+                if kind == 0x10:
+                    keepalive = struct.unpack("!H", body[8:10])[0]
+                    limit = keepalive * 1.5 if keepalive else None
+                    asyncio.ensure_future(self._answer(w, b"\x20\x02\0\0"))
+                elif kind == 0x30:
+                    tl = struct.unpack("!H", body[:2])[0]
+                    pos = 2 + tl
+                    qos = (h >> 1) & 3
+                    if qos:
+                        asyncio.ensure_future(self._answer(w, b"\x40\x02" + body[pos:pos + 2]))
+                        pos += 2
+                    self.published.append((loop.time(), body[2:2 + tl], body[pos:], qos, bool(h & 8)))
+                elif kind == 0x80:
+                    pos = 2
+                    while pos < len(body):
+                        tl = struct.unpack("!H", body[pos:pos + 2])[0]
+                        self._clients.setdefault(w, []).append(body[pos + 2:pos + 2 + tl])
+                        pos += 3 + tl
+                    asyncio.ensure_future(self._answer(w, b"\x90\x03" + body[:2] + b"\0"))
+                elif kind == 0xc0:
+                    self.pings += 1
+                    if not self.ignore_pings:
+                        asyncio.ensure_future(self._answer(w, b"\xd0\0"))
+                elif kind == 0xe0:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            # a TLS client still writing when drop_all() closed it
+            pass
+        finally:
+            self._handlers.discard(task)
+            self._clients.pop(w, None)
+            w.close()
+
+
+def self_signed(directory, bits=2048):
+    """cert.pem and key.pem for localhost / 127.0.0.1 made with the openssl tool, return their paths
+
+    RSA, the ESP8266 TLS stack has no elliptic curves.
+    """
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    if not os.path.exists(cert):
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:%d" % bits, "-nodes", "-days", "30",
+                        "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+                        "-keyout", key, "-out", cert], check=True, capture_output=True)
+    return cert, key
+
+
+def server_context(cert, key):
+    """SSLContext for FakeBroker(ssl=...), session tickets on"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+def _encode_len(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7f
+        n >>= 7
+        out.append(b | 0x80 if n else b)
+        if not n:
+            return bytes(out)
@@ -0,0 +1,56 @@
+"""Virtual clock and an asyncio event loop that runs on it"""
+import asyncio
+import selectors
+import time
+
+
+class Clock:
+    """Seconds since the simulated boot, real time or virtual"""
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self._start = time.monotonic()
+        self._t = 0.0
+        self.wakeups = 0            # times the loop went idle and a timer woke it up
+
+    def time(self):
+        if self.realtime:
+            return time.monotonic() - self._start
+        return self._t
+
+    def advance(self, seconds):
+        """blocking sleep: moves the virtual clock, or really sleeps in real time mode"""
+        if seconds <= 0:
+            return
+        self.wakeups += 1
+        if self.realtime:
+            time.sleep(seconds)
+        else:
+            self._t += seconds
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    # never wait for real: when nothing is ready jump the clock to the next timer
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # only sockets to wait for, give the other side of loopback a moment
+            return super().select(0.01)
+        self.clock.advance(timeout)
+        return []
+
+
+def new_event_loop(clock):
+    """asyncio loop whose time() is the clock, timers fire as soon as the loop is idle"""
+    if clock.realtime:
+        return asyncio.new_event_loop()
+    loop = asyncio.SelectorEventLoop(_VirtualSelector(clock))
+    loop.time = clock.time
+    return loop
@@ -0,0 +1,390 @@
+"""CPython stand-ins for the MicroPython modules used by the firmware
+
+Every fake reads and records its state on the current Board, so a test or
+the simulation runner can drive the ADC, drop WiFi and inspect relay timing.
+"""
+import asyncio
+import socket
+import struct
+import sys
+import types
+
+from sim.clock import Clock
+
+TICKS_MASK = 0x3fffffff         # esp8266 ticks wrap at 2**30
+TICKS_HALF = 0x20000000
+EPOCH = 1700000000              # unix time of the simulated boot, what ntptime sets the RTC to
+Y2K = 946684800                 # utime.time() counts from 2000-01-01 on the esp8266
+
+BOARD = None
+
+
+class Board:
+    """State of the simulated board: ADC sources, pin history, WiFi link and HTTP log"""
+
+    def __init__(self, clock=None):
+        self.clock = clock or Clock()
+        self.adc_sources = {}       # adc id -> callable(t_seconds) -> raw value
+        self.pins = {}              # pin id -> FakePin
+        self.wifi_available = True
+        self.wifi_connect_s = 2.0   # time to associate
+        self.http_requests = []     # (t, method, url)
+        self.resets = 0
+        self.sleep_type = 0         # esp.sleep_type()
+        self.lcd = None             # the I2cLcd created by the firmware
+        self.rtc = 0                # utime.time() at boot: 2000-01-01 until ntptime.settime()
+        self.ntp_available = True
+
+    def ms(self):
+        return int(self.clock.time() * 1000)
+
+    def read_adc(self, pin):
+        source = self.adc_sources.get(pin)
+        if source is None:
+            return 0
+        return max(0, min(1024, int(source(self.clock.time()))))
+
+    def pin_value(self, pin):
+        p = self.pins.get(pin)
+        return p.value() if p else 0
+
+    def pin_history(self, pin):
+        p = self.pins.get(pin)
+        return p.history if p else []
+
+
+# machine
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    IRQ_FALLING = 2
+    IRQ_RISING = 1
+
+    def __new__(cls, id, mode=-1, pull=-1, value=None):
+        # the same pin id is the same pin, like on the board
+        pin = BOARD.pins.get(id)
+        if pin is None:
+            pin = super().__new__(cls)
+            pin.id = id
+            pin._value = 0
+            pin.history = []    # (ms, value) on every change
+            BOARD.pins[id] = pin
+        return pin
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        if value is not None:
+            self.value(value)
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        v = 1 if v else 0
+        if v != self._value or not self.history:
+            self.history.append((BOARD.ms(), v))
+        self._value = v
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+
+class ADC:
+    def __init__(self, pin):
+        self.pin = pin
+
+    def read(self):
+        return BOARD.read_adc(self.pin)
+
+    def read_u16(self):
+        return BOARD.read_adc(self.pin) << 6
+
+
+class I2C:
+    def __init__(self, *args, **kwargs):
+        self.writes = []
+
+    def scan(self):
+        return []
+
+    def writeto(self, addr, buf, stop=True):
+        self.writes.append((addr, bytes(buf)))
+        return len(buf)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        for i in range(len(buf)):
+            buf[i] = 0
+
+    def writeto_mem(self, addr, reg, buf):
+        self.writes.append((addr, bytes([reg]) + bytes(buf)))
+
+    def readfrom_mem_into(self, addr, reg, buf):
+        self.readfrom_into(addr, buf)
+
+
+class I2cLcd:
+    """esp8266_i2c_lcd.I2cLcd, keeps the screen and counts the characters sent"""
+
+    def __init__(self, i2c, addr, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.screen = [[" "] * cols for _ in range(rows)]
+        self.x = 0
+        self.y = 0
+        self.chars = 0
+        self.moves = 0
+        BOARD.lcd = self
+
+    def backlight_on(self):
+        pass
+
+    def clear(self):
+        self.screen = [[" "] * self.cols for _ in range(self.rows)]
+        self.x = self.y = 0
+
+    def move_to(self, x, y):
+        self.x, self.y = x, y
+        self.moves += 1
+
+    def putstr(self, text):
+        for c in text:
+            if self.x < self.cols and self.y < self.rows:
+                self.screen[self.y][self.x] = c
+            self.x += 1
+            self.chars += 1
+
+    def lines(self):
+        return ["".join(row) for row in self.screen]
+
+
+class Timer:
+    """Software timer on the running event loop, callbacks run between tasks like soft IRQs"""
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1):
+        self.id = id
+        self._handle = None
+
+    def init(self, mode=PERIODIC, period=-1, callback=None, freq=-1):
+        self.deinit()
+        if freq > 0:
+            period = 1000 // freq
+        loop = asyncio.get_event_loop()
+
+        def fire():
+            if mode == Timer.PERIODIC:
+                self._handle = loop.call_later(period / 1000, fire)
+            else:
+                self._handle = None
+            callback(self)
+        self._handle = loop.call_later(period / 1000, fire)
+
+    def deinit(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+def _machine_reset():
+    BOARD.resets += 1
+    raise SystemExit("machine.reset()")
+
+
+def _make_machine():
+    m = types.ModuleType("machine")
+    m.Pin = Pin
+    m.ADC = ADC
+    m.I2C = I2C
+    m.Timer = Timer
+    m.reset = _machine_reset
+    m.freq = lambda *args: 80000000
+    m.unique_id = lambda: b"\x00sim"
+    m.idle = lambda: None
+    return m
+
+
+# network
+
+class WLAN:
+    _ifaces = {}
+
+    def __new__(cls, iface=0):
+        wlan = cls._ifaces.get(iface)
+        if wlan is None:
+            wlan = super().__new__(cls)
+            wlan.iface = iface
+            wlan._active = False
+            wlan._connect_at = None
+            cls._ifaces[iface] = wlan
+        return wlan
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = bool(value)
+
+    def connect(self, ssid=None, password=None):
+        self._connect_at = BOARD.clock.time() + BOARD.wifi_connect_s
+
+    def disconnect(self):
+        self._connect_at = None
+
+    def isconnected(self):
+        return (self._active and BOARD.wifi_available and self._connect_at is not None and
+                BOARD.clock.time() >= self._connect_at)
+
+    def ifconfig(self):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+    def status(self, *args):
+        return 5 if self.isconnected() else 0
+
+
+def _make_network():
+    m = types.ModuleType("network")
+    m.STA_IF = 0
+    m.AP_IF = 1
+    m.WLAN = WLAN
+    return m
+
+
+# urequests
+
+class Response:
+    def __init__(self, status_code=200, content=b""):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def close(self):
+        pass
+
+
+def _request(method, url, data=None, json=None, headers=None):
+    if not WLAN(0).isconnected():
+        raise OSError(-1)
+    BOARD.http_requests.append((BOARD.clock.time(), method, url))
+    return Response()
+
+
+def _make_urequests():
+    m = types.ModuleType("urequests")
+    m.request = _request
+    m.get = lambda url, **kw: _request("GET", url, **kw)
+    m.post = lambda url, **kw: _request("POST", url, **kw)
+    m.Response = Response
+    return m
+
+
+# utime
+
+def _make_utime():
+    m = types.ModuleType("utime")
+
+    def ticks_ms():
+        return int(BOARD.clock.time() * 1000) & TICKS_MASK
+
+    def ticks_us():
+        return int(BOARD.clock.time() * 1000000) & TICKS_MASK
+
+    def ticks_add(ticks, delta):
+        return (ticks + delta) & TICKS_MASK
+
+    def ticks_diff(a, b):
+        return ((a - b + TICKS_HALF) & TICKS_MASK) - TICKS_HALF
+
+    m.ticks_ms = ticks_ms
+    m.ticks_us = ticks_us
+    m.ticks_cpu = ticks_us
+    m.ticks_add = ticks_add
+    m.ticks_diff = ticks_diff
+    m.sleep_ms = lambda ms: BOARD.clock.advance(ms / 1000)
+    m.sleep_us = lambda us: BOARD.clock.advance(us / 1000000)
+    m.sleep = lambda s: BOARD.clock.advance(s)
+    m.time = lambda: BOARD.rtc + int(BOARD.clock.time())
+    m.localtime = lambda secs=None: tuple(__import__("time").gmtime(Y2K + (m.time() if secs is None else secs)))[:8]
+    return m
+
+
+# ntptime
+
+def _settime():
+    if not (WLAN(0).isconnected() and BOARD.ntp_available):
+        raise OSError(110)
+    BOARD.rtc = EPOCH - Y2K
+
+
+def _make_ntptime():
+    m = types.ModuleType("ntptime")
+    m.host = "pool.ntp.org"
+    m.settime = _settime
+    return m
+
+
+# uasyncio
+
+def _make_uasyncio():
+    m = types.ModuleType("uasyncio")
+    m.__dict__.update((k, v) for k, v in vars(asyncio).items() if not k.startswith("__"))
+
+    async def sleep_ms(ms):
+        await asyncio.sleep(ms / 1000)
+
+    async def wait_for_ms(aw, timeout):
+        return await asyncio.wait_for(aw, timeout / 1000)
+
+    async def readinto(self, buf):
+        data = await self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    m.sleep_ms = sleep_ms
+    m.wait_for_ms = wait_for_ms
+    # uasyncio.Stream.readinto(), CPython streams only have read()
+    asyncio.StreamReader.readinto = readinto
+    return m
+
+
+def _make_esp():
+    m = types.ModuleType("esp")
+    m.osdebug = lambda *args: None
+    m.SLEEP_NONE, m.SLEEP_LIGHT, m.SLEEP_MODEM = 0, 1, 2
+
+    def sleep_type(*args):
+        if args:
+            BOARD.sleep_type = args[0]
+        return BOARD.sleep_type
+    m.sleep_type = sleep_type
+    return m
+
+
+def install(board=None, clock=None):
+    """register the fakes in sys.modules, return the Board they work on"""
+    global BOARD
+    BOARD = board or Board(clock)
+    if "machine" not in sys.modules or not hasattr(sys.modules["machine"], "Pin"):
+        sys.modules["machine"] = _make_machine()
+        sys.modules["network"] = _make_network()
+        sys.modules["urequests"] = _make_urequests()
+        sys.modules["utime"] = _make_utime()
+        sys.modules["uasyncio"] = _make_uasyncio()
+        sys.modules["ntptime"] = _make_ntptime()
+        sys.modules["esp"] = _make_esp()
+        sys.modules["usocket"] = socket
+        sys.modules["ustruct"] = struct
+        lcd = types.ModuleType("esp8266_i2c_lcd")
+        lcd.I2cLcd = I2cLcd
+        sys.modules["esp8266_i2c_lcd"] = lcd
+    WLAN._ifaces.clear()
+    return BOARD
@@ -0,0 +1,66 @@
+"""Keep-alive HTTP server stand-in that counts connections and requests"""
+import asyncio
+
+
+class FakeHttpServer:
+    def __init__(self, status=200, reply=None):
+        self.status = status
+        self.reply = reply          # raw response bytes instead of the Content-Length one
+        self.delay_s = 0            # after the status line and first header of a response
+        self.connections = 0
+        self.requests = []          # (method, path, body)
+        self._server = None
+        self._writers = set()
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for w in list(self._writers):
+            w.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, r, w):
+        self.connections += 1
+        self._writers.add(w)
+        try:
+            while True:
+                line = await r.readline()
+                if not line:
+                    break
+                method, path = line.split()[:2]
+                length = 0
+                close = False
+                while True:
+                    h = await r.readline()
+                    if not h or h == b"\r\n":
+                        break
+                    h = h.lower()
+                    if h.startswith(b"content-length:"):
+                        length = int(h[15:])
+                    elif h.startswith(b"connection:") and b"close" in h:
+                        close = True
+                body = await r.readexactly(length) if length else b""
+                self.requests.append((method, path, body))
+                if self.reply is not None:
+                    reply = self.reply
+                else:
+                    reply = b"HTTP/1.1 %d OK\r\nContent-Length: 2\r\n\r\nok" % self.status
+                if self.delay_s:
+                    i = reply.find(b"\n", reply.find(b"\n") + 1) + 1
+                    w.write(reply[:i])
+                    await w.drain()
+                    await asyncio.sleep(self.delay_s)
+                    reply = reply[i:]
+                w.write(reply)
+                await w.drain()
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(w)
+            w.close()
@@ -0,0 +1,111 @@
+"""Sensor traces: a closed loop water system model and a recorded trace replayer"""
+import random
+
+
+class WaterSystem:
+    """Pressure in a pipe with a pump and consumers, seen through the sensor ADC
+
+    The pump (relay pin high) adds pump_rate bar/s, consumers take usage(t)
+    bar/s. faults is a list of (start_s, end_s, kind) with kind one of
+    "disconnected" (raw 0), "stuck" (the raw value freezes), "dry" (the pump
+    runs but adds nothing) and "leak" (extra constant usage).
+    """
+
+    def __init__(self, board, relay_pin=14, pressure=4.5, pump_rate=0.05, usage=None,
+                 raw_offset=43, max_pressure=12, noise=2, leak_rate=0.004, faults=(), seed=1):
+        self.board = board
+        self.relay_pin = relay_pin
+        self.pressure = pressure
+        self.pump_rate = pump_rate
+        self.usage = usage or (lambda t: 0.003)
+        self.raw_offset = raw_offset
+        self.max_pressure = max_pressure
+        self.noise = noise
+        self.leak_rate = leak_rate
+        self.faults = list(faults)
+        self._rand = random.Random(seed)
+        self._t = 0.0
+        self._stuck_raw = None
+
+    def fault(self, t):
+        for start, end, kind in self.faults:
+            if start <= t < end:
+                return kind
+        return None
+
+    def step(self, t):
+        dt = t - self._t
+        if dt <= 0:
+            return
+        self._t = t
+        fault = self.fault(t)
+        rate = -self.usage(t)
+        if fault == "leak":
+            rate -= self.leak_rate
+        if self.board.pin_value(self.relay_pin) and fault != "dry":
+            # the pump gets weaker close to its max head
+            rate += self.pump_rate * (1 - self.pressure / (self.max_pressure * 0.8))
+        self.pressure = max(0.0, self.pressure + rate * dt)
+
+    def raw(self, t):
+        self.step(t)
+        fault = self.fault(t)
+        if fault == "disconnected":
+            return 0
+        value = self.raw_offset + self.pressure * (1023 - self.raw_offset) / self.max_pressure
+        value += self._rand.uniform(-self.noise, self.noise)
+        if fault == "stuck":
+            if self._stuck_raw is None:
+                self._stuck_raw = value
+            return self._stuck_raw
+        self._stuck_raw = None
+        return value
+
+
+def household_usage(t):
+    """bar/s taken by consumers: quiet nights, busy mornings and evenings, a shower now and then"""
+    hour = (t / 3600) % 24
+    base = 0.002 if hour < 6 or hour > 23 else 0.006
+    if 7 <= hour < 8 or 19 <= hour < 21:
+        base = 0.015
+    if int(t / 60) % 37 == 0:
+        base += 0.03
+    return base
+
+
+class RecordedTrace:
+    """Open loop replay of "<ms>,<raw>" lines, the last value is held at the end"""
+
+    def __init__(self, path):
+        self.points = []
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    ms, raw = line.split(",")[:2]
+                    self.points.append((int(ms) / 1000, int(raw)))
+        self._i = 0
+
+    def raw(self, t):
+        points = self.points
+        if t < points[self._i][0]:
+            self._i = 0
+        while self._i + 1 < len(points) and points[self._i + 1][0] <= t:
+            self._i += 1
+        return points[self._i][1]
+
+
+def scenario(name, board, relay_pin=14, seed=1):
+    """ready made sensor sources: pump_cycles, leak, sensor_fault, stuck_sensor, dry_run, burst"""
+    faults = {
+        "pump_cycles": (),
+        "leak": ((1800, 10 ** 9, "leak"),),
+        "sensor_fault": ((1800, 1860, "disconnected"),),
+        "stuck_sensor": ((1800, 2400, "stuck"),),
+        "dry_run": ((1800, 10 ** 9, "dry"),),
+        "burst": ((1800, 1830, "leak"),),
+    }[name]
+    model = WaterSystem(board, relay_pin, usage=household_usage, faults=faults, seed=seed)
+    if name == "burst":
+        model.leak_rate = 0.3
+    return model
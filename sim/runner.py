@@ -0,0 +1,158 @@
+"""Run SmartWaterSync on the simulated board faster than real time"""
+import asyncio
+import time
+
+from sim.broker import FakeBroker
+from sim.clock import Clock, new_event_loop
+from sim.fakes import Board, install
+from sim.httpd import FakeHttpServer
+from sim.model import RecordedTrace, scenario
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class LagProbe:
+    """Sleeps period_ms in a loop and records how late it wakes up, in ms"""
+
+    def __init__(self, clock, period_ms=50):
+        self.clock = clock
+        self.period_ms = period_ms
+        self.lags = []
+
+    async def run(self):
+        while True:
+            start = self.clock.time()
+            await asyncio.sleep(self.period_ms / 1000)
+            self.lags.append(max(0.0, (self.clock.time() - start) * 1000 - self.period_ms))
+
+
+class Report:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def format(self):
+        on = self.pump_on_periods
+        lines = [
+            "simulated {:.0f} s in {:.2f} s wall ({:.0f}x)".format(self.seconds, self.wall_s, self.speedup),
+            "relay: {} switches, pump on {:.0f} s ({:.1f}%)".format(
+                len(self.relay_switches), self.pump_on_s, 100 * self.pump_on_s / self.seconds),
+        ]
+        if on:
+            lines.append("  pump run min/avg/max: {:.0f} / {:.0f} / {:.0f} s".format(
+                min(on), sum(on) / len(on), max(on)))
+        lines.append("mqtt: {} connections, {} publishes".format(self.mqtt_connections, sum(self.publishes.values())))
+        for topic, n in sorted(self.publishes.items()):
+            lines.append("  {:<40} {:>6}".format(topic, n))
+        lines.append("http: {} connections, {} requests".format(self.http_connections, self.http_requests))
+        lines.append("loop lag ms: p50 {:.1f}  p99 {:.1f}  max {:.1f}".format(
+            self.lag_p50_ms, self.lag_p99_ms, self.lag_max_ms))
+        return "\n".join(lines)
+
+
+async def _run(board, clock, seconds, output_channels, sync_kwargs, setup, lag_probe_ms, broker_ssl):
+    import sync
+
+    broker = FakeBroker(ssl=broker_ssl)
+    mqtt_port = await broker.start()
+    httpd = FakeHttpServer()
+    http_port = await httpd.start()
+    kwargs = dict(mqtt_server="127.0.0.1", mqtt_port=mqtt_port, db_host="127.0.0.1", db_port=http_port,
+                  output_channels=output_channels)
+    kwargs.update(sync_kwargs)
+    sensor = sync.SmartWaterSync(**kwargs)
+    if setup is not None:
+        setup(sensor, broker, board)
+    probe = LagProbe(clock, lag_probe_ms)
+    if lag_probe_ms:
+        asyncio.ensure_future(probe.run())
+
+    wall = time.perf_counter()
+    await sensor.run()
+    await asyncio.sleep(seconds)
+    wall = time.perf_counter() - wall
+
+    # close the server side first so the connection handlers end on their own
+    await broker.stop()
+    await httpd.stop()
+    for _ in range(3):
+        await asyncio.sleep(0)
+    tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    pending = tasks
+    while pending:
+        for t in pending:
+            t.cancel()
+        # CPython 3.11 wait_for() loses a cancel that comes with a refused connect, the task retries
+        _, pending = await asyncio.wait(pending, timeout=1)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return sensor, broker, httpd, probe, wall
+
+
+def simulate(scenario_name="pump_cycles", seconds=3600, output_channels=("mqtt",), trace=None, seed=1,
+             relay_pin=14, setup=None, lag_probe_ms=50, board_setup=None, broker_ssl=None, **sync_kwargs):
+    """run the firmware for seconds of virtual time, return a Report
+
+    trace is a "<ms>,<raw>" CSV to replay instead of the scenario model,
+    board_setup(board) is called before SmartWaterSync is created (more ADC
+    sources), setup(sensor, broker, board) before the tasks are started,
+    lag_probe_ms=0 turns the loop lag probe off (it wakes the loop up),
+    broker_ssl is a server SSLContext for the broker, see
+    sim.broker.server_context; set mqtt_tls=True for the firmware side.
+    """
+    clock = Clock()
+    board = install(Board(clock))
+    source = RecordedTrace(trace) if trace else scenario(scenario_name, board, relay_pin, seed)
+    board.adc_sources[0] = source.raw
+    sync_kwargs.setdefault("pump_relay", relay_pin)
+    if board_setup is not None:
+        board_setup(board)
+
+    loop = new_event_loop(clock)
+    asyncio.set_event_loop(loop)
+    try:
+        sensor, broker, httpd, probe, wall = loop.run_until_complete(
+            _run(board, clock, seconds, output_channels, sync_kwargs, setup, lag_probe_ms, broker_ssl))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    switches = [(ms, v) for ms, v in board.pin_history(relay_pin)[1:]]
+    periods = []
+    started = None
+    for ms, v in board.pin_history(relay_pin):
+        if v and started is None:
+            started = ms
+        elif not v and started is not None:
+            periods.append((ms - started) / 1000)
+            started = None
+    pump_on_s = sum(periods) + ((seconds * 1000 - started) / 1000 if started is not None else 0)
+    publishes = {}
+    for _, topic, _, _, _ in broker.published:
+        topic = topic.decode()
+        publishes[topic] = publishes.get(topic, 0) + 1
+    return Report(
+        scenario=scenario_name if not trace else trace,
+        seconds=seconds,
+        wall_s=wall,
+        speedup=seconds / wall if wall else 0,
+        relay_switches=switches,
+        pump_on_periods=periods,
+        pump_on_s=pump_on_s,
+        publishes=publishes,
+        mqtt_connections=broker.connections,
+        http_connections=httpd.connections,
+        http_requests=len(httpd.requests),
+        lag_p50_ms=percentile(probe.lags, 50),
+        lag_p99_ms=percentile(probe.lags, 99),
+        lag_max_ms=max(probe.lags) if probe.lags else 0,
+        sensor=sensor,
+        board=board,
+        broker=broker,
+    )
@@ -1,14 +1,23 @@
-import math
-
 import machine
-import network
-from umqtt_simple import MQTTClient
 import uasyncio as asyncio
-import urequests
 import gc
 import utime
+# only what the control loop needs is imported here, the output backends are
+# imported by _setup_outputs() when they are listed in output_channels
+from sampler import AdcSampler
+from filters import make_filter
+from calibration import build_table, format_dbar, TABLE_SIZE
+from events import PressureEvents, EV_ALERTS, EV_DRY_RUN, NAMES as EVENT_NAMES
+from controller import PumpController, EV_PUMP_ON, EV_PUMP_OFF, EV_SENSOR_ERROR, EV_MAX_RUN, LOCKED_AT, MAX_INTERVAL
+from telemetry import (Telemetry, TASK_TICKER, TASK_MQTT, TASK_PRESSURE, TASK_SEND,
+                       TASK_SAMPLER, TASK_UPLOADER, TASK_COMMANDS, TASK_PUBLISH, TASK_DB, TASK_DISPLAY,
+                       TASK_ZONES, TASK_SUMMARY)
+from zones import Zone, ZoneLoop
+from anomaly import CycleMonitor
 
 DEBUG = False
+LCD_ROWS = 4
+LCD_COLS = 20
 
 
 def _print(txt):
@@ -16,18 +25,20 @@ def _print(txt):
         print(txt)
 
 
-def median(lst):
-    # return median from the list of values
-    quotient, remainder = divmod(len(lst), 2)
-    if remainder:
-        return sorted(lst)[quotient]
-    return sum(sorted(lst)[quotient - 1:quotient + 1]) / 2
+# telemetry task of each output backend
+OUTPUT_TASKS = {"mqtt": TASK_PUBLISH, "db": TASK_DB, "display": TASK_DISPLAY}
+
+
+def _topic(topic):
+    return topic.encode() if isinstance(topic, str) else bytes(topic)
 
 
 class SmartWaterSync:
-    """Sync class"""
-    wlan = network.WLAN(network.AP_IF)
-    wlan.active(False)
+    """Sync class
+
+    The constructor sets up the control loop and takes the first reading
+    before the output backends are imported, see _setup_outputs.
+    """
 
     def __init__(self,
                  wifi_ssid="",
@@ -52,11 +63,68 @@ class SmartWaterSync:
                  sensor_voltage_offset=0.45,    # default sensor output voltage
                  sensor_raw_offset=43,          # default raw value
                  sensor_min_raw_for_error=30,   # min raw value when we should call ERROR and reset the system
+                 calibration_curve=None,        # optional ((raw, bar), ...) points instead of the linear formula
+                 sample_window=5,               # number of ADC readings kept for filtering
+                 sample_period_ms=50,           # delay between two ADC readings, also the control loop period
+                 sample_max_period_ms=1000,     # backed off up to that while the pump is off and pressure steady
+                 sample_floor_dbar=1,           # always sample at full rate that close above low_pressure
+                 sample_move_dbar=2,            # change between two samples that brings the full rate back
+                 power_mode=None,               # esp8266 sleep between wakeups: None, "modem" or "light"
+                 sensor_filter="median",        # possible: median, ema, kalman or own object with push() / value()
+                 queue_size=32,                 # readings kept in RAM while mqtt is down
+                 queue_path=None,               # flash file for older readings, e.g. "readings.bin"
+                 queue_flash_size=512,          # readings kept in the flash file
+                 replay_batch=8,                # queued readings sent per event loop slice after reconnect
+                 payload_format="text",         # possible: text, binary, both; binary goes to <mqtt_channels[0]>/bin
+                 payload_batch=1,               # readings per binary message, alerts flush earlier
+                 db_host="192.168.10.10",       # 'db' output: readings are POSTed in batches
+                 db_port=80,
+                 db_path="/water/pressure",
+                 db_batch=16,                   # flush when that many readings are waiting
+                 db_max_age_ms=60000,           # or when the oldest one is that old
+                 event_deadband=2,              # publish when pressure moved that many deci-bars
+                 rapid_drop_rate=10,            # deci-bars per second that count as a rapid drop
+                 stuck_ms=60000,                # pump runs and the reading does not move that long
+                 heartbeat_min_ms=30000,        # heartbeat interval right after an event
+                 heartbeat_max_ms=300000,       # heartbeat interval when pressure is steady
+                 pump_min_on_ms=0,              # pump stays on at least that long unless the safety margin is hit
+                 pump_min_off_ms=0,             # and off at least that long before the next start
+                 pump_max_run_ms=0,             # stop and lock out a pump that runs longer, 0 == no limit
+                 pump_lockout_ms=600000,
+                 control_timer=-1,              # machine.Timer id for the control loop, None == asyncio task
+                 connect_timeout_ms=5000,       # broker connect / subscribe timeout
+                 mqtt_keepalive=60,             # seconds, PINGREQ after half of it quiet either way, dropped with no answer in the other half
+                 mqtt_inflight=4,               # QoS 1 publishes sent before the first PUBACK is needed
+                 mqtt_tls=False,                # TLS to the broker, usually with mqtt_port=8883, see broker_tls.py
+                 mqtt_ca=None,                  # CA file the broker certificate is checked against, None == not
+                 mqtt_cert=None,                # client certificate and key files, for brokers that want one
+                 mqtt_key=None,
+                 backoff_max_ms=60000,          # longest wait between two failed connection attempts
+                 telemetry=False,               # per task loop stats, published on <board_id>/stats
+                 stats_period_ms=60000,
+                 zones=(),                      # more tanks on the same board, see _zone()
+                 zone_batch_ms=2000,            # extra zone readings are collected that long into one message
+                 summary_windows=(60, 900, 3600),   # seconds, see send_summaries, () == no summaries
+                 dry_run_ms=30000,              # a running pump must raise the pressure every that long, 0 == off
+                 dry_run_cut=True,              # and is locked out for pump_lockout_ms when it does not
+                 leak_sigma=3,                  # std deviations of the daily fall floor that are a leak, 0 == off
+                 leak_window_ms=86400000,       # one floor per day
+                 anomaly_learn_cycles=10,       # pump runs to learn the usual pressure gain from
+                 config=None,                   # config.ConfigStore that <board_id>/cmd/config saves to
                  ):
 
+        if config is not None:
+            from config import check
+            # the saved settings against the arguments they were merged with, see from_config
+            values = dict(config.values)
+            values["low_pressure"] = low_pressure
+            values["high_pressure"] = high_pressure
+            check(values, sample_max_period_ms)
+
         if output_channels is None:
             output_channels = ('mqtt',)
 
+        self.config = config
         self.wifi_ssid = wifi_ssid
         self.wifi_pass = wifi_pass
         self.mqtt_server = mqtt_server
@@ -64,9 +132,24 @@ class SmartWaterSync:
         self.mqtt_username = mqtt_username
         self.mqtt_password = mqtt_password
         self.mqtt_channels = mqtt_channels
+        # topics are encoded once, payload is formatted into a preallocated buffer
+        self._topics = tuple(_topic(topic) for topic in mqtt_channels)
+        self._payload = bytearray(8)
+        self._payload_mv = memoryview(self._payload)
+        self._replay_topic = self._topics[0] + b"/replay"
+        self._binary_topic = self._topics[0] + b"/bin"
+        self._payload_format = payload_format
+        self._payload_batch = payload_batch
+        self._event_topic = self._topics[0] + b"/event"
+        self._stats_topic = _topic(board_id) + b"/stats"
+        self._config_topic = _topic(board_id) + b"/config"
+        # <board_id>/cmd/<command>, see _setup_commands
+        self._command_topic = _topic(board_id) + b"/cmd/"
+
+        # event loop instrumentation, costs nothing when disabled
+        self.telemetry = Telemetry(telemetry)
+        self._stats_period_ms = stats_period_ms
         self.board_id = board_id
-        self.mqtt_client = None
-        self.wlan = network.WLAN(network.STA_IF)
         self.board_led = machine.Pin(board_led, machine.Pin.OUT)
         self.board_led.value(1)
 
@@ -90,37 +173,221 @@ class SmartWaterSync:
         self._max_sensor_pressure = max_sensor_pressure
         self._sensor_voltage_offset = sensor_voltage_offset
         self._sensor_raw_offset = sensor_raw_offset
+        self._calibration_curve = calibration_curve
+        # everything below works with integer deci-bars (0.1 bar)
+        self._low_dbar = int(round(low_pressure * 10))
+        self._high_dbar = int(round(high_pressure * 10))
+        self._pressure_table = build_table(sensor_raw_offset, max_sensor_pressure, calibration_curve)
 
-        self.adc = machine.ADC(self._adc_pin)
+        # change driven publishing: pressure_check sets the event, send_data waits for it
+        self.events = PressureEvents(self._low_dbar, self._high_dbar, event_deadband, rapid_drop_rate,
+                                     stuck_ms, heartbeat_min_ms, heartbeat_max_ms)
+        self._pending_events = 0
+        self._data_ready = asyncio.Event()
 
-        # init first values from sensor
-        self._current_pressure = self.convert_pressure(self.adc.read())
-        self._last_pressure = self.convert_pressure(self.adc.read())
+        self.adc = machine.ADC(self._adc_pin)
+        self.sampler = AdcSampler(self.adc, sample_window, sample_period_ms,
+                                  make_filter(sensor_filter, sample_window))
 
-        self._sensor_error = False
-        self._pump_working = False
-        # setup
+        # the controller owns the relay, everything else only reads its state
         self.pump_relay = machine.Pin(self._pump_relay, machine.Pin.OUT)
+        self.controller = PumpController(self.sampler, self._pressure_table, self.pump_relay,
+                                         self._low_dbar, self._high_dbar, self._min_raw_value,
+                                         pump_min_on_ms, pump_min_off_ms, pump_max_run_ms, pump_lockout_ms,
+                                         max_interval_ms=sample_max_period_ms, floor_dbar=sample_floor_dbar,
+                                         move_dbar=sample_move_dbar)
+        self._control_timer = control_timer
+        self._power_mode = power_mode
+        self._dry_run_cut = dry_run_cut
+
+        # zone 0 is the sensor and relay above with mqtt_channels, the others publish their readings
+        # together on <board_id>/zones and take relay commands on <board_id>/<name>/relay
+        self.zones = [Zone(_topic(board_id), self.controller, self.events, self._topics[0], self._topics[1],
+                           CycleMonitor(dry_run_ms, leak_sigma, anomaly_learn_cycles, leak_window_ms))]
+        for zone_config in zones:
+            zone = self._zone(zone_config, sample_window, sample_period_ms, sensor_filter,
+                              pump_min_on_ms, pump_min_off_ms, pump_max_run_ms, pump_lockout_ms,
+                              sample_max_period_ms, sample_floor_dbar, sample_move_dbar,
+                              event_deadband, rapid_drop_rate, stuck_ms, heartbeat_min_ms,
+                              heartbeat_max_ms)
+            zone.anomaly = CycleMonitor(dry_run_ms, leak_sigma, anomaly_learn_cycles, leak_window_ms)
+            self.zones.append(zone)
+        self._zones_topic = _topic(board_id) + b"/zones"
+        self._zones_ready = asyncio.Event()
+        self._zone_batch_ms = zone_batch_ms
+        # one "<name>,<bars>,<pump>\n" line per zone
+        self._zones_buf = bytearray(sum(len(zone.name) + 9 for zone in self.zones[1:]))
+        self._zones_mv = memoryview(self._zones_buf)
+
+        # first reading and relay decision before anything is loaded for the outputs
+        for zone in self.zones:
+            zone.controller.tick()
+        self.boot_first_reading_ms = utime.ticks_ms()
+        self._current_pressure = self._last_pressure = self.controller.dbar
+
+        self._summary_ready = asyncio.Event()
+        self._summary_query = False
+        self._setup_outputs(queue_size, queue_path, queue_flash_size, replay_batch, db_host, db_port, db_path,
+                            db_batch, db_max_age_ms, connect_timeout_ms, mqtt_keepalive, mqtt_inflight,
+                            backoff_max_ms, summary_windows, mqtt_tls, mqtt_ca, mqtt_cert, mqtt_key)
+        gc.collect()
+        self.boot_mem_free = gc.mem_free() if hasattr(gc, "mem_free") else 0
+        self.boot_ms = utime.ticks_ms()
 
+    @classmethod
+    def from_config(cls, path="config.bin", **kwargs):
+        """SmartWaterSync with the settings saved by <board_id>/cmd/config over kwargs, see config.py"""
+        from config import ConfigStore
+        store = ConfigStore(path)
+        values = store.load()
+        merged = dict(kwargs)
+        merged.update(values)
+        try:
+            # the constructor checks the saved settings first, nothing is built when they fail
+            return cls(config=store, **merged)
+        except ValueError as e:
+            if not values:
+                raise
+            # saved by a firmware that let it through, or they do not go with the arguments:
+            # the next cmd/config saves over them
+            _print("saved config ignored: {}".format(e))
+            store.values = {}
+            return cls(config=store, **kwargs)
+
+    def _zone(self, config, sample_window, sample_period_ms, sensor_filter, min_on_ms, min_off_ms, max_run_ms,
+              lockout_ms, max_period_ms, floor_dbar, move_dbar, deadband, drop_rate, stuck_ms, heartbeat_min_ms,
+              heartbeat_max_ms):
+        """an extra zone from a dict:
+
+        name        short name, used in the topics
+        adc         machine.ADC id or an object with read(), e.g. ads1115.ADS1115(i2c).channel(1)
+        relay       relay pin
+        low, high   thresholds in bars, the board ones by default
+        raw_offset, max_pressure, calibration_curve
+                    any of them gives the zone its own calibration table (2 KB), the board ones fill
+                    in the others and a new one from cmd/config refills it; none: the board table
+        """
+        name = _topic(config["name"])
+        adc = config["adc"]
+        if isinstance(adc, int):
+            adc = machine.ADC(adc)
+        sampler = AdcSampler(adc, sample_window, sample_period_ms, make_filter(sensor_filter, sample_window))
+        table = self._pressure_table
+        calibration = None
+        if "raw_offset" in config or "max_pressure" in config or "calibration_curve" in config:
+            table = build_table(config.get("raw_offset", self._sensor_raw_offset),
+                                config.get("max_pressure", self._max_sensor_pressure),
+                                config.get("calibration_curve"))
+            if not config.get("calibration_curve"):
+                calibration = (config.get("raw_offset"), config.get("max_pressure"))
+        low = int(round(config.get("low", self._low_pressure) * 10))
+        high = int(round(config.get("high", self._high_pressure) * 10))
+        controller = PumpController(sampler, table, machine.Pin(config["relay"], machine.Pin.OUT), low, high,
+                                    self._min_raw_value, min_on_ms, min_off_ms, max_run_ms, lockout_ms,
+                                    max_interval_ms=max_period_ms, floor_dbar=floor_dbar, move_dbar=move_dbar)
+        events = PressureEvents(low, high, deadband, drop_rate, stuck_ms, heartbeat_min_ms, heartbeat_max_ms)
+        base = _topic(self.board_id) + b"/" + name
+        zone = Zone(name, controller, events, base, base + b"/relay")
+        zone.calibration = calibration
+        return zone
+
+    def _setup_outputs(self, queue_size, queue_path, queue_flash_size, replay_batch, db_host, db_port, db_path,
+                       db_batch, db_max_age_ms, connect_timeout_ms, mqtt_keepalive, mqtt_inflight,
+                       backoff_max_ms, summary_windows, mqtt_tls, mqtt_ca, mqtt_cert, mqtt_key):
+        """import and build only the backends listed in output_channels"""
+        output_channels = self.output_channels
+        mqtt = "mqtt" in output_channels
+        self.wlan = None
+        self.connection = None
+        self.uploader = None
+        self.queue = None
+        self.encoder = None
+        self.router = None
+        # channel name: outputs.Output, each one is drained by its own task
+        self.outputs = {}
+
+        if mqtt:
+            from readings import ReadingQueue
+            from commands import CommandRouter
+            from outputs import MqttOutput
+            # readings that could not be published, replayed after mqtt reconnects
+            self.queue = ReadingQueue(queue_size, queue_path, queue_flash_size)
+            self._replay_batch = replay_batch
+            if self._payload_format != "text":
+                from payload import PayloadEncoder, FLAG_PUMP, FLAG_SENSOR_ERROR, FLAG_LOCKED
+                # see payload.decode for the format
+                self.encoder = PayloadEncoder(self._payload_batch)
+                # bits of reading_flags()
+                self._flag_bits = (FLAG_PUMP, FLAG_SENSOR_ERROR, FLAG_LOCKED)
+            if summary_windows:
+                from aggregate import Aggregator
+                # rolling windows of every zone, fed by pressure_check
+                for zone in self.zones:
+                    zone.summary = Aggregator(summary_windows)
+                    zone.summary_topics = [zone.topic + ("/summary/%d" % s).encode() for s in summary_windows]
+            self.router = CommandRouter()
+            self._setup_commands()
+            self.outputs["mqtt"] = MqttOutput(self.publish_reading)
+
+        if "db" in output_channels:
+            from uploader import BatchUploader, DbOutput
+            self.uploader = BatchUploader(db_host, db_port, db_path, db_batch, db_max_age_ms)
+            self.outputs["db"] = DbOutput(self.uploader)
 
         if "display" in output_channels:
             self.lcd = self.i2c_setup()
+            if self.lcd is not None:
+                from display import LcdOutput
+                # only the latest reading is worth drawing
+                self.outputs["display"] = LcdOutput(self.lcd, self.controller, LCD_ROWS, LCD_COLS, EVENT_NAMES)
+
+        import network
+        network.WLAN(network.AP_IF).active(False)
+        if mqtt or "db" in output_channels:
+            from connection import ConnectionManager
+            # WiFi and the broker connection, only WiFi when mqtt is not an output
+            subscriptions = [self._command_topic + b"#"]
+            if len(self._topics) > 1:
+                subscriptions.insert(0, self._topics[1])
+            if len(self.zones) > 1:
+                # one subscription for the relay topics of every extra zone
+                subscriptions.append(_topic(self.board_id) + b"/+/relay")
+            context = None
+            if mqtt and mqtt_tls:
+                from broker_tls import make_context
+                # certificates are parsed once, every reconnect reuses the context and its session
+                context = make_context(mqtt_ca, mqtt_cert, mqtt_key)
+            self.wlan = network.WLAN(network.STA_IF)
+            self.connection = ConnectionManager(
+                self.wlan, self.board_id, self.mqtt_server if mqtt else None, self.mqtt_port,
+                self.mqtt_username, self.mqtt_password, self.wifi_ssid, self.wifi_pass,
+                callback=self._mqtt_setup_callback, subscriptions=subscriptions, on_connect=self._mqtt_connected,
+                connect_timeout_ms=connect_timeout_ms, backoff_max_ms=backoff_max_ms,
+                sleep_ms=self.telemetry.sleeper(TASK_MQTT), keepalive=mqtt_keepalive, max_inflight=mqtt_inflight,
+                ssl=context, on_clock=self._clock_set)
+
+    def boot_report(self):
+        """ms from reset to the first reading and to the end of the setup, free heap after it"""
+        return "boot: first reading {} ms, ready {} ms, mem_free {}".format(
+            self.boot_first_reading_ms, self.boot_ms, self.boot_mem_free)
 
     @property
     def pump_working(self):
-        return self._pump_working
+        return self.controller.pump_on
 
     @pump_working.setter
     def pump_working(self, value: bool):
-        self._pump_working = value
+        self.controller.force(value)
 
     @property
     def sensor_error(self):
-        return self._sensor_error
+        return self.controller.sensor_error
 
-    @sensor_error.setter
-    def sensor_error(self, value):
-        self._sensor_error = value
+    @property
+    def mqtt_client(self):
+        """the broker connection while it is up, None otherwise"""
+        connection = self.connection
+        return connection.client if connection is not None and connection.connected else None
 
     @property
     def min_raw_value(self):
@@ -152,104 +419,236 @@ class SmartWaterSync:
 
     @property
     def pressure(self):
+        """current pressure in bars"""
+        return self._current_pressure / 10
+
+    @pressure.setter
+    def pressure(self, value):
+        self._current_pressure = int(round(value * 10))
+
+    @property
+    def pressure_dbar(self):
         return self._current_pressure
 
+    @pressure_dbar.setter
+    def pressure_dbar(self, value):
+        self._current_pressure = value
+
     @property
     def last_pressure(self):
-        return self._last_pressure
+        return self._last_pressure / 10
 
     @last_pressure.setter
     def last_pressure(self, value):
-        self._last_pressure = value
+        self._last_pressure = int(round(value * 10))
 
-    @pressure.setter
-    def pressure(self, value):
-        self._current_pressure = value
+    @property
+    def last_pressure_dbar(self):
+        return self._last_pressure
+
+    @last_pressure_dbar.setter
+    def last_pressure_dbar(self, value):
+        self._last_pressure = value
 
     async def pressure_check(self):
-        """Convert raw sensor pressure data into readable Bars and make a decision what to do :)"""
+        """Publish what the control loop did and turn its pressure readings into events"""
+        sleep_ms = self.telemetry.sleeper(TASK_PRESSURE)
         while True:
             try:
-                await asyncio.sleep_ms(500)
-                raw_value = self.get_analog_data()
-                self.check_sensor_health(raw_value)
-                pressure = self.convert_pressure(raw_value)
-                self.check_pressure_value(pressure)
-                self.pressure = pressure
+                # no point in looking more often than the control loop samples
+                await sleep_ms(max(500, self.controller.interval_ms))
+                self.relay_notifications()
+                pressure = self.controller.dbar
+                self.pressure_dbar = pressure
+                now = utime.ticks_ms()
+                ev = self.events.update(pressure, now, self.pump_working)
+                ev |= self.check_cycle(self.zones[0], now)
+                if ev:
+                    self._pending_events |= ev
+                    self._data_ready.set()
+                summary = self.zones[0].summary
+                if summary is not None and summary.add(now, pressure, self.pump_working):
+                    self._summary_ready.set()
+                for i in range(1, len(self.zones)):
+                    zone = self.zones[i]
+                    self.zone_notifications(zone)
+                    controller = zone.controller
+                    ev = zone.events.update(controller.dbar, now, controller.pump_on)
+                    ev |= self.check_cycle(zone, now)
+                    if ev:
+                        zone.pending |= ev
+                        self._zones_ready.set()
+                    if zone.summary is not None and zone.summary.add(now, controller.dbar, controller.pump_on):
+                        self._summary_ready.set()
             except OSError as e:
+                self.telemetry.error(TASK_PRESSURE)
+                _print(e)
+
+    def check_cycle(self, zone, now):
+        """leak and dry run events of a zone, a dry running pump is locked out"""
+        controller = zone.controller
+        ev = zone.anomaly.update(now, controller.dbar, controller.pump_on)
+        if ev & EV_DRY_RUN and self._dry_run_cut:
+            controller.lock_out()
+        return ev
+
+    def relay_notifications(self):
+        """publish the relay changes and faults queued by the control loop"""
+        while True:
+            ev = self.controller.pop_event()
+            if not ev:
+                return
+            _print("control event: {}".format(ev))
+            display = self.outputs.get("display")
+            if display is not None and ev != EV_MAX_RUN:
+                # the pump state line changed
+                display.submit(utime.ticks_ms(), self.controller.dbar)
+            summary = self.zones[0].summary
+            if summary is not None and (ev == EV_PUMP_ON or ev == EV_PUMP_OFF):
+                summary.switched()
+            if ev == EV_PUMP_ON:
+                self.mqtt_publish(self._topics[1], b"1")
+            elif ev == EV_PUMP_OFF:
+                self.mqtt_publish(self._topics[1], b"0")
+            elif ev == EV_SENSOR_ERROR:
+                self.mqtt_publish(self._topics[1], b"0")
+                self.mqtt_publish(self._event_topic, b"sensor_error")
+            elif ev == EV_MAX_RUN:
+                self.mqtt_publish(self._event_topic, b"max_run")
+
+    def zone_notifications(self, zone):
+        """relay changes and faults of an extra zone"""
+        while True:
+            ev = zone.controller.pop_event()
+            if not ev:
+                return
+            if zone.summary is not None and (ev == EV_PUMP_ON or ev == EV_PUMP_OFF):
+                zone.summary.switched()
+            if ev == EV_PUMP_ON:
+                self.mqtt_publish(zone.relay_topic, b"1")
+            elif ev == EV_PUMP_OFF or ev == EV_SENSOR_ERROR:
+                self.mqtt_publish(zone.relay_topic, b"0")
+            if ev == EV_SENSOR_ERROR:
+                self.mqtt_publish(zone.event_topic, b"sensor_error")
+            elif ev == EV_MAX_RUN:
+                self.mqtt_publish(zone.event_topic, b"max_run")
+
+    async def send_zones(self):
+        """publish the readings of the extra zones with events in one message, alerts on <zone topic>/event"""
+        while True:
+            await self._zones_ready.wait()
+            # the other zones get the time to add their readings
+            await asyncio.sleep_ms(self._zone_batch_ms)
+            self._zones_ready.clear()
+            try:
+                started = utime.ticks_us()
+                buf = self._zones_buf
+                mv = self._zones_mv
+                n = 0
+                now = utime.ticks_ms()
+                for i in range(1, len(self.zones)):
+                    zone = self.zones[i]
+                    ev = zone.pending
+                    if not ev:
+                        continue
+                    zone.pending = 0
+                    zone.alerts = ev & EV_ALERTS
+                    controller = zone.controller
+                    dbar = controller.dbar
+                    zone.events.sent(dbar, now, ev)
+                    name = zone.name
+                    buf[n:n + len(name)] = name
+                    n += len(name)
+                    buf[n] = 0x2c   # ,
+                    n += 1 + format_dbar(mv[n + 1:], dbar)
+                    buf[n] = 0x2c
+                    buf[n + 1] = 0x31 if controller.pump_on else 0x30
+                    buf[n + 2] = 0x0a   # \n
+                    n += 3
+                if n:
+                    # readings of a zone are not queued while mqtt is down, only zone 0 ones are
+                    await self.mqtt_publish_async(self._zones_topic, mv[:n - 1])
+                for i in range(1, len(self.zones)):
+                    zone = self.zones[i]
+                    if zone.alerts:
+                        for bit, name in EVENT_NAMES:
+                            if zone.alerts & bit:
+                                await self.mqtt_publish_async(zone.event_topic, name)
+                        zone.alerts = 0
+                self.telemetry.busy(TASK_ZONES, started)
+            except Exception as e:
+                # OSError from publishing or a reading the buffer has no room for, the next batch goes on
+                self.telemetry.error(TASK_ZONES)
                 _print(e)
 
+    async def send_summaries(self):
+        """publish the windows that closed on <zone topic>/summary/<window s>, see aggregate.decode
+
+        A closed window waits in its aggregator while mqtt is down, only the
+        last one of every tier is kept. cmd/summary publishes the open ones.
+        """
+        from aggregate import FLAG_RUNNING
+        while True:
+            await self._summary_ready.wait()
+            self._summary_ready.clear()
+            started = utime.ticks_us()
+            query = self._summary_query
+            self._summary_query = False
+            now = utime.ticks_ms()
+            for zone in self.zones:
+                summary = zone.summary
+                for tier in range(summary.tiers):
+                    client = self.mqtt_client
+                    if not (client and client.connected):
+                        break
+                    if summary.pending & 1 << tier:
+                        summary.pending &= ~(1 << tier)
+                        await self.mqtt_publish_async(zone.summary_topics[tier], summary.encode(tier))
+                    if query:
+                        await self.mqtt_publish_async(zone.summary_topics[tier], summary.encode(
+                            tier, summary.running(tier, now), FLAG_RUNNING))
+            self.telemetry.busy(TASK_SUMMARY, started)
+
     def switch_pump_off(self):
         """switch pump OFF"""
-        # relay 0 == OFF | 1 == ON
-        self.pump_relay.value(0)
+        self.controller.force(False)
 
     def switch_pump_on(self):
         """switch pump ON"""
-        # relay 0 == OFF | 1 == ON
-        self.pump_relay.value(1)
+        self.controller.force(True)
 
-    def check_pressure_value(self, pressure: float):
-        """That method terminates water pump if something goes wrong with other verification method"""
-        try:
-            if pressure >= self.high_pressure and self.pump_working:
-                # if something goes wrong and we have a high pressure - let's stop the whole system
-                self.switch_pump_off()
-                self.pump_working = False
-                self.mqtt_publish(self.mqtt_channels[1], "0")
-            else:
-                if pressure <= self.low_pressure and not self.pump_working:
-                    self.pump_working = True
-                    self.switch_pump_on()
-                    self.mqtt_publish(self.mqtt_channels[1], "1")
-        except OSError as e:
-            _print("on-off error {}".format(e))
-            # just to be sure
-            self.switch_pump_off()
-            self.pump_working = False
+    def check_pressure_value(self, pressure: int):
+        """One control decision for a pressure in deci-bars, the control loop does this on every sample"""
+        self.controller.decide(pressure)
 
     def check_sensor_health(self, raw_value):
         """Extra verification of water pump to safety switch off in any other non working parameters"""
-        if raw_value <= self.min_raw_value:
-            # switch off relay just to be sure that we're safe
-            self.sensor_error = True
-            self.switch_pump_off()
-            self.mqtt_publish(self.mqtt_channels)
+        return self.controller.check_health(raw_value)
 
     def convert_pressure(self, raw_value):
-        """Pressure calculation rules"""
-        # https://forum.arduino.cc/index.php?topic=568567.0
-        full_scale = 1023 - self.sensor_raw_offset
-        max_pressure = 12
-        sensor_voltage = round((raw_value - self.sensor_raw_offset) / full_scale, 1)
-        pressure = round((raw_value - self.sensor_raw_offset) * max_pressure / full_scale, 1)
-        _print("debug: sensor_voltage: {}, pressure: {}".format(sensor_voltage, pressure))
-        return round(pressure, 1)
+        """Raw ADC value to deci-bars, see calibration.build_table for the rules"""
+        if raw_value >= TABLE_SIZE:
+            # esp8266 ADC may return 1024
+            raw_value = TABLE_SIZE - 1
+        return self._pressure_table[raw_value]
 
     def get_analog_data(self):
-        """Return median for the list of values"""
-        raw_values = []
-        try:
-            for i in range(5):
-                raw_values.append(self.adc.read())
-                utime.sleep_ms(50)
-            raw_values.sort()
-        except OSError as e:
-            raw_values = [0, 0, 0, 0, 0]
-            _print("Get analog data error: {}".format(e))
-        # take a new values from average values during the last 5 readings
-        finally:
-            _print("debug: raw values: {}".format(raw_values))
-            # return median values
-            return median(raw_values)
-            # return sum(raw_values) / len(raw_values)
+        """Return filtered value of the latest readings collected by the sampler task"""
+        raw_value = self.sampler.value()
+        _print("debug: raw value: {}".format(raw_value))
+        return raw_value
 
     def i2c_setup(self):
         """setup i2c interface"""
         if 'display' in self.output_channels:
-            from esp8266_i2c_lcd import I2cLcd
+            try:
+                from esp8266_i2c_lcd import I2cLcd
+            except ImportError:
+                # the driver is not part of this repo, copy it to the board to use the display
+                _print("no esp8266_i2c_lcd module, display disabled")
+                return None
             from machine import I2C, Pin
-            lcd = I2cLcd(I2C(scl=Pin(5), sda=Pin(4)), 0x27, 4, 20)
+            lcd = I2cLcd(I2C(scl=Pin(5), sda=Pin(4)), 0x27, LCD_ROWS, LCD_COLS)
             lcd.backlight_on()
             lcd.clear()
             lcd.move_to(0, 1)
@@ -257,134 +656,369 @@ class SmartWaterSync:
             return lcd
 
     async def board_ticker(self, time_ms):
+        sleep_ms = self.telemetry.sleeper(TASK_TICKER)
         while True:
-            await asyncio.sleep_ms(time_ms)
+            # blinks slower while the control loop backs off
+            await sleep_ms(max(time_ms, self.controller.interval_ms))
             if self.board_led.value() == 0:
                 self.board_led.value(1)
             else:
                 self.board_led.value(0)
 
     def _mqtt_setup_callback(self, topic, msg):
-        """setup callback for income messages"""
-        try:
-            _print("MQTT: topic, msg:{}-{}".format(topic, msg))
-            topic = topic.decode()
-            if len(self.mqtt_channels) > 1:
-                # just double check that we have 2 topics during setup procedure
-                if str(topic) == str(self.mqtt_channels[1]):
-                    data = msg.decode()
-                    # change relay status from MQTT channel mqtt_channels[1]
-                    # be careful to play with relay!)
-                    if int(data) == 1:
-                        self.pump_relay.value(1)
-                        self.pump_working = True
-                    else:
-                        self.pump_relay.value(0)
-                        self.pump_working = False
-        except OSError as e:
-            _print("Error during mqtt data reading from channel: {}".format(e))
-
-    async def send_data(self, time_ms):
-        """send water pressure to available channels: mqtt, db, display"""
-        while True:
-            try:
-                await asyncio.sleep_ms(time_ms)
-                # send update only if the diff > 0.1
-                _print("pressure: {} | last: {}, diff: {}".format(self.pressure, self.last_pressure,
-                                                                  math.fabs(self.pressure - self.last_pressure)))
-                if round(math.fabs(self.pressure-self.last_pressure), 1) > 0.1:
-                    self.last_pressure = self.pressure
-                    _print(">>>>> push data to DB")
-                    if "mqtt" in self.output_channels:
-                        self.mqtt_publish(self.mqtt_channels[0], "{}".format(self.pressure))
-                    if "db" in self.output_channels:
-                        self.send_http_data(_url='http://192.168.10.10/water/pressure/{}'.format(self.pressure))
-                    if "display" in self.output_channels:
-                        # use your own code here :) for data displaying
-                        pass
+        """setup callback for income messages, runs in the client reader task so it only queues them"""
+        self.router.dispatch(topic, msg)
 
-            except OSError as e:
-                # nothing here - continue even we have some errors
-                _print("Error during sending data: {}".format(e))
+    def _setup_commands(self):
+        router = self.router
+        if len(self._topics) > 1:
+            router.add(self._topics[1], self._relay_command)
+        cmd = self._command_topic
+        router.add(cmd + b"thresholds", self._thresholds_command)
+        router.add(cmd + b"sampling", self._sampling_command)
+        router.add(cmd + b"stats", self._stats_command)
+        router.add(cmd + b"config", self._config_command)
+        if self.zones[0].summary is not None:
+            router.add(cmd + b"summary", self._summary_command)
+        router.add(cmd + b"reboot", self._reboot_command)
+        for i in range(1, len(self.zones)):
+            router.add(self.zones[i].relay_topic, self.zones[i].relay_command)
 
+    def _command_error(self, topic, e):
+        self.telemetry.error(TASK_COMMANDS)
+        _print("Command error {}: {}".format(topic, e))
 
-    async def check_mqtt(self):
-        """setup MQTT bridge"""
-        try:
-            i = 0
-            while True:
-                await asyncio.sleep(10)
-                if self.wlan.isconnected():
-                    _print("CHECK [mqtt]...{}-{}".format(i, self.mqtt_client))
-                    if not self.mqtt_client:
-                        _print("Connecting... to mqtt")
-                        self.mqtt_client = MQTTClient(
-                            client_id=self.board_id,
-                            server=self.mqtt_server,
-                            port=self.mqtt_port,
-                            user=self.mqtt_username,
-                            password=self.mqtt_password
-                        )
-                        self.mqtt_client.set_callback(self._mqtt_setup_callback)
-                        self.mqtt_client.connect()
-                        if len(self.mqtt_channels) > 1:
-                            # double check
-                            self.mqtt_client.subscribe(self.mqtt_channels[1])
-                        # self.mqtt_client.publish(self.mqtt_channels[0], "{} connected".format("pressure"), False, 0)
-                        _print("Connected to mqtt!")
-                i += 1
-        except OSError as e:
-            _print("MQTT connection error: {}".format(e))
-            self.wlan.disconnect()
-            gc.collect()
-
-    async def wifi_check(self):
-        i = 0
-        while True:
-            await asyncio.sleep(10)
-            # _print("CHECK wifi connection...{}".format(i))
+    def _relay_command(self, topic, msg):
+        # change relay status from MQTT channel mqtt_channels[1]
+        # be careful to play with relay!)
+        self.controller.force(msg[:1] == b"1")
+
+    def _thresholds_command(self, topic, msg):
+        """payload is <low>,<high> in bars, ,<zone name> for an extra zone"""
+        fields = msg.split(b",")
+        low_dbar = int(round(float(fields[0].decode()) * 10))
+        high_dbar = int(round(float(fields[1].decode()) * 10))
+        if len(fields) > 2:
+            for zone in self.zones[1:]:
+                if zone.name == fields[2]:
+                    zone.controller.set_thresholds(low_dbar, high_dbar)
+                    zone.events.low = low_dbar
+                    zone.events.high = high_dbar
+                    return
+            raise ValueError("unknown zone")
+        self._set_thresholds(low_dbar, high_dbar)
+
+    def _set_thresholds(self, low_dbar, high_dbar):
+        self.controller.set_thresholds(low_dbar, high_dbar)
+        self._low_dbar = self.events.low = low_dbar
+        self._high_dbar = self.events.high = high_dbar
+        self._low_pressure = low_dbar / 10
+        self._high_pressure = high_dbar / 10
+
+    def _sampling_command(self, topic, msg):
+        """sampling and control period in ms, for every zone, up to sample_max_period_ms"""
+        period_ms = int(msg.decode())
+        for zone in self.zones:
+            zone.controller.set_period(period_ms)
+
+    async def _stats_command(self, topic, msg):
+        await self.mqtt_publish_async(self._stats_topic, self.telemetry.encode(self.connection.counters))
+
+    async def _config_command(self, topic, msg):
+        """<name>=<value> lines, see config.KEYS: applied, saved and sent back on <board_id>/config
+
+        An empty payload only sends the settings back, the passwords never.
+        """
+        from config import parse, format_values
+        changes = parse(msg)
+        if changes:
+            await self.apply_config(changes)
+            if self.config is not None:
+                values = dict(self.config.values)
+                values.update(changes)
+                self.config.save(values)
+        await self.mqtt_publish_async(self._config_topic, format_values(self.config_values()))
+
+    def config_values(self):
+        """the settings config.KEYS has, as they are now"""
+        values = {
+            "low_pressure": self._low_pressure,
+            "high_pressure": self._high_pressure,
+            "sensor_raw_offset": self._sensor_raw_offset,
+            "max_sensor_pressure": self._max_sensor_pressure,
+            "sample_period_ms": self.sampler.period_ms,
+            "wifi_ssid": self.wifi_ssid,
+            "wifi_pass": self.wifi_pass,
+            "mqtt_server": self.mqtt_server,
+            "mqtt_port": self.mqtt_port,
+            "mqtt_username": self.mqtt_username,
+            "mqtt_password": self.mqtt_password,
+            "mqtt_channels": tuple(self.mqtt_channels),
+        }
+        uploader = self.uploader
+        if uploader is not None:
+            values["db_host"] = uploader.host
+            values["db_port"] = uploader.port
+            values["db_path"] = uploader.path
+        return values
+
+    async def apply_config(self, changes):
+        """settings at runtime, only what they change is recomputed
+
+        Everything is checked, and the new calibration tables built aside
+        (2 KB each for a moment), before anything is applied. Thresholds and
+        the sampling period go to the controllers, a new sensor offset or
+        range is copied over the board table in place and over the zone
+        tables that took the other constant from the board; it is refused
+        with a calibration_curve, which does not use them. New mqtt_channels
+        re-encode the topics and subscribe again only when the relay topic
+        changed. A new broker or login reconnects, WiFi settings are used at
+        the next WiFi connect.
+        """
+        from config import check
+        values = {"low_pressure": self._low_pressure, "high_pressure": self._high_pressure}
+        values.update(changes)
+        check(values, self.controller.state[MAX_INTERVAL])
+        low_dbar = int(round(values["low_pressure"] * 10))
+        high_dbar = int(round(values["high_pressure"] * 10))
+        period_ms = changes.get("sample_period_ms", self.sampler.period_ms)
+        channels = tuple(changes.get("mqtt_channels", self.mqtt_channels))
+        raw_offset = changes.get("sensor_raw_offset", self._sensor_raw_offset)
+        max_pressure = changes.get("max_sensor_pressure", self._max_sensor_pressure)
+        # (table in use, new values) for the board table and the zone tables built from its constants
+        tables = []
+        if raw_offset != self._sensor_raw_offset or max_pressure != self._max_sensor_pressure:
+            if self._calibration_curve:
+                raise ValueError("the calibration curve does not use sensor_raw_offset or max_sensor_pressure")
+            tables.append((self._pressure_table, build_table(raw_offset, max_pressure)))
+            for zone in self.zones[1:]:
+                calibration = zone.calibration
+                if calibration is not None and None in calibration:
+                    tables.append((zone.controller.table, build_table(
+                        raw_offset if calibration[0] is None else calibration[0],
+                        max_pressure if calibration[1] is None else calibration[1])))
+
+        # nothing has changed up to here
+        if low_dbar != self._low_dbar or high_dbar != self._high_dbar:
+            self._set_thresholds(low_dbar, high_dbar)
+        self._sensor_raw_offset = raw_offset
+        self._max_sensor_pressure = max_pressure
+        for table, values in tables:
+            # the zones sharing the board table follow, a tick during the copy reads an old or a new value
+            table[:] = values
+        if period_ms != self.sampler.period_ms:
+            for zone in self.zones:
+                zone.controller.set_period(period_ms)
+        if channels != tuple(self.mqtt_channels):
+            await self._set_channels(channels)
+
+        connection = self.connection
+        self.wifi_ssid = changes.get("wifi_ssid", self.wifi_ssid)
+        self.wifi_pass = changes.get("wifi_pass", self.wifi_pass)
+        if connection is not None:
+            connection.ssid = self.wifi_ssid
+            connection.wifi_pass = self.wifi_pass
+        mqtt = (changes.get("mqtt_server", self.mqtt_server), changes.get("mqtt_port", self.mqtt_port),
+                changes.get("mqtt_username", self.mqtt_username), changes.get("mqtt_password", self.mqtt_password))
+        if mqtt != (self.mqtt_server, self.mqtt_port, self.mqtt_username, self.mqtt_password):
+            self.mqtt_server, self.mqtt_port, self.mqtt_username, self.mqtt_password = mqtt
+            if connection is not None and connection.server is not None:
+                connection.reconfigure(*mqtt)
+        uploader = self.uploader
+        if uploader is not None:
+            db = (changes.get("db_host", uploader.host), changes.get("db_port", uploader.port),
+                  changes.get("db_path", uploader.path))
+            if db != (uploader.host, uploader.port, uploader.path):
+                uploader.retarget(*db)
+
+    async def _set_channels(self, channels):
+        old_relay = self._topics[1]
+        self.mqtt_channels = channels
+        self._topics = tuple(_topic(topic) for topic in channels)
+        self._replay_topic = self._topics[0] + b"/replay"
+        self._binary_topic = self._topics[0] + b"/bin"
+        self._event_topic = self._topics[0] + b"/event"
+        zone = self.zones[0]
+        zone.topic = self._topics[0]
+        zone.event_topic = self._event_topic
+        zone.relay_topic = self._topics[1]
+        if zone.summary is not None:
+            zone.summary_topics = [zone.topic + ("/summary/%d" % (ms // 1000)).encode() for ms in zone.summary.length]
+        relay = self._topics[1]
+        if relay == old_relay or self.router is None:
+            return
+        self.router.remove(old_relay)
+        self.router.add(relay, self._relay_command)
+        connection = self.connection
+        subscriptions = connection.subscriptions
+        subscriptions[subscriptions.index(old_relay)] = relay
+        client = self.mqtt_client
+        if client is not None and client.connected:
+            from umqtt_async import MQTTException
             try:
-                if not self.wlan.isconnected():
-                    _print("setup wifi connection")
-                    self.wlan.active(True)
-                    self.wlan.connect("nc-main", "sensorium")
-                    while not self.wlan.isconnected():
-                        # wait until we'll not connect to wifi
-                        await asyncio.sleep(5)
-                    _print("Connected to wifi. IP: {}".format(self.wlan.ifconfig()))
-            except OSError as e:
-                _print("Wifi connection error: {}".format(e))
-                gc.collect()
-            i += 1
+                # the old topic stays subscribed until the next clean session, the router ignores it
+                await client.subscribe(relay, timeout_ms=connection.connect_timeout_ms)
+            except (OSError, MQTTException) as e:
+                # the connection manager subscribes to the new topic when it connects again
+                _print("subscribe error: {}".format(e))
+                client.close()
 
-    async def check_mqtt_msg(self):
+    def _summary_command(self, topic, msg):
+        # send_summaries publishes the open windows, the closed ones share its buffers
+        self._summary_query = True
+        self._summary_ready.set()
+
+    async def _reboot_command(self, topic, msg):
+        # give the client a moment to ack the command
+        await asyncio.sleep_ms(500)
+        machine.reset()
+
+    async def send_data(self):
+        """hand the reading to every output backend, woken up by pressure events"""
         while True:
-            try:
-                await asyncio.sleep_ms(1000)
-                if self.mqtt_client:
-                    self.mqtt_client.check_msg()
-                    _print("check mqtt messages")
-            except OSError as e:
-                _print("Something goes wrong with mqtt: {}".format(e))
-                self.mqtt_client = None
+            await self._data_ready.wait()
+            self._data_ready.clear()
+            started = utime.ticks_us()
+            ev = self._pending_events
+            self._pending_events = 0
+            dbar = self.pressure_dbar
+            now = utime.ticks_ms()
+            self.events.sent(dbar, now, ev)
+            _print("pressure: {} | last: {}, events: {:#x}".format(self.pressure, self.last_pressure, ev))
+            self.last_pressure_dbar = dbar
+            # the backends drain their own queues, a slow one does not hold up the others
+            for output in self.outputs.values():
+                output.submit(now, dbar, ev)
+            self.telemetry.busy(TASK_SEND, started)
+
+    async def publish_reading(self, dbar, ev):
+        """the mqtt output: text and / or binary reading and the alert names, queued while offline"""
+        client = self.mqtt_client
+        if not (client and client.connected):
+            self.queue.append(dbar)
+            return
+        if self._payload_format != "binary":
+            n = format_dbar(self._payload, dbar)
+            await self.mqtt_publish_async(self._topics[0], self._payload_mv[:n])
+        if self.encoder is not None:
+            await self.publish_binary(dbar, ev & EV_ALERTS)
+        if ev & EV_ALERTS:
+            for bit, name in EVENT_NAMES:
+                if ev & bit:
+                    await self.mqtt_publish_async(self._event_topic, name)
+
+    def _clock_set(self, delta):
+        # NTP set the RTC, readings stamped before it get their real time
+        if self.queue is not None:
+            self.queue.clock_set(delta)
+        if self.uploader is not None:
+            self.uploader.clock_set(delta)
+
+    async def _mqtt_connected(self):
+        _print("Connected to mqtt!")
+        gc.collect()
+        if self.zones[0].summary is not None:
+            # windows that closed while the broker was away
+            self._summary_ready.set()
+        await self.replay_readings()
+
+    def set_power_mode(self):
+        """let the esp8266 sleep between wakeups, modem sleep keeps the CPU running"""
+        if self._power_mode is None:
+            return
+        try:
+            import esp
+            esp.sleep_type(esp.SLEEP_LIGHT if self._power_mode == "light" else esp.SLEEP_MODEM)
+        except (ImportError, AttributeError) as e:
+            _print("power mode not supported: {}".format(e))
 
     async def run(self):
+        self.set_power_mode()
+        # the control loop first, it does not depend on anything below
+        # several zones share one timer
+        control = self.controller if len(self.zones) == 1 else ZoneLoop(self.zones)
+        if self._control_timer is None or not control.start(self._control_timer):
+            asyncio.create_task(control.run(self.telemetry.sleeper(TASK_SAMPLER)))
         asyncio.create_task(self.board_ticker(500))
-        # wifi is default channel that should be exists for default communication channels
-        asyncio.create_task(self.wifi_check())
+        # networking only starts once the control loop runs
+        if self.connection is not None:
+            asyncio.create_task(self.connection.run())
         if "mqtt" in self.output_channels:
-            asyncio.create_task(self.check_mqtt())
-            asyncio.create_task(self.check_mqtt_msg())
+            # incoming messages are pushed to _mqtt_setup_callback by the client reader task
+            asyncio.create_task(self.router.run(self._command_error))
+        if "db" in self.output_channels:
+            asyncio.create_task(self.uploader.run(sleep_ms=self.telemetry.sleeper(TASK_UPLOADER)))
+        for name, output in self.outputs.items():
+            asyncio.create_task(output.run(self.telemetry, OUTPUT_TASKS[name]))
         asyncio.create_task(self.pressure_check())
-        asyncio.create_task(self.send_data(1000))
+        asyncio.create_task(self.send_data())
+        if len(self.zones) > 1 and "mqtt" in self.output_channels:
+            asyncio.create_task(self.send_zones())
+        if self.zones[0].summary is not None:
+            asyncio.create_task(self.send_summaries())
+        if self.telemetry.enabled and "mqtt" in self.output_channels:
+            asyncio.create_task(self.publish_stats())
 
     def mqtt_publish(self, channel, msg):
-        if self.mqtt_client:
-            self.mqtt_client.publish(channel, msg, False, 1)
+        """publish from sync code: the message is sent by a separate task"""
+        client = self.mqtt_client
+        if client and client.connected:
+            if client.window_full():
+                # the broker does not ack, do not pile up tasks waiting for a slot
+                _print("MQTT stalled, dropped: {}".format(msg))
+                return
+            asyncio.create_task(self.mqtt_publish_async(channel, msg))
+
+    async def mqtt_publish_async(self, channel, msg):
+        client = self.mqtt_client
+        if client and client.connected:
+            try:
+                await client.publish(channel, msg, False, 1)
+            except OSError as e:
+                _print("MQTT publish error: {}".format(e))
+
+    def reading_flags(self):
+        pump, sensor_error, locked = self._flag_bits
+        controller = self.controller
+        flags = pump if controller.pump_on else 0
+        if controller.sensor_error:
+            flags |= sensor_error
+        if controller.state[LOCKED_AT]:
+            flags |= locked
+        return flags
 
-    def send_http_data(self, _url):
-        if self.wlan.isconnected():
-            response = urequests.get(url=_url)
-            response.close()
+    async def publish_binary(self, dbar, flush=False):
+        """add the reading to the binary batch, publish it when full or on flush"""
+        full = self.encoder.add(utime.ticks_ms(), dbar, self.controller.raw, self.reading_flags())
+        if full or flush:
+            await self.mqtt_publish_async(self._binary_topic, self.encoder.encode())
+
+    async def publish_stats(self):
+        """publish telemetry counters, see telemetry.decode for the format"""
+        while True:
+            await asyncio.sleep_ms(self._stats_period_ms)
+            await self.mqtt_publish_async(self._stats_topic, self.telemetry.encode(self.connection.counters))
 
+    async def replay_readings(self):
+        """send readings queued while mqtt was down, oldest first, payload is <unix time>,<pressure>
 
+        The time is 0 when the reading was taken before the clock was set.
+        """
+        queue = self.queue
+        while len(queue):
+            for _ in range(self._replay_batch):
+                item = queue.peek()
+                client = self.mqtt_client
+                if item is None or not (client and client.connected):
+                    return
+                ts, dbar = item
+                try:
+                    await client.publish(self._replay_topic, "{},{}".format(ts, dbar / 10), False, 1)
+                except OSError as e:
+                    # keep the reading, the next reconnect will try again
+                    _print("Replay error: {}".format(e))
+                    return
+                queue.pop()
+            # let the control loop run between batches
+            await asyncio.sleep_ms(0)
+        _print("replayed: {}, dropped: {}".format(queue.replayed, queue.dropped))
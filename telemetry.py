@@ -0,0 +1,149 @@
+from array import array
+import gc
+
+import uasyncio as asyncio
+import ustruct as struct
+import utime
+
+# task ids, the order is the order of the records in the stats payload
+TASK_TICKER = 0
+TASK_WIFI = 1
+TASK_MQTT = 2
+TASK_PRESSURE = 3
+TASK_SEND = 4
+TASK_SAMPLER = 5
+TASK_UPLOADER = 6
+TASK_COMMANDS = 7
+TASK_PUBLISH = 8    # output backends, see outputs.py
+TASK_DB = 9
+TASK_DISPLAY = 10
+TASK_ZONES = 11     # batched readings of the extra zones
+TASK_SUMMARY = 12   # window summaries, see aggregate.py
+TASK_NAMES = ("ticker", "wifi", "mqtt", "pressure", "send", "sampler", "uploader", "commands",
+              "publish", "db", "display", "zones", "summary")
+
+# counters per task
+ITERATIONS = 0
+LAG_TOTAL_MS = 1    # woke up later than the requested sleep_ms
+LAG_MAX_MS = 2
+BUSY_TOTAL_US = 3   # time between waking up and the next sleep
+BUSY_MAX_US = 4
+ERRORS = 5
+FIELDS = 6
+FIELD_NAMES = ("iterations", "lag_total_ms", "lag_max_ms", "busy_total_us", "busy_max_us", "errors")
+
+VERSION = 3
+HEADER = "<BBIII"   # version, tasks, uptime s, mem_free, mem_free low-water mark
+HEADER_SIZE = struct.calcsize(HEADER)
+# version 2: reconnects, failures, last and max ms to recover, version 3 adds last and max connect ms,
+# resumed TLS sessions and the heap of the TLS session, see connection.py
+LINK = "<IIIIIIII"
+LINK_SIZE = struct.calcsize(LINK)
+LINK_NAMES = ("reconnects", "failures", "recover_ms", "recover_max_ms", "handshake_ms", "handshake_max_ms",
+              "tls_resumed", "tls_heap")
+LINK_V2 = "<IIII"
+
+
+def _mem_free():
+    return gc.mem_free() if hasattr(gc, "mem_free") else 0
+
+
+class Telemetry:
+    """Fixed size per-task counters for the event loop
+
+    Tasks sleep through the function returned by sleeper(): when telemetry
+    is disabled that is asyncio.sleep_ms itself, so there is no cost.
+    """
+
+    def __init__(self, enabled=False, tasks=len(TASK_NAMES)):
+        self.enabled = enabled
+        self.tasks = tasks
+        self.counters = array('I', [0] * (tasks * FIELDS))
+        self._woke = array('I', [0] * tasks)    # ticks_us of the last wake up, 0 == sleeping
+        self.mem_low = _mem_free()
+        self._started = utime.ticks_ms()
+        self._buf = bytearray(HEADER_SIZE + LINK_SIZE + 4 * len(self.counters))
+
+    def sleeper(self, task):
+        """sleep_ms replacement for the task"""
+        if not self.enabled:
+            return asyncio.sleep_ms
+        counters = self.counters
+        base = task * FIELDS
+        woke = self._woke
+
+        async def sleep_ms(ms):
+            now = utime.ticks_us()
+            if woke[task]:
+                self._add(base + BUSY_TOTAL_US, base + BUSY_MAX_US, utime.ticks_diff(now, woke[task]))
+            await asyncio.sleep_ms(ms)
+            t = utime.ticks_us()
+            woke[task] = t or 1
+            counters[base + ITERATIONS] += 1
+            self._add(base + LAG_TOTAL_MS, base + LAG_MAX_MS, utime.ticks_diff(t, now) // 1000 - ms)
+            self._mem()
+        return sleep_ms
+
+    def _add(self, total, peak, value):
+        if value < 0:
+            value = 0
+        c = self.counters
+        c[total] = (c[total] + value) & 0xffffffff
+        if value > c[peak]:
+            c[peak] = value
+
+    def _mem(self):
+        free = _mem_free()
+        if free and free < self.mem_low:
+            self.mem_low = free
+
+    def busy(self, task, started_us):
+        """one iteration of a task that does not sleep through sleeper() (waits on an event)"""
+        if self.enabled:
+            base = task * FIELDS
+            self.counters[base + ITERATIONS] += 1
+            self._add(base + BUSY_TOTAL_US, base + BUSY_MAX_US, utime.ticks_diff(utime.ticks_us(), started_us))
+            self._mem()
+
+    def error(self, task):
+        if self.enabled:
+            self.counters[task * FIELDS + ERRORS] += 1
+
+    def encode(self, link=None):
+        """stats payload: header, link counters, the task counters as little endian uint32
+
+        The buffer is valid until the next call.
+        """
+        uptime = utime.ticks_diff(utime.ticks_ms(), self._started) // 1000
+        struct.pack_into(HEADER, self._buf, 0, VERSION, self.tasks, uptime, _mem_free(), self.mem_low)
+        if link is None:
+            struct.pack_into(LINK, self._buf, HEADER_SIZE, 0, 0, 0, 0, 0, 0, 0, 0)
+        else:
+            struct.pack_into(LINK, self._buf, HEADER_SIZE, link[0], link[1], link[2], link[3], link[4], link[5],
+                             link[6], link[7])
+        i = HEADER_SIZE + LINK_SIZE
+        for value in self.counters:
+            struct.pack_into("<I", self._buf, i, value)
+            i += 4
+        return self._buf
+
+
+def decode(payload):
+    """stats payload to a dict, for the consuming side"""
+    version, tasks, uptime, mem_free, mem_low = struct.unpack_from(HEADER, payload, 0)
+    if version not in (1, 2, VERSION):
+        raise ValueError("unknown stats version {}".format(version))
+    stats = {"uptime": uptime, "mem_free": mem_free, "mem_low": mem_low, "tasks": {}}
+    i = HEADER_SIZE
+    if version >= 3:
+        stats["link"] = dict(zip(LINK_NAMES, struct.unpack_from(LINK, payload, i)))
+        i += LINK_SIZE
+    elif version == 2:
+        stats["link"] = dict(zip(LINK_NAMES, struct.unpack_from(LINK_V2, payload, i)))
+        i += struct.calcsize(LINK_V2)
+    for task in range(tasks):
+        name = TASK_NAMES[task] if task < len(TASK_NAMES) else str(task)
+        values = struct.unpack_from("<" + "I" * FIELDS, payload, i)
+        stats["tasks"][name] = dict(zip(FIELD_NAMES, values))
+        i += 4 * FIELDS
+    return stats
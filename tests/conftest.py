@@ -0,0 +1,19 @@
+"""Make the firmware modules importable on the host, see sim.install()"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import sim  # noqa: E402
+
+sim.install()
+
+
+@pytest.fixture(autouse=True)
+def board():
+    """a fresh simulated board for every test: clock at 0, RTC not set, WiFi down"""
+    return sim.install()
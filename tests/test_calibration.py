@@ -0,0 +1,43 @@
+from calibration import TABLE_SIZE, build_table, fill_table, format_dbar
+
+
+def old_convert_pressure(raw_value, sensor_raw_offset, max_pressure):
+    # SmartWaterSync.convert_pressure before the table, with max_pressure instead of the hard-coded 12
+    full_scale = 1023 - sensor_raw_offset
+    pressure = round((raw_value - sensor_raw_offset) * max_pressure / full_scale, 1)
+    return round(pressure, 1)
+
+
+def test_table_matches_old_formula():
+    for raw_offset in (0, 43, 100, 300):
+        for max_pressure in (10, 12, 16):
+            table = build_table(raw_offset, max_pressure)
+            assert len(table) == TABLE_SIZE
+            for raw in range(TABLE_SIZE):
+                expected = int(round(old_convert_pressure(raw, raw_offset, max_pressure) * 10))
+                assert table[raw] == expected, (raw_offset, max_pressure, raw)
+
+
+def test_fill_table_in_place():
+    table = build_table(43, 12)
+    same = fill_table(table, 43, 24)
+    assert same is table
+    assert table[1023] == 240
+    assert table[43] == 0
+
+
+def test_curve_interpolates_and_extrapolates():
+    table = build_table(0, 12, curve=((100, 0.0), (900, 8.0), (500, 4.0)))
+    assert table[100] == 0
+    assert table[300] == 20
+    assert table[500] == 40
+    assert table[900] == 80
+    assert table[0] == -10
+    assert table[1000] == 90
+
+
+def test_format_dbar():
+    buf = bytearray(8)
+    for dbar, text in ((0, b"0.0"), (5, b"0.5"), (120, b"12.0"), (-15, b"-1.5"), (32767, b"3276.7")):
+        n = format_dbar(buf, dbar)
+        assert bytes(buf[:n]) == text
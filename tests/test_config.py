@@ -0,0 +1,240 @@
+import asyncio
+import os
+
+import network
+import pytest
+
+import config
+from config import ConfigStore, check, decode, encode, format_values, parse
+from connection import ConnectionManager
+from sim import simulate
+from sync import SmartWaterSync
+from umqtt_async import MQTTClient
+
+SAVED = {
+    "low_pressure": 3.5,
+    "high_pressure": 5.5,
+    "sensor_raw_offset": 41,
+    "mqtt_server": "broker.lan",
+    "mqtt_password": "secret",
+    "mqtt_channels": ("home/pressure", "home/relay"),
+}
+OLD = {"low_pressure": 4.0}
+CMD = b"water_pressure/cmd/config"
+ECHO = b"water_pressure/config"
+
+
+def _flip(data, i):
+    data = bytearray(data)
+    data[i] ^= 0x10
+    return bytes(data)
+
+
+def _newer(data):
+    data = bytearray(data)
+    data[4] = config.VERSION + 1
+    return bytes(data)
+
+
+GOOD = encode(SAVED)
+# damage: config.bin, config.bin.tmp (None: no file), what load() should come back with
+DAMAGE = {
+    "intact": (GOOD, None, "config.bin", 0, SAVED),
+    "truncated": (GOOD[:len(GOOD) // 2], None, None, 1, {}),
+    "bit flip": (_flip(GOOD, len(GOOD) - 3), None, None, 1, {}),
+    "bad magic": (b"XXXX" + GOOD[4:], None, None, 1, {}),
+    "empty file": (b"", None, None, 1, {}),
+    "newer version": (_newer(GOOD), None, None, 1, {}),
+    "no file, tmp done": (None, GOOD, "config.bin.tmp", 0, SAVED),
+    "bit flip, tmp done": (_flip(GOOD, len(GOOD) - 3), GOOD, "config.bin.tmp", 1, SAVED),
+    "old file, tmp half": (encode(OLD), GOOD[:10], "config.bin", 0, OLD),
+    "nothing": (None, None, None, 0, {}),
+}
+
+
+@pytest.mark.parametrize("damage", sorted(DAMAGE))
+def test_recovery(tmp_path, damage):
+    data, tmp, source, corrupt, expected = DAMAGE[damage]
+    path = str(tmp_path / "config.bin")
+    for content, name in ((data, path), (tmp, path + ".tmp")):
+        if content is not None:
+            with open(name, "wb") as f:
+                f.write(content)
+    store = ConfigStore(path)
+    assert store.load() == expected
+    assert store.corrupt == corrupt
+    assert (store.source and os.path.basename(store.source)) == source
+    if source == "config.bin.tmp":
+        # the rename the power cut stopped is done, the next boot reads config.bin
+        assert not os.path.exists(path + ".tmp")
+        again = ConfigStore(path)
+        assert again.load() == expected
+        assert again.source == path
+
+
+def test_save_replaces_the_file(tmp_path):
+    path = str(tmp_path / "config.bin")
+    store = ConfigStore(path)
+    store.save(OLD)
+    store.save(SAVED)
+    assert ConfigStore(path).load() == SAVED
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_unknown_keys_are_skipped():
+    data = bytearray(encode({"low_pressure": 2.0}))
+    # an entry a newer firmware added: key 200, 2 bytes
+    payload = data[config.HEADER_SIZE:] + bytes([200, 2, 1, 2])
+    header = config.struct.pack(config.HEADER, config.MAGIC, config.VERSION, 2, len(payload),
+                                config.crc32(payload))
+    assert decode(header + payload) == {"low_pressure": 2.0}
+
+
+def test_parse_and_format():
+    values = parse(b"low_pressure = 2.04\nmqtt_port=8883\n\nmqtt_channels=a/b, c/d\nwifi_pass=x")
+    assert values == {"low_pressure": 2.0, "mqtt_port": 8883, "mqtt_channels": ("a/b", "c/d"), "wifi_pass": "x"}
+    assert format_values(values) == b"low_pressure=2.0\nmqtt_port=8883\nmqtt_channels=a/b,c/d"
+
+
+@pytest.mark.parametrize("msg", [
+    b"nothing",
+    b"colour=red",
+    b"mqtt_port=eighty",
+    b"mqtt_port=99999999999",
+    b"low_pressure=inf",
+    b"low_pressure=nan",
+    b"mqtt_server=" + b"x" * 300,
+])
+def test_parse_rejects(msg):
+    with pytest.raises(ValueError):
+        parse(msg)
+
+
+@pytest.mark.parametrize("values", [
+    {"sensor_raw_offset": 1023},
+    {"sensor_raw_offset": -1},
+    {"max_sensor_pressure": 0},
+    {"max_sensor_pressure": -1.0},
+    {"mqtt_port": 0},
+    {"mqtt_port": 65536},
+    {"db_port": 70000},
+    {"sample_period_ms": 5},
+    {"sample_period_ms": 1001},
+    {"sample_period_ms": 86400000},
+    {"low_pressure": 5.0, "high_pressure": 5.0},
+    {"low_pressure": 5.0, "high_pressure": 5.04},
+    {"mqtt_channels": ("only",)},
+    {"mqtt_channels": ("a", "")},
+])
+def test_check_rejects(values):
+    with pytest.raises(ValueError):
+        check(values, 1000)
+
+
+def test_check_accepts_edges():
+    check({"sensor_raw_offset": 0, "max_sensor_pressure": 0.1, "mqtt_port": 1, "db_port": 65535,
+           "sample_period_ms": 10, "mqtt_channels": ("a", "b"), "low_pressure": 4.9, "high_pressure": 5.0}, 1000)
+    check({"sensor_raw_offset": 1022, "sample_period_ms": 1000}, 1000)
+
+
+@pytest.mark.parametrize("saved, kwargs", [
+    # a saved low above the high main.py passes now
+    ({"low_pressure": 6.0}, {"high_pressure": 5.5}),
+    # and above the default high
+    ({"low_pressure": 6.0}, {}),
+    ({"sample_period_ms": 86400000}, {}),
+    ({"sample_period_ms": 2000}, {"sample_max_period_ms": 1000}),
+])
+def test_from_config_ignores_what_does_not_fit(tmp_path, saved, kwargs):
+    path = str(tmp_path / "config.bin")
+    ConfigStore(path).save(saved)
+    sensor = SmartWaterSync.from_config(path, output_channels=(), **kwargs)
+    assert sensor.config.values == {}
+    assert sensor.controller.state[0] < sensor.controller.state[1]
+    assert sensor.sampler.period_ms == 50
+
+
+def test_from_config_merges(tmp_path):
+    path = str(tmp_path / "config.bin")
+    ConfigStore(path).save({"low_pressure": 5.5, "sample_period_ms": 2000})
+    sensor = SmartWaterSync.from_config(path, output_channels=(), high_pressure=6, sample_max_period_ms=4000)
+    assert (sensor.controller.state[0], sensor.controller.state[1]) == (55, 60)
+    assert sensor.sampler.period_ms == 2000
+
+
+BAD = (
+    b"sensor_raw_offset=1023",
+    b"max_sensor_pressure=0",
+    b"mqtt_port=99999999999",
+    b"mqtt_port=0",
+    b"low_pressure=6\nhigh_pressure=5",
+    b"low_pressure=1\nsensor_raw_offset=2000",
+    b"high_pressure=3.5",
+    b"sample_period_ms=86400000",
+    b"mqtt_channels=home/pressure",
+    b"colour=red",
+)
+
+
+def test_live_reload(tmp_path):
+    path = str(tmp_path / "live.bin")
+    seen = {}
+
+    def setup(sensor, broker, board):
+        sensor.config = ConfigStore(path)
+
+        async def script():
+            await asyncio.sleep(30)
+            seen["table"] = list(sensor._pressure_table)
+            seen["state"] = (sensor._low_dbar, sensor._high_dbar, sensor._sensor_raw_offset,
+                             sensor._max_sensor_pressure, sensor.mqtt_port)
+            for msg in BAD:
+                broker.send(CMD, msg)
+                await asyncio.sleep(1)
+            seen["after_bad"] = (sensor._low_dbar, sensor._high_dbar, sensor._sensor_raw_offset,
+                                 sensor._max_sensor_pressure, sensor.mqtt_port)
+            seen["table_after_bad"] = list(sensor._pressure_table)
+            seen["saved_after_bad"] = os.path.exists(path)
+            seen["sent"] = asyncio.get_event_loop().time()
+            broker.send(CMD, b"low_pressure=3.5\nhigh_pressure=5.5\nsensor_raw_offset=41\nmax_sensor_pressure=16")
+            await asyncio.sleep(5)
+            broker.send(CMD, b"mqtt_channels=home/pressure,home/relay")
+            await asyncio.sleep(5)
+            seen["pump"] = sensor.controller.pump_on
+            broker.send(b"home/relay", b"0")
+            await asyncio.sleep(5)
+            seen["pump_after"] = sensor.controller.pump_on
+
+        asyncio.ensure_future(script())
+
+    report = simulate("pump_cycles", 60, ("mqtt",), setup=setup, lag_probe_ms=0)
+    sensor = report.sensor
+    # nothing of a rejected message was applied or saved, and the router kept going
+    assert seen["after_bad"] == seen["state"]
+    assert seen["table_after_bad"] == seen["table"]
+    assert not seen["saved_after_bad"]
+    # the good ones were, the echo went out within a control period
+    echoes = [p for p in report.broker.published if p[1] == ECHO]
+    assert len(echoes) == 2
+    assert echoes[0][0] - seen["sent"] < 0.1
+    assert b"sensor_raw_offset=41" in echoes[0][2]
+    assert b"mqtt_password" not in echoes[0][2]
+    assert (sensor._low_dbar, sensor._high_dbar) == (35, 55)
+    assert sensor.controller.state[0] == 35
+    assert sensor._pressure_table[41] == 0
+    assert sensor._pressure_table[1023] == 160
+    # the relay command on the new topic went through the new subscription
+    assert seen["pump"] and not seen["pump_after"]
+    assert [p[2] for p in report.broker.published if p[1] == b"home/relay"] == [b"0"]
+    saved = ConfigStore(path).load()
+    assert saved == {"low_pressure": 3.5, "high_pressure": 5.5, "sensor_raw_offset": 41, "max_sensor_pressure": 16.0,
+                     "mqtt_channels": ("home/pressure", "home/relay")}
+
+
+def test_broker_move_checks_the_new_host_name():
+    manager = ConnectionManager(network.WLAN(network.STA_IF), "board", "old.lan", 8883)
+    manager.client = MQTTClient("board", "10.0.0.1", 8883, server_hostname="old.lan")
+    manager.reconfigure("new.lan", 8884, "user", "pass")
+    client = manager.client
+    assert (client.server_hostname, client.port, client.user, client.pswd) == ("new.lan", 8884, "user", "pass")
+    assert not client.connected
@@ -0,0 +1,85 @@
+from array import array
+
+import pytest
+
+from controller import EV_PUMP_OFF, EV_PUMP_ON, LOCKED_AT, MAX_INTERVAL, PumpController
+
+
+class Sampler:
+    period_ms = 50
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def sample(self):
+        pass
+
+    def value(self):
+        return self.raw
+
+
+class Relay:
+    def __init__(self):
+        self.values = []
+
+    def value(self, v):
+        self.values.append(v)
+
+
+def controller(raw):
+    # one deci-bar per raw step
+    table = array('h', range(1024))
+    return PumpController(Sampler(raw), table, Relay(), 30, 50, 5)
+
+
+def test_force_waits_for_the_tick():
+    c = controller(40)
+    c.tick()
+    c.force(True)
+    # nothing switched and nothing queued from the command task
+    assert not c.pump_on
+    assert c.pop_event() == 0
+    c.tick()
+    assert c.pump_on
+    assert c.relay.values[-1] == 1
+    assert c.pop_event() == EV_PUMP_ON
+    c.force(False)
+    c.tick()
+    assert not c.pump_on
+    assert c.pop_event() == EV_PUMP_OFF
+
+
+def test_force_on_refused_with_a_sensor_error():
+    c = controller(2)
+    c.tick()
+    c.force(True)
+    c.tick()
+    assert not c.pump_on
+
+
+def test_lock_out_waits_for_the_tick():
+    c = controller(20)
+    c.tick()
+    assert c.pump_on
+    assert c.pop_event() == EV_PUMP_ON
+    c.lock_out()
+    assert c.pump_on
+    assert not c.state[LOCKED_AT]
+    c.tick()
+    assert not c.pump_on
+    assert c.state[LOCKED_AT]
+    assert c.pop_event() == EV_PUMP_OFF
+    # still below LOW, the lockout holds the pump off
+    c.tick()
+    assert not c.pump_on
+
+
+def test_period_is_capped():
+    c = PumpController(Sampler(40), array('h', range(1024)), Relay(), 30, 50, 5, max_interval_ms=1000)
+    c.set_period(1000)
+    assert c.interval_ms == 1000
+    for period in (5, 1001, 3600000):
+        with pytest.raises(ValueError):
+            c.set_period(period)
+    assert c.sampler.period_ms == 1000
+    assert c.state[MAX_INTERVAL] == 1000
@@ -0,0 +1,90 @@
+import asyncio
+
+from sim import Board, Clock, install, new_event_loop
+from sim.broker import FakeBroker
+from umqtt_async import MQTTClient
+
+TOPIC = b"smarty/water_relay"
+
+
+def run(coro):
+    clock = Clock()
+    install(Board(clock))
+    loop = new_event_loop(clock)
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+async def connect(broker, keepalive):
+    port = await broker.start()
+    client = MQTTClient("board", "127.0.0.1", port, keepalive=keepalive)
+    received = []
+    client.set_callback(lambda topic, msg: received.append(bytes(msg)))
+    await client.connect()
+    await client.subscribe(TOPIC)
+    return client, received
+
+
+def test_a_board_that_only_receives_still_pings():
+    async def main():
+        broker = FakeBroker()
+        client, received = await connect(broker, 60)
+        # a home automation system re-publishing the relay state every 10 s
+        for _ in range(60):
+            broker.send(TOPIC, b"0")
+            await asyncio.sleep(10)
+        connected = client.connected
+        client.close()
+        await broker.stop()
+        return broker, client, received, connected
+
+    broker, client, received, connected = run(main())
+    assert connected
+    assert len(received) == 60
+    assert broker.keepalive_drops == 0
+    assert broker.connections == 1
+    # one PINGREQ every half keepalive, give or take the check granularity
+    assert 15 <= client.pings <= 21
+    assert client.ping_timeouts == 0
+
+
+def test_publishing_board_does_not_ping():
+    async def main():
+        broker = FakeBroker()
+        client, _ = await connect(broker, 60)
+        for i in range(60):
+            await client.publish(b"smarty/water_pressure", b"%d" % i)
+            broker.send(TOPIC, b"0")
+            await asyncio.sleep(10)
+        connected = client.connected
+        client.close()
+        await broker.stop()
+        return broker, client, connected
+
+    broker, client, connected = run(main())
+    assert connected
+    assert broker.keepalive_drops == 0
+    assert client.pings == 0
+
+
+def test_half_open_connection_is_closed():
+    async def main():
+        broker = FakeBroker()
+        client, _ = await connect(broker, 10)
+        await asyncio.sleep(5)
+        broker.ignore_pings = True
+        start = asyncio.get_event_loop().time()
+        while client.connected:
+            await asyncio.sleep(0.1)
+        elapsed = asyncio.get_event_loop().time() - start
+        await broker.stop()
+        return client, elapsed
+
+    client, elapsed = run(main())
+    assert client.ping_timeouts == 1
+    # half the keepalive quiet, then half of it without an answer
+    assert 5 <= elapsed <= 12
@@ -0,0 +1,79 @@
+import pytest
+
+from payload import (FLAG_LOCKED, FLAG_PUMP, FLAG_SENSOR_ERROR, HEADER_SIZE, RECORD_SIZE, VERSION,
+                     PayloadEncoder, decode, missing)
+
+
+def test_round_trip_edge_values():
+    encoder = PayloadEncoder(4)
+    readings = (
+        (0, -32768, 0, 0),
+        (0xffffffff, 32767, 65535, FLAG_PUMP | FLAG_SENSOR_ERROR | FLAG_LOCKED),
+        (2 ** 32 + 5, 0, 1023, FLAG_LOCKED),
+        (123456, -15, 44, FLAG_SENSOR_ERROR),
+    )
+    for ts, dbar, raw, flags in readings:
+        encoder.add(ts, dbar, raw, flags)
+    payload = bytes(encoder.encode())
+    assert len(payload) == HEADER_SIZE + 4 * RECORD_SIZE
+    message = decode(payload)
+    assert message["version"] == VERSION
+    assert message["seq"] == 0
+    decoded = [(r["ts"], round(r["pressure"] * 10), r["raw"], r["flags"]) for r in message["readings"]]
+    # ticks_ms wraps at 32 bits
+    assert decoded == [(0, -32768, 0, 0), readings[1], (5, 0, 1023, FLAG_LOCKED), readings[3]]
+    assert message["readings"][1]["pump"] and message["readings"][1]["locked"]
+    assert message["readings"][3]["sensor_error"] and not message["readings"][3]["pump"]
+    assert message["readings"][3]["pressure"] == -1.5
+
+
+def test_short_or_unknown_payload():
+    encoder = PayloadEncoder(2)
+    encoder.add(1, 2, 3, 0)
+    encoder.add(4, 5, 6, 0)
+    payload = bytes(encoder.encode())
+    for cut in (0, HEADER_SIZE - 1, HEADER_SIZE, len(payload) - 1):
+        with pytest.raises(ValueError):
+            decode(payload[:cut])
+    with pytest.raises(ValueError):
+        decode(bytes([VERSION + 1]) + payload[1:])
+
+
+def test_batch_fill():
+    encoder = PayloadEncoder(3)
+    assert encoder.encode() is None
+    assert not encoder.add(1, 10, 100, 0)
+    assert not encoder.add(2, 20, 200, 0)
+    assert encoder.add(3, 30, 300, 0)
+    assert [r["ts"] for r in decode(encoder.encode())["readings"]] == [1, 2, 3]
+    # a partial batch, flushed
+    encoder.add(4, 40, 400, 0)
+    message = decode(encoder.encode())
+    assert [r["ts"] for r in message["readings"]] == [4]
+    assert message["seq"] == 1
+    assert encoder.encode() is None
+
+
+def test_batch_overflow_drops_the_full_batch():
+    encoder = PayloadEncoder(2)
+    encoder.add(1, 10, 100, 0)
+    assert encoder.add(2, 20, 200, 0)
+    # the full batch was not taken
+    assert not encoder.add(3, 30, 300, 0)
+    message = decode(encoder.encode())
+    assert [r["ts"] for r in message["readings"]] == [3]
+    assert message["seq"] == 0
+
+
+def test_sequence_wrap():
+    encoder = PayloadEncoder(1)
+    encoder.seq = 0xfffe
+    seqs = []
+    for i in range(3):
+        encoder.add(i, 0, 0, 0)
+        seqs.append(decode(encoder.encode())["seq"])
+    assert seqs == [0xfffe, 0xffff, 0]
+    assert missing(0xfffe, 0xffff) == 0
+    assert missing(0xffff, 0) == 0
+    assert missing(0xfffe, 1) == 2
+    assert missing(5, 9) == 3
@@ -0,0 +1,133 @@
+import os
+
+import network
+import rtc
+from readings import HEADER_SIZE, RECORD_SIZE, ReadingQueue
+from sim import fakes
+
+T0 = 1700000000     # a unix time after the clock was set
+
+
+def drain(queue):
+    items = []
+    while True:
+        item = queue.peek()
+        if item is None:
+            return items
+        items.append(item)
+        queue.pop()
+
+
+def test_ram_only_drops_oldest():
+    queue = ReadingQueue(4)
+    for i in range(6):
+        queue.append(i, T0 + i)
+    assert len(queue) == 4
+    assert queue.dropped == 2
+    assert drain(queue) == [(T0 + i, i) for i in range(2, 6)]
+    assert queue.replayed == 4
+    assert len(queue) == 0
+    queue.pop()
+    assert queue.replayed == 4
+
+
+def test_spill_to_flash_keeps_order(tmp_path):
+    queue = ReadingQueue(4, str(tmp_path / "queue.bin"), 8)
+    for i in range(10):
+        queue.append(i, T0 + i)
+    assert len(queue) == 10
+    assert queue.flash.count == 6
+    assert queue.dropped == 0
+    assert drain(queue) == [(T0 + i, i) for i in range(10)]
+    assert queue.replayed == 10
+
+
+def test_flash_full_drops_oldest(tmp_path):
+    queue = ReadingQueue(2, str(tmp_path / "queue.bin"), 3)
+    for i in range(8):
+        queue.append(i, T0 + i)
+    assert len(queue) == 5
+    assert queue.dropped == 3
+    assert drain(queue) == [(T0 + i, i) for i in range(3, 8)]
+
+
+def test_flash_survives_reboot(tmp_path):
+    path = str(tmp_path / "queue.bin")
+    queue = ReadingQueue(2, path, 8)
+    for i in range(7):
+        queue.append(i, T0 + i)
+    queue.pop()
+    queue.flash.close()
+    # the RAM ring is lost, the flash ring comes back
+    queue = ReadingQueue(2, path, 8)
+    assert len(queue) == 4
+    assert drain(queue) == [(T0 + i, i) for i in range(1, 5)]
+    queue.flash.close()
+    queue = ReadingQueue(2, path, 8)
+    assert len(queue) == 0
+    queue.flash.close()
+
+
+def test_flash_reformatted(tmp_path):
+    path = str(tmp_path / "queue.bin")
+    queue = ReadingQueue(1, path, 8)
+    for i in range(4):
+        queue.append(i, T0 + i)
+    queue.flash.close()
+    # another flash_capacity, the old records are not trusted
+    queue = ReadingQueue(1, path, 16)
+    assert len(queue) == 0
+    queue.flash.close()
+    with open(path, "wb") as f:
+        f.write(b"garbage")
+    queue = ReadingQueue(1, path, 8)
+    assert len(queue) == 0
+    queue.append(5, T0)
+    queue.append(6, T0 + 1)
+    assert drain(queue) == [(T0, 5), (T0 + 1, 6)]
+    queue.flash.close()
+    assert os.path.getsize(path) == HEADER_SIZE + 8 * RECORD_SIZE
+
+
+def test_clock_set_fixes_readings_of_this_boot(tmp_path):
+    path = str(tmp_path / "queue.bin")
+    queue = ReadingQueue(2, path, 8)
+    # an earlier boot that never had the time
+    queue.append(1, 100)
+    queue.append(2, 101)
+    queue.append(3, 102)
+    queue.flash.close()
+    queue = ReadingQueue(2, path, 8)
+    assert queue.flash.old == 1
+    # this boot, the RTC counts from its epoch until NTP answers
+    for i in range(4):
+        queue.append(10 + i, 50 + i)
+    delta = T0 - 60
+    queue.clock_set(delta)
+    # after the clock was set
+    queue.append(20, T0 + 10)
+    queue.clock_set(1)
+    assert drain(queue) == [(0, 1)] + [(T0 - 10 + i, 10 + i) for i in range(4)] + [(T0 + 10, 20)]
+    queue.flash.close()
+
+
+def test_append_stamps_unix_time():
+    queue = ReadingQueue(2)
+    queue.append(7)
+    ts, dbar = queue.peek()
+    # the simulated RTC is not set yet
+    assert (ts, dbar) == (0, 7)
+    queue.pop()
+    board = fakes.BOARD
+    wlan = network.WLAN(network.STA_IF)
+    wlan.active(True)
+    wlan.connect("ssid", "pass")
+    board.clock.advance(board.wifi_connect_s)
+    try:
+        delta = rtc.sync()
+        assert delta == fakes.EPOCH - fakes.Y2K
+        queue.append(8)
+        assert queue.peek() == (fakes.EPOCH + int(board.clock.time()), 8)
+    finally:
+        board.rtc = 0
+        wlan.disconnect()
@@ -0,0 +1,164 @@
+import asyncio
+
+import pytest
+import ustruct as struct
+
+from readings import RECORD, RECORD_SIZE
+from sim import Board, Clock, install, new_event_loop
+from sim.httpd import FakeHttpServer
+from uploader import BatchUploader
+
+T0 = 1700000000
+Y2K = 946684800     # unix time of the esp8266 RTC at boot
+
+
+def run(coro):
+    clock = Clock()
+    install(Board(clock))
+    loop = new_event_loop(clock)
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def records(body):
+    return [struct.unpack_from(RECORD, body, i) for i in range(0, len(body), RECORD_SIZE)]
+
+
+def test_refused_batch_backs_off():
+    async def main():
+        server = FakeHttpServer(status=500)
+        port = await server.start()
+        uploader = BatchUploader("127.0.0.1", port, max_batch=2, backoff_ms=1000, backoff_max_ms=8000)
+        uploader.add(1, T0)
+        uploader.add(2, T0 + 1)
+        task = asyncio.ensure_future(uploader.run())
+        await asyncio.sleep(60)
+        refused = len(server.requests)
+        server.status = 200
+        await asyncio.sleep(10)
+        task.cancel()
+        uploader.close()
+        await server.stop()
+        await asyncio.sleep(0.1)
+        return uploader, server, refused
+
+    uploader, server, refused = run(main())
+    # 1, 2, 4, 8, 8, ... s apart instead of every 250 ms poll
+    assert 8 <= refused <= 11
+    assert uploader.errors == refused
+    assert len(server.requests) == refused + 1
+    assert records(server.requests[-1][2]) == [(T0, 1), (T0 + 1, 2)]
+    assert len(uploader) == 0
+    assert uploader.backoff() == 0
+
+
+def test_readings_before_the_clock_was_set():
+    async def main():
+        server = FakeHttpServer()
+        port = await server.start()
+        uploader = BatchUploader("127.0.0.1", port)
+        # the RTC still counts from 2000-01-01
+        uploader.add(1)
+        uploader.add(2, Y2K + 5)
+        uploader.clock_set(T0 - Y2K)
+        uploader.add(3, T0 + 10)
+        # NTP moved the clock, a reading of the old clock would not be fixed
+        uploader.add(4, Y2K + 6)
+        assert await uploader.flush()
+        uploader.add(5, Y2K + 7)
+        assert await uploader.flush()
+        # already sent with time 0, not moved again
+        uploader.clock_set(100)
+        uploader.close()
+        await server.stop()
+        await asyncio.sleep(0.1)
+        return server
+
+    server = run(main())
+    assert records(server.requests[0][2]) == [(T0, 1), (T0 + 5, 2), (T0 + 10, 3), (0, 4)]
+    assert records(server.requests[1][2]) == [(0, 5)]
+
+
+def _drain(server, count=6):
+    async def main():
+        port = await server.start()
+        uploader = BatchUploader("127.0.0.1", port, max_batch=1, capacity=8, backoff_ms=1000)
+        task = asyncio.ensure_future(uploader.run())
+        for i in range(count):
+            uploader.add(i, T0 + i)
+            await asyncio.sleep(3)
+        alive = not task.done()
+        task.cancel()
+        uploader.close()
+        await server.stop()
+        await asyncio.sleep(0.1)
+        return uploader, alive
+
+    return run(main())
+
+
+def test_chunked_reply():
+    server = FakeHttpServer(reply=b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                                  b"2\r\nok\r\n3;x=1\r\n!!!\r\n0\r\n\r\n")
+    uploader, alive = _drain(server)
+    assert alive
+    assert len(server.requests) == 6
+    assert server.connections == 1
+    assert uploader.errors == 0
+    assert len(uploader) == 0
+
+
+def test_reply_without_length_closes():
+    server = FakeHttpServer(reply=b"HTTP/1.0 200 OK\r\n\r\nok")
+    uploader, alive = _drain(server)
+    assert alive
+    assert len(server.requests) == 6
+    assert server.connections == 6
+    assert uploader.errors == 0
+
+
+@pytest.mark.parametrize("reply", [
+    b"garbage\r\n\r\n",
+    b"HTTP/1.1 two hundred\r\nContent-Length: 0\r\n\r\n",
+    b"HTTP/1.1 200 OK\r\nContent-Length: lots\r\n\r\n",
+    b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n",
+])
+def test_bad_reply_backs_off(reply):
+    server = FakeHttpServer(reply=reply)
+    uploader, alive = _drain(server)
+    # the task lives on and keeps the readings
+    assert alive
+    assert uploader.errors >= 2
+    assert len(uploader) == 6
+
+
+def test_retarget_during_a_request():
+    async def main():
+        server = FakeHttpServer()
+        port = await server.start()
+        server.delay_s = 1
+        uploader = BatchUploader("127.0.0.1", port, max_batch=1)
+        uploader.add(1, T0)
+        task = asyncio.ensure_future(uploader.run())
+        # the first POST is in the middle of its response headers
+        while not server.requests:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.5)
+        uploader.retarget("127.0.0.1", port, "/other")
+        uploader.add(2, T0 + 1)
+        await asyncio.sleep(5)
+        alive = not task.done()
+        task.cancel()
+        uploader.close()
+        await server.stop()
+        await asyncio.sleep(0.1)
+        return uploader, server, alive
+
+    uploader, server, alive = run(main())
+    assert alive
+    assert len(uploader) == 0
+    assert [(r[1], records(r[2])) for r in server.requests][-1] == (b"/other", [(T0 + 1, 2)])
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from sync import SmartWaterSync
+
+
+def tables(**config):
+    zone = dict(name="garden", adc=1, relay=12, **config)
+    sensor = SmartWaterSync(output_channels=(), zones=[zone], sensor_raw_offset=0, max_sensor_pressure=12)
+    return sensor.zones[0].controller.table, sensor.zones[1].controller.table
+
+
+def test_zone_shares_the_board_table():
+    board, zone = tables()
+    assert zone is board
+
+
+def test_zone_max_pressure_alone_gets_its_own_table():
+    board, zone = tables(max_pressure=24)
+    assert zone is not board
+    assert board[1023] == 120
+    assert zone[1023] == 240
+
+
+def test_zone_raw_offset_keeps_the_board_range():
+    board, zone = tables(raw_offset=100)
+    assert zone is not board
+    assert zone[100] == 0
+    assert zone[1023] == 120
+
+
+def test_new_board_constants_refill_the_zone_tables():
+    zones = [dict(name="shared", adc=1, relay=12), dict(name="range", adc=2, relay=13, max_pressure=24),
+             dict(name="own", adc=3, relay=15, raw_offset=100, max_pressure=24)]
+    sensor = SmartWaterSync(output_channels=(), zones=zones, sensor_raw_offset=0, max_sensor_pressure=12)
+    own = list(sensor.zones[3].controller.table)
+    asyncio.run(sensor.apply_config({"sensor_raw_offset": 41, "max_sensor_pressure": 16.0}))
+    board, shared, ranged = (zone.controller.table for zone in sensor.zones[:3])
+    assert shared is board
+    assert (board[41], board[1023]) == (0, 160)
+    # its own range, the new board offset
+    assert (ranged[41], ranged[1023]) == (0, 240)
+    assert list(sensor.zones[3].controller.table) == own
+
+
+def test_curve_refuses_the_sensor_constants():
+    sensor = SmartWaterSync(output_channels=(), calibration_curve=((43, 0), (1023, 12)))
+    table = list(sensor._pressure_table)
+    for changes in ({"sensor_raw_offset": 41}, {"max_sensor_pressure": 16.0}):
+        with pytest.raises(ValueError):
+            asyncio.run(sensor.apply_config(dict(changes, low_pressure=3.0)))
+    assert list(sensor._pressure_table) == table
+    assert (sensor._sensor_raw_offset, sensor._max_sensor_pressure, sensor._low_dbar) == (43, 12, 40)
+    # unchanged values, as in the echo, go through
+    asyncio.run(sensor.apply_config({"sensor_raw_offset": 43, "low_pressure": 3.0}))
+    assert sensor._low_dbar == 30
+
+
+def test_zone_publishing_survives_an_error():
+    zones = [dict(name="garden", adc=1, relay=12)]
+    sensor = SmartWaterSync(output_channels=(), zones=zones, zone_batch_ms=0)
+    sent = []
+
+    async def publish(topic, msg):
+        if not sent:
+            sent.append(None)
+            raise ValueError("broken")
+        sent.append(bytes(msg))
+
+    sensor.mqtt_publish_async = publish
+
+    async def main():
+        task = asyncio.ensure_future(sensor.send_zones())
+        for _ in range(2):
+            sensor.zones[1].pending = 1
+            sensor._zones_ready.set()
+            await asyncio.sleep(0.01)
+        alive = not task.done()
+        task.cancel()
+        return alive
+
+    assert asyncio.run(main())
+    assert len(sent) == 2 and sent[1].startswith(b"garden,")
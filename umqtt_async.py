@@ -0,0 +1,512 @@
+from array import array
+
+import gc
+import uasyncio as asyncio
+import ustruct as struct
+import utime
+
+
+class MQTTException(Exception):
+    pass
+
+
+def _mem_free():
+    return gc.mem_free() if hasattr(gc, "mem_free") else 0
+
+
+def encode_topic(topic):
+    """topic as bytes, done once at config time so publish() does not encode"""
+    if isinstance(topic, str):
+        return topic.encode()
+    return bytes(topic)
+
+
+class MQTTClient:
+    """MQTT 3.1.1 client on top of uasyncio streams
+
+    Incoming packets are handled by a background reader task: subscribed
+    messages are pushed to the callback set with .set_callback(), PUBACK and
+    SUBACK clear their packet id from the in-flight table so publish() never
+    waits for the broker.
+
+    Up to max_inflight QoS 1 frames are kept in per slot buffers until their
+    PUBACK and sent again with the DUP flag when the same client connects
+    again. With keepalive (seconds) set, PINGREQ goes out when nothing was
+    received or nothing was sent for half of it (the broker drops a client
+    that sent nothing for 1.5 times it, MQTT 3.1.1 3.1.2.10) and the
+    connection is closed when nothing comes back within another half.
+
+    Incoming bytes are read with readinto() into one rx_size buffer and every
+    complete packet in it is handled in one pass. The callback gets the topic
+    and the payload as memoryview slices of that buffer: they are only valid
+    during the call, copy what has to be kept. Packets bigger than the buffer
+    are read into a new bytes object.
+
+    ssl is an SSLContext built once (see broker_tls.py), every connect()
+    wraps the connection with it and checks the broker certificate against
+    server_hostname. handshake_ms is the time the last connect took to open
+    the connection, TLS handshake included; tls_heap the heap the TLS
+    session holds after it.
+    """
+
+    def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0,
+                 max_inflight=4, buf_size=128, rx_size=256, ssl=None, server_hostname=None):
+        if port == 0:
+            port = 8883 if ssl is not None else 1883
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.ssl = ssl
+        self.server_hostname = server_hostname
+        self.handshake_ms = 0
+        self.tls_resumed = False
+        self.tls_heap = 0
+        self.pid = 0
+        self.cb = None
+        self.user = user
+        self.pswd = password
+        self.keepalive = keepalive
+        self.lw_topic = None
+        self.lw_msg = None
+        self.lw_qos = 1
+        self.lw_retain = False
+        self.connected = False
+        self._reader = None
+        self._writer = None
+        self._task = None
+        self._ping_task = None
+        self._closed = asyncio.Event()
+        self._slot_free = asyncio.Event()
+        self._last_rx = 0
+        self._last_tx = 0
+        self.pings = 0
+        self.ping_timeouts = 0
+        self.retransmits = 0
+        # packet ids waiting for PUBACK / SUBACK, 0 == free slot
+        self._inflight = array('H', [0] * max_inflight)
+        # QoS 1 frames by slot for retransmission, length 0 == nothing to resend (SUBSCRIBE)
+        self._frames = [bytearray(buf_size) for _ in range(max_inflight)]
+        self._frames_mv = [memoryview(f) for f in self._frames]
+        self._frame_len = array('H', [0] * max_inflight)
+        self._frame_big = [None] * max_inflight     # frames that do not fit the slot buffer
+        # every outgoing frame is built here and sent with a single write
+        self._buf = bytearray(buf_size)
+        self._mv = memoryview(self._buf)
+        self._rx = bytearray(rx_size)
+        self._rx_mv = memoryview(self._rx)
+        self._ack_buf = bytearray(b"\x40\x02\0\0")
+        self._acks = 0                  # PUBACKs written since the last drain
+
+    def _send_str(self, s):
+        if isinstance(s, str):
+            s = s.encode()
+        self._writer.write(struct.pack("!H", len(s)))
+        self._writer.write(s)
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def set_last_will(self, topic, msg, retain=False, qos=1):
+        assert 0 <= qos <= 2
+        assert topic
+        self.lw_topic = topic
+        self.lw_msg = msg
+        self.lw_qos = qos
+        self.lw_retain = retain
+
+    async def connect(self, clean_session=True):
+        if self.ssl is None:
+            started = utime.ticks_ms()
+            self._reader, self._writer = await asyncio.open_connection(self.server, self.port)
+        else:
+            # the handshake needs a few KB in one piece
+            gc.collect()
+            free = _mem_free()
+            started = utime.ticks_ms()
+            self._reader, self._writer = await asyncio.open_connection(
+                self.server, self.port, ssl=self.ssl, server_hostname=self.server_hostname or self.server)
+            self.tls_heap = free - _mem_free() if free else 0
+        self.handshake_ms = utime.ticks_diff(utime.ticks_ms(), started)
+        premsg = bytearray(b"\x10\0\0\0\0\0")
+        msg = bytearray(b"\x04MQTT\x04\x02\0\0")
+
+        sz = 10 + 2 + len(self.client_id)
+        msg[6] = clean_session << 1
+        if self.user is not None:
+            sz += 2 + len(self.user) + 2 + len(self.pswd)
+            msg[6] |= 0xC0
+        if self.keepalive:
+            assert self.keepalive < 65536
+            msg[7] |= self.keepalive >> 8
+            msg[8] |= self.keepalive & 0x00FF
+        if self.lw_topic:
+            sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
+            msg[6] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            msg[6] |= self.lw_retain << 5
+
+        i = 1
+        while sz > 0x7f:
+            premsg[i] = (sz & 0x7f) | 0x80
+            sz >>= 7
+            i += 1
+        premsg[i] = sz
+
+        self._writer.write(premsg[:i + 2])
+        self._writer.write(msg)
+        self._send_str(self.client_id)
+        if self.lw_topic:
+            self._send_str(self.lw_topic)
+            self._send_str(self.lw_msg)
+        if self.user is not None:
+            self._send_str(self.user)
+            self._send_str(self.pswd)
+        await self._writer.drain()
+        resp = await self._reader.readexactly(4)
+        if resp[0] != 0x20 or resp[1] != 0x02:
+            raise MQTTException(resp[0])
+        if resp[3] != 0:
+            raise MQTTException(resp[3])
+        if self.ssl is not None and hasattr(self.ssl, "connected"):
+            # a TLS 1.3 session ticket comes after the handshake, it is there with the CONNACK
+            self.tls_resumed = self.ssl.connected(self._writer)
+        self.connected = True
+        self._closed = asyncio.Event()
+        self._last_rx = self._last_tx = utime.ticks_ms()
+        self._task = asyncio.create_task(self._read_loop())
+        if self.keepalive:
+            if self._ping_task is not None:
+                self._ping_task.cancel()
+            self._ping_task = asyncio.create_task(self._keepalive())
+        await self._resend()
+        return resp[2] & 1
+
+    async def _resend(self):
+        # QoS 1 frames not acked on the previous connection, SUBSCRIBEs are the caller's business
+        inflight = self._inflight
+        sent = False
+        for i in range(len(inflight)):
+            if not inflight[i]:
+                continue
+            big = self._frame_big[i]
+            if big is not None:
+                big[0] |= 0x08
+                self._writer.write(big)
+            elif self._frame_len[i]:
+                self._frames[i][0] |= 0x08
+                self._writer.write(self._frames_mv[i][:self._frame_len[i]])
+            else:
+                inflight[i] = 0
+                continue
+            self.retransmits += 1
+            sent = True
+        if sent:
+            await self._writer.drain()
+            self._last_tx = utime.ticks_ms()
+
+    async def _keepalive(self):
+        half = self.keepalive * 500
+        pinged_at = None
+        while self.connected:
+            await asyncio.sleep_ms(half >> 1)
+            now = utime.ticks_ms()
+            if pinged_at is not None:
+                if utime.ticks_diff(self._last_rx, pinged_at) >= 0:
+                    pinged_at = None
+                elif utime.ticks_diff(now, pinged_at) >= half:
+                    # no PINGRESP, the connection is half open
+                    self.ping_timeouts += 1
+                    self._ping_task = None      # a task can not cancel itself
+                    self.close()
+                    return
+            # a board that only receives must still send within the keepalive
+            if pinged_at is None and (utime.ticks_diff(now, self._last_rx) >= half or
+                                      utime.ticks_diff(now, self._last_tx) >= half):
+                try:
+                    await self.ping()
+                except OSError:
+                    self._ping_task = None
+                    self.close()
+                    return
+                self.pings += 1
+                pinged_at = self._last_tx
+
+    async def disconnect(self):
+        try:
+            self._writer.write(b"\xe0\0")
+            await self._writer.drain()
+        finally:
+            self.close()
+
+    def close(self):
+        """drop the connection without DISCONNECT, the reader task is stopped"""
+        self.connected = False
+        self._closed.set()
+        # publishers waiting for a slot raise OSError
+        self._slot_free.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._ping_task is not None:
+            self._ping_task.cancel()
+            self._ping_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def wait_closed(self, timeout_ms):
+        """return when the connection is lost or after timeout_ms"""
+        if not self.connected:
+            return
+        try:
+            await asyncio.wait_for_ms(self._closed.wait(), timeout_ms)
+        except asyncio.TimeoutError:
+            pass
+
+    async def ping(self):
+        self._writer.write(b"\xc0\0")
+        await self._writer.drain()
+        self._last_tx = utime.ticks_ms()
+
+    def _next_pid(self):
+        self.pid += 1
+        if self.pid > 0xffff:
+            self.pid = 1
+        return self.pid
+
+    async def _track(self, pid):
+        # take a free in-flight slot, wait for an ack only when the table is full, return the slot
+        inflight = self._inflight
+        while True:
+            for i in range(len(inflight)):
+                if inflight[i] == 0:
+                    inflight[i] = pid
+                    return i
+            if not self.connected:
+                raise OSError(-1)
+            self._slot_free.clear()
+            await self._slot_free.wait()
+
+    def _ack(self, pid):
+        inflight = self._inflight
+        for i in range(len(inflight)):
+            if inflight[i] == pid:
+                inflight[i] = 0
+                self._frame_len[i] = 0
+                self._frame_big[i] = None
+                self._slot_free.set()
+                return True
+        return False
+
+    def is_inflight(self, pid):
+        return pid in self._inflight
+
+    def inflight(self):
+        """number of packets waiting for ack"""
+        n = 0
+        for pid in self._inflight:
+            if pid:
+                n += 1
+        return n
+
+    def window_full(self):
+        """True when every in-flight slot waits for its ack, a QoS 1 publish would wait for one"""
+        return self.inflight() >= len(self._inflight)
+
+    def _encode_publish(self, topic, msg, retain, qos, pid, buf=None):
+        """PUBLISH frame into buf (the scratch buffer), return the header length (msg is not counted)"""
+        if buf is None:
+            buf = self._buf
+        sz = 2 + len(topic) + len(msg)
+        if qos > 0:
+            sz += 2
+        assert sz < 2097152
+        buf[0] = 0x30 | qos << 1 | retain
+        i = 1
+        while sz > 0x7f:
+            buf[i] = (sz & 0x7f) | 0x80
+            sz >>= 7
+            i += 1
+        buf[i] = sz
+        i += 1
+        n = len(topic)
+        buf[i] = n >> 8
+        buf[i + 1] = n & 0xff
+        i += 2
+        buf[i:i + n] = topic
+        i += n
+        if qos > 0:
+            buf[i] = pid >> 8
+            buf[i + 1] = pid & 0xff
+            i += 2
+        return i
+
+    async def publish(self, topic, msg, retain=False, qos=0):
+        """send PUBLISH and return its packet id (0 for qos 0), the PUBACK is not awaited
+
+        topic and msg should be bytes (or bytearray / memoryview), encode topics
+        once with encode_topic() instead of passing str on every call.
+        """
+        if not self.connected:
+            raise OSError(-1)
+        assert qos < 2
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(msg, str):
+            msg = msg.encode()
+        if not qos:
+            i = self._encode_publish(topic, msg, retain, 0, 0)
+            n = len(msg)
+            if i + n <= len(self._buf):
+                self._buf[i:i + n] = msg
+                self._writer.write(self._mv[:i + n])
+            else:
+                # payload is bigger than the scratch buffer
+                self._writer.write(self._mv[:i])
+                self._writer.write(msg)
+            await self._writer.drain()
+            self._last_tx = utime.ticks_ms()
+            return 0
+        pid = self._next_pid()
+        slot = await self._track(pid)
+        # built in the slot buffer so it can be sent again after a reconnect
+        buf = self._frames[slot]
+        i = self._encode_publish(topic, msg, retain, qos, pid, buf)
+        n = len(msg)
+        if i + n <= len(buf):
+            buf[i:i + n] = msg
+            self._frame_len[slot] = i + n
+            frame = self._frames_mv[slot][:i + n]
+        else:
+            frame = bytearray(self._frames_mv[slot][:i])
+            frame.extend(msg)
+            self._frame_big[slot] = frame
+        if self.connected:
+            self._writer.write(frame)
+            await self._writer.drain()
+            self._last_tx = utime.ticks_ms()
+        # else the connection went while waiting for a slot, connect() sends the frame
+        return pid
+
+    async def subscribe(self, topic, qos=0, timeout_ms=5000):
+        assert self.cb is not None, "Subscribe callback is not set"
+        if isinstance(topic, str):
+            topic = topic.encode()
+        pid = self._next_pid()
+        await self._track(pid)
+        n = len(topic)
+        struct.pack_into("!BBHH", self._buf, 0, 0x82, 2 + 2 + n + 1, pid, n)
+        self._buf[6:6 + n] = topic
+        self._buf[6 + n] = qos
+        self._writer.write(self._mv[:7 + n])
+        await self._writer.drain()
+        self._last_tx = utime.ticks_ms()
+        # SUBACK is handled by the reader task
+        while self.is_inflight(pid):
+            if timeout_ms <= 0 or not self.connected:
+                self._ack(pid)
+                raise MQTTException("no SUBACK")
+            await asyncio.sleep_ms(10)
+            timeout_ms -= 10
+
+    async def _read_loop(self):
+        rx = self._rx
+        mv = self._rx_mv
+        size = len(rx)
+        start = 0
+        end = 0
+        try:
+            while True:
+                if end == size:
+                    if not start:
+                        # a packet bigger than the buffer
+                        start = end = await self._read_big()
+                        continue
+                    # move the partial packet to the front
+                    n = end - start
+                    rx[:n] = mv[start:end]
+                    start = 0
+                    end = n
+                n = await self._reader.readinto(mv[end:])
+                if not n:
+                    raise OSError(-1)
+                self._last_rx = utime.ticks_ms()
+                end += n
+                start = self._parse(mv, start, end)
+                if self._acks:
+                    self._acks = 0
+                    await self._writer.drain()
+                    self._last_tx = utime.ticks_ms()
+                if start == end:
+                    start = end = 0
+        except (OSError, EOFError, MQTTException):
+            pass
+        finally:
+            self.connected = False
+            self._closed.set()
+            self._slot_free.set()
+
+    async def _read_big(self):
+        """read the rest of the packet that fills the buffer and handle it, return 0"""
+        mv = self._rx_mv
+        i, sz = self._header(mv, 0, len(mv))
+        if i < 0:
+            raise MQTTException("bad remaining length")
+        rest = await self._reader.readexactly(i + sz - len(mv))
+        packet = bytearray(mv)
+        packet.extend(rest)
+        self._last_rx = utime.ticks_ms()
+        self._parse(memoryview(packet), 0, len(packet))
+        if self._acks:
+            self._acks = 0
+            await self._writer.drain()
+            self._last_tx = utime.ticks_ms()
+        return 0
+
+    @staticmethod
+    def _header(mv, i, end):
+        """(body offset, body length) of the packet at i, (0, 0) if the header is not all there"""
+        n = 0
+        sh = 0
+        j = i + 1
+        while j < end:
+            b = mv[j]
+            j += 1
+            n |= (b & 0x7f) << sh
+            if not b & 0x80:
+                return j, n
+            sh += 7
+            if sh > 21:
+                return -1, 0
+        return 0, 0
+
+    def _parse(self, mv, i, end):
+        """handle every complete packet in mv[i:end], return the offset of the first incomplete one"""
+        while i < end:
+            body, sz = self._header(mv, i, end)
+            if body < 0:
+                raise MQTTException("bad remaining length")
+            if not body or body + sz > end:
+                return i
+            op = mv[i]
+            kind = op & 0xf0
+            if kind == 0x30:
+                topic_len = mv[body] << 8 | mv[body + 1]
+                pos = body + 2 + topic_len
+                pid = 0
+                if op & 6:
+                    pid = mv[pos] << 8 | mv[pos + 1]
+                    pos += 2
+                self.cb(mv[body + 2:body + 2 + topic_len], mv[pos:body + sz])
+                if op & 6 == 2:
+                    ack = self._ack_buf
+                    ack[2] = pid >> 8
+                    ack[3] = pid & 0xff
+                    self._writer.write(ack)
+                    self._acks += 1
+            elif kind == 0x40 or kind == 0x90:
+                # PUBACK or SUBACK
+                self._ack(mv[body] << 8 | mv[body + 1])
+                if kind == 0x90 and mv[body + 2] == 0x80:
+                    raise MQTTException(0x80)
+            i = body + sz
+        return i
@@ -0,0 +1,223 @@
+import uasyncio as asyncio
+import ustruct as struct
+import utime
+
+from outputs import Output, DROP_OLDEST
+from readings import RECORD, RECORD_SIZE
+from rtc import SET_AFTER, unix_time
+
+
+class BatchUploader:
+    """Collect readings and POST them in one request over a keep-alive connection
+
+    The body is the packed records ("<Ih": unix time, pressure in
+    deci-bars) back to back, Content-Type application/octet-stream. The
+    time is 0 for a reading taken before NTP set the clock, see rtc.py.
+    A failed or refused request is tried again after backoff_ms, doubled
+    for every failure in a row up to backoff_max_ms. The response body is
+    skipped by Content-Length or chunk sizes; without either the
+    connection is closed after it.
+    """
+
+    def __init__(self, host, port=80, path="/water/pressure", max_batch=16, max_age_ms=60000,
+                 timeout_ms=5000, capacity=0, backoff_ms=1000, backoff_max_ms=60000):
+        self.max_batch = max_batch
+        self.max_age_ms = max_age_ms
+        self.timeout_ms = timeout_ms
+        self.backoff_ms = backoff_ms
+        self.backoff_max_ms = backoff_max_ms
+        self._reader = None
+        self._writer = None
+        self.retarget(host, port, path)
+        # room for the readings that come in while the server is slow or down
+        self.capacity = capacity or 4 * max_batch
+        self._buf = bytearray(self.capacity * RECORD_SIZE)
+        self._mv = memoryview(self._buf)
+        self._count = 0
+        self._sending = 0       # readings in the request that is in flight
+        self._first = 0         # ticks_ms of the oldest pending reading
+        self._failures = 0      # in a row
+        self._retry_at = 0      # ticks_ms, no request before it while failing
+        # counters
+        self.connections = 0
+        self.requests = 0
+        self.dropped = 0
+        self.errors = 0         # requests that failed or were refused
+
+    def retarget(self, host, port, path):
+        """send the next batches to another server or path"""
+        self.host = host
+        self.port = port
+        self.path = path
+        self._head = ("POST {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/octet-stream\r\n"
+                      "Connection: keep-alive\r\nContent-Length: ").format(path, host).encode()
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def add(self, dbar, ts=None):
+        if ts is None:
+            ts = unix_time()
+        if self._count == self.capacity:
+            if self._sending:
+                # the oldest readings are on the wire, drop the new one
+                self.dropped += 1
+                return
+            # could not flush in time, forget the oldest reading
+            self._buf[:-RECORD_SIZE] = self._buf[RECORD_SIZE:]
+            self._count -= 1
+            self.dropped += 1
+        if not self._count:
+            self._first = utime.ticks_ms()
+        struct.pack_into(RECORD, self._buf, self._count * RECORD_SIZE, ts, dbar)
+        self._count += 1
+
+    def clock_set(self, delta):
+        """the RTC moved by delta seconds, move the pending readings taken before it was set"""
+        for i in range(self._sending, self._count):
+            ts, dbar = struct.unpack_from(RECORD, self._buf, i * RECORD_SIZE)
+            if 0 < ts < SET_AFTER:
+                struct.pack_into(RECORD, self._buf, i * RECORD_SIZE, ts + delta, dbar)
+
+    def due(self):
+        if not self._count:
+            return False
+        if self._failures and utime.ticks_diff(self._retry_at, utime.ticks_ms()) > 0:
+            return False
+        return (self._count >= self.max_batch or
+                utime.ticks_diff(utime.ticks_ms(), self._first) >= self.max_age_ms)
+
+    async def run(self, poll_ms=250, sleep_ms=asyncio.sleep_ms):
+        while True:
+            await sleep_ms(poll_ms)
+            if self.due():
+                try:
+                    sent = await self.flush()
+                except Exception:
+                    # OSError, EOFError, TimeoutError, or a retarget() in the middle of the request:
+                    # keep the readings for the next try
+                    self.close()
+                    sent = False
+                if sent:
+                    self._failures = 0
+                else:
+                    self.errors += 1
+                    self._failures += 1
+                    self._retry_at = utime.ticks_add(utime.ticks_ms(), self.backoff())
+
+    def backoff(self):
+        """ms to wait after the current run of failures, 0 when the last request went through"""
+        if not self._failures:
+            return 0
+        delay = self.backoff_ms << min(self._failures - 1, 16)
+        return delay if delay < self.backoff_max_ms else self.backoff_max_ms
+
+    async def _request(self, n):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.wait_for_ms(
+                asyncio.open_connection(self.host, self.port), self.timeout_ms)
+            self.connections += 1
+        # close() may drop them while the request is in flight
+        reader = self._reader
+        writer = self._writer
+        writer.write(self._head)
+        writer.write(b"%d\r\n\r\n" % n)
+        writer.write(self._mv[:n])
+        await writer.drain()
+        return await asyncio.wait_for_ms(self._read_response(reader), self.timeout_ms)
+
+    async def _read_response(self, reader):
+        """the status code, the body is skipped; OSError for a response that cannot be parsed"""
+        status = await reader.readline()
+        if not status:
+            raise OSError(-1)
+        length = None
+        chunked = False
+        keep_alive = True
+        try:
+            code = int(status.split(None, 2)[1])
+            while True:
+                line = await reader.readline()
+                if not line or line == b"\r\n":
+                    break
+                line = line.lower()
+                if line.startswith(b"content-length:"):
+                    length = int(line[15:])
+                elif line.startswith(b"transfer-encoding:") and b"chunked" in line:
+                    chunked = True
+                elif line.startswith(b"connection:") and b"close" in line:
+                    keep_alive = False
+            if chunked:
+                await self._skip_chunks(reader)
+            elif length is None:
+                # the body runs until the server closes the connection
+                keep_alive = False
+            elif length:
+                await reader.readexactly(length)
+        except (ValueError, IndexError):
+            self.close()
+            raise OSError("bad response")
+        if not keep_alive:
+            self.close()
+        return code
+
+    async def _skip_chunks(self, reader):
+        while True:
+            size = int((await reader.readline()).split(b";", 1)[0], 16)
+            if not size:
+                break
+            # the data and its CRLF
+            await reader.readexactly(size + 2)
+        # trailers up to the empty line
+        while True:
+            line = await reader.readline()
+            if not line or line == b"\r\n":
+                return
+
+    async def flush(self):
+        """send pending readings, True when the server took them, they are kept if it does not answer with 2xx"""
+        sent = self._count
+        n = sent * RECORD_SIZE
+        if not n:
+            return True
+        for i in range(sent):
+            ts, dbar = struct.unpack_from(RECORD, self._buf, i * RECORD_SIZE)
+            if ts < SET_AFTER:
+                # taken before the clock was set and it still is not
+                struct.pack_into(RECORD, self._buf, i * RECORD_SIZE, 0, dbar)
+        self._sending = sent
+        try:
+            try:
+                code = await self._request(n)
+            except (OSError, EOFError, asyncio.TimeoutError):
+                # the server may have closed an idle keep-alive connection: reconnect once
+                self.close()
+                code = await self._request(n)
+        finally:
+            self._sending = 0
+        self.requests += 1
+        if 200 <= code < 300:
+            if self._count > sent:
+                # readings added while the request was in flight
+                self._buf[:-n] = self._buf[n:]
+            self._count -= sent
+            return True
+        return False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+
+class DbOutput(Output):
+    """readings into the BatchUploader buffer, its own task POSTs them"""
+
+    def __init__(self, uploader, size=4):
+        super().__init__(size, DROP_OLDEST)
+        self.uploader = uploader
+
+    async def send(self, ticks, dbar, ev):
+        self.uploader.add(dbar)
@@ -0,0 +1,66 @@
+from array import array
+
+import utime
+
+from controller import TimerLoop
+
+
+class Zone:
+    """One tank: its pump controller (sensor, filter, relay, thresholds), events and topics
+
+    The readings live in the sampler and controller arrays, a zone itself
+    is a handful of references.
+    """
+
+    def __init__(self, name, controller, events, topic, relay_topic, anomaly=None):
+        self.name = name            # bytes
+        self.controller = controller
+        self.events = events
+        self.anomaly = anomaly      # anomaly.CycleMonitor
+        self.topic = topic
+        self.relay_topic = relay_topic
+        self.event_topic = topic + b"/event"
+        self.summary = None         # aggregate.Aggregator when summaries are published
+        self.summary_topics = ()    # <topic>/summary/<window s> per tier
+        self.pending = 0            # event bits not published yet
+        self.alerts = 0             # alert bits of the last published reading
+        # (raw_offset, max_pressure) of its own linear table, None for a constant taken from the board;
+        # None with the board table or a calibration curve
+        self.calibration = None
+
+    def relay_command(self, topic, msg):
+        """CommandRouter handler for the zone relay topic, payload 1 / 0"""
+        self.controller.force(msg[:1] == b"1")
+
+
+class ZoneLoop(TimerLoop):
+    """One control loop for several zones
+
+    Every zone keeps its own adaptive interval (see PumpController),
+    tick() runs the zones that are due and arms the timer for the next one.
+    """
+
+    def __init__(self, zones):
+        self.zones = zones
+        now = utime.ticks_ms()
+        self._due = array('i', [now] * len(zones))     # ticks_ms of the next tick of every zone
+        self.interval_ms = 0
+
+    def tick(self, _=None):
+        try:
+            now = utime.ticks_ms()
+            due = self._due
+            wait = 0x3fffffff
+            for i in range(len(self.zones)):
+                left = utime.ticks_diff(due[i], now)
+                if left <= 0:
+                    controller = self.zones[i].controller
+                    controller.tick()
+                    left = controller.interval_ms
+                    due[i] = utime.ticks_add(now, left)
+                if left < wait:
+                    wait = left
+            self.interval_ms = wait
+        finally:
+            if self._timer is not None:
+                self._arm()